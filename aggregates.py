@@ -0,0 +1,181 @@
+import os
+import sys
+import json
+import argparse
+from datetime import date
+from collections import Counter
+
+
+# Statistics of friends computed while reports are created (instead of re-reading report files):
+# counts by country and city, age histogram, sex ratio and birthdays per month
+# Statistics of chunks, users, processes or separate runs are merged into one summary:
+# python aggregates.py stats/1.json stats/2.json --output stats/total.json
+
+# services.User.user_fields() (services imports this module, so it is not imported here)
+_USER_FIELDS = ('first_name', 'last_name', 'country', 'city', 'birth_date', 'sex')
+
+
+def _sorted_pairs(counter: Counter) -> list[list]:
+    """
+    :param counter: (Counter)
+    :return: (list[list]) [value, count] pairs sorted by count, then by value (the same for any order of merges)
+    """
+    return [[value, count] for value, count in sorted(counter.items(),
+                                                      key=lambda pair: (-pair[1], pair[0] is None, pair[0] or ''))]
+
+
+class FriendsStatistics:
+    """
+    Mergeable statistics of friends. Memory depends only on the number of distinct countries, cities and ages,
+    not on the number of friends, so it can be filled chunk by chunk while the report is written
+    None keys of counters are friends without the value (unknown country, city, sex)
+    """
+
+    def __init__(self, today: date | None = None):
+        """
+        :param today: (date | None) ages are counted at this date (today if None)
+        """
+        self.today = today or date.today()
+        self.number_of_friends = 0
+        self.countries: Counter = Counter()
+        self.cities: Counter = Counter()
+        self.sexes: Counter = Counter()
+        self.ages: Counter = Counter()          # age in years -> number of friends (only birth dates with year)
+        self.birth_months = [0] * 12            # number of friends with birthday in January, February...
+
+    def add_columns(self, columns: dict[str, list]):
+        """
+        Adds friends given by columns (fast path for VkResponseData.columns, counters are filled in C)
+        Statistics of fields missing in columns (not in the fields of the report) are not counted
+        :param columns: (dict[str, list]) 'country', 'city', 'birth_date' ('1998-03-02', '03-02' or None), 'sex'
+                        and other columns of the report (at least one column)
+        """
+        self.number_of_friends += len(next(iter(columns.values())))
+        for name, counter in (('country', self.countries), ('city', self.cities), ('sex', self.sexes)):
+            if name in columns:
+                counter.update(columns[name])
+        today_year, today_month_day = self.today.year, self.today.strftime('%m-%d')
+        birth_months = self.birth_months
+        for birth_date in columns.get('birth_date', ()):
+            if not birth_date:
+                continue
+            birth_months[int(birth_date[-5:-3]) - 1] += 1
+            if len(birth_date) == 10:
+                self.ages[today_year - int(birth_date[:4]) - (birth_date[5:] > today_month_day)] += 1
+
+    def add(self, list_of_users, fields: tuple = _USER_FIELDS):
+        """
+        Adds friends
+        :param list_of_users: (Iterable[User | tuple]) users or tuples of values in the order of fields
+        :param fields: (tuple) names of values of users (User.user_fields() by default)
+        """
+        rows = list(list_of_users)
+        if rows:
+            self.add_columns(dict(zip(fields, zip(*rows))))
+
+    def merge(self, other: 'FriendsStatistics') -> 'FriendsStatistics':
+        """
+        Adds statistics of other friends (of another chunk, user or process)
+        Only statistics counted at the same date can be merged (ages depend on it)
+        :param other: (FriendsStatistics)
+        :return: (FriendsStatistics) self
+        :raises ValueError: if other statistics are counted at another date
+        """
+        if other.today != self.today:
+            raise ValueError(f'Statistics counted at {other.today} can not be merged into statistics counted at '
+                             f'{self.today}')
+        self.number_of_friends += other.number_of_friends
+        self.countries.update(other.countries)
+        self.cities.update(other.cities)
+        self.sexes.update(other.sexes)
+        self.ages.update(other.ages)
+        self.birth_months = [number + other_number for number, other_number
+                             in zip(self.birth_months, other.birth_months)]
+        return self
+
+    def to_dict(self) -> dict:
+        """
+        :return: (dict) json serializable statistics, counters are lists of [value, count] pairs sorted by count
+                 (values can be null)
+        """
+        return {'today': self.today.isoformat(),
+                'number_of_friends': self.number_of_friends,
+                'countries': _sorted_pairs(self.countries),
+                'cities': _sorted_pairs(self.cities),
+                'sexes': _sorted_pairs(self.sexes),
+                'ages': [list(pair) for pair in sorted(self.ages.items())],
+                'birth_months': self.birth_months}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'FriendsStatistics':
+        """
+        :param data: (dict) result of to_dict()
+        :return: (FriendsStatistics)
+        """
+        statistics = cls(date.fromisoformat(data['today']))
+        statistics.number_of_friends = data['number_of_friends']
+        for name in ('countries', 'cities', 'sexes', 'ages'):
+            setattr(statistics, name, Counter({value: count for value, count in data[name]}))
+        statistics.birth_months = list(data['birth_months'])
+        return statistics
+
+    def save(self, path: str):
+        """
+        Writes statistics to the json file (the file is replaced atomically)
+        :param path: (str)
+        """
+        with open(f'{path}.tmp', 'w', encoding='UTF-8') as statistics_file:
+            json.dump(self.to_dict(), statistics_file, ensure_ascii=False, indent=1)
+        os.replace(f'{path}.tmp', path)
+
+    @classmethod
+    def load(cls, path: str) -> 'FriendsStatistics':
+        """
+        :param path: (str) json file written by save()
+        :return: (FriendsStatistics)
+        """
+        with open(path, 'r', encoding='UTF-8') as statistics_file:
+            return cls.from_dict(json.load(statistics_file))
+
+    def format_summary(self, top: int = 10) -> str:
+        """
+        :param top: (int) number of the most common countries and cities
+        :return: (str) human readable summary
+        """
+        def share(number: int) -> str:
+            return f'{number} ({number / self.number_of_friends:.1%})' if self.number_of_friends else '0'
+
+        lines = [f'Friends: {self.number_of_friends}']
+        for title, counter in (('Countries', self.countries), ('Cities', self.cities)):
+            lines.append(f'{title} (top {top} of {len(counter)}):')
+            lines.extend(f'  {value or "unknown"}: {share(count)}' for value, count in counter.most_common(top))
+        lines.append('Sex: ' + ', '.join(f'{value or "unknown"} {share(count)}'
+                                         for value, count in self.sexes.most_common()))
+        decades = Counter()
+        for age, count in self.ages.items():
+            decades[age // 10 * 10] += count
+        lines.append(f'Age (of {sum(self.ages.values())} friends with full birth date): ' +
+                     ', '.join(f'{decade}-{decade + 9} {count}' for decade, count in sorted(decades.items())))
+        lines.append('Birthdays per month: ' + ', '.join(f'{month} {count}'
+                                                          for month, count in enumerate(self.birth_months, 1)))
+        return '\n'.join(lines)
+
+
+def main():
+    argument_parser = argparse.ArgumentParser(description='Merges statistics of friends into one summary')
+    argument_parser.add_argument('paths', nargs='+', help='json files with statistics (--statistics of main/batch)')
+    argument_parser.add_argument('--output', help='write the merged statistics to this json file')
+    argument_parser.add_argument('--top', type=int, default=10, help='number of the most common countries and cities')
+    args = argument_parser.parse_args()
+
+    statistics = FriendsStatistics.load(args.paths[0])
+    for path in args.paths[1:]:
+        statistics.merge(FriendsStatistics.load(path))
+    print(statistics.format_summary(args.top))
+    if args.output:
+        statistics.save(args.output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,222 @@
+import sys
+import asyncio
+from time import monotonic
+from collections import deque
+
+import aiohttp
+from loguru import logger
+
+from metrics import METRICS
+from config import FRIENDS_PER_REQUEST, REQUESTS_PER_SECOND, WORKERS, VK_API_URL, VK_API_VERSION, REQUEST_TIMEOUT, \
+    REPORT_FIELDS
+from services import User, RateLimiter, AdaptiveRateLimiter, RetryPolicy, VkApiError, VkResponseData, TokenPool, \
+    FailedAttempt, create_and_prepare_file, check_report_fields, get_vk_fields, decode_json, check_vk_result, \
+    get_retry_delay
+
+
+# Async version of VkFriendsParser and create_and_fill_vk_friends_report (requires aiohttp)
+
+
+class AsyncVkFriendsParser:
+    """
+    Class for requesting information from VK API friends with asyncio
+    All requests go through one aiohttp session with a pool of keep-alive connections
+    Use as an async context manager: async with AsyncVkFriendsParser(...) as parser: ...
+    Failed requests are retried like in services.VkFriendsParser, with a TokenPool requests are spread over its tokens
+    """
+    def __init__(self, access_token: 'str | TokenPool', vk_user_id: str, rate_limiter: RateLimiter | None = None,
+                 session: aiohttp.ClientSession | None = None, api_url: str = VK_API_URL,
+                 connections_limit: int = WORKERS, retry_policy: RetryPolicy | None = None,
+                 fields: tuple = User.user_fields()):
+        """
+        Creates an object for working with VK API friends
+        :param access_token: (str | TokenPool) one token or a pool of tokens (can be shared between parsers)
+        :param vk_user_id: (str)
+        :param rate_limiter: (RateLimiter | None) if None, parser creates its own AdaptiveRateLimiter,
+                             not used with a TokenPool (tokens of the pool have their own limiters)
+        :param session: (aiohttp.ClientSession | None) session (can be shared between parsers),
+                        if None, parser creates its own session when entering the context
+        :param api_url: (str) base url of VK API methods
+        :param connections_limit: (int) size of the connection pool of the own session
+        :param retry_policy: (RetryPolicy | None) if None, RetryPolicy() with settings from config is used
+        :param fields: (tuple) fields of the report (see services.report_fields), only VK fields needed for them
+                       are requested
+        """
+        if isinstance(access_token, TokenPool):
+            self._token_pool = access_token
+        else:
+            self._token_pool = TokenPool([access_token],
+                                         rate_limiters=[rate_limiter or AdaptiveRateLimiter(REQUESTS_PER_SECOND)])
+        self._vk_user_id = vk_user_id
+        self._retry_policy = retry_policy or RetryPolicy()
+        self._session = session
+        self._is_own_session = session is None
+        self._api_url = api_url
+        self._connections_limit = connections_limit
+        self._vk_fields = get_vk_fields(fields)
+
+    async def __aenter__(self):
+        if self._is_own_session:
+            connector = aiohttp.TCPConnector(limit=self._connections_limit)
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        if self._is_own_session:
+            await self._session.close()
+
+    async def _request_friends_get(self, params: dict) -> dict:
+        """
+        Makes a web request to VK API friends.get, respecting the rate limiter of the token
+        Network errors, HTTP 429/5xx and retryable VK errors are retried with backoff (see services.RetryPolicy),
+        errors of the token (TOKEN_ERROR_CODES) are retried at once with another token of the pool
+        (the same services.check_vk_result and services.get_retry_delay as in services.VkFriendsParser)
+        :param params: (dict) query params without access_token and version
+        :return: (dict) raw vk response data (with a not retryable VK error or the last retryable one)
+        """
+        result = None
+        for attempt in range(self._retry_policy.attempts):
+            token, delay = self._token_pool.reserve()
+            METRICS.observe('rate_limiter_wait_seconds', delay)
+            await asyncio.sleep(delay)
+            METRICS.increment('vk_requests_total', method='friends.get')
+            request_params = {**params, 'access_token': token.access_token, 'v': VK_API_VERSION}
+            try:
+                start = monotonic()
+                async with self._session.get(f'{self._api_url}friends.get', params=request_params,
+                                             timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)) as vk_response:
+                    vk_response.raise_for_status()
+                    body = await vk_response.read()
+                METRICS.observe('vk_request_seconds', monotonic() - start, method='friends.get')
+                METRICS.increment('vk_received_bytes_total', len(body), method='friends.get')
+                result = decode_json(body)
+                if not isinstance(result, dict):          # 'null' or a list is not a response of VK API
+                    raise ValueError(f'Response is not a json object: {type(result).__name__}')
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as Ex:
+                result = None
+                failure = FailedAttempt(f'{type(Ex).__name__}: {Ex}', is_throttled=getattr(Ex, 'status', None) == 429)
+            else:
+                failure = check_vk_result(self._token_pool, token, self._retry_policy, 'friends.get', result)
+                if failure is None:
+                    return result
+            delay = get_retry_delay(self._token_pool, token, self._retry_policy, 'friends.get', attempt, failure)
+            if delay:
+                await asyncio.sleep(delay)
+        if result is None:
+            raise VkApiError(f'Request to friends.get failed after {self._retry_policy.attempts} attempts: '
+                             f'{failure.error}')
+        return result
+
+    async def get_number_of_friends(self) -> int:
+        """
+        Function makes a web request to VK API friends
+        Function to get the number of friends of user (with user_id)
+        :return: (int) number of friends of user (with user_id)
+        """
+        vk_response = None
+        try:
+            vk_response = await self._request_friends_get({'user_id': self._vk_user_id})
+            result = int(vk_response['response']['count'])
+        except Exception as Ex:
+            print('''An error occurred while getting the number of friends.
+                  Possibly incorrect access_token/user_id entered or access closed.''', file=sys.stderr)
+            logger.error(f'An error occurred while getting the number of friends. '
+                         f'Possibly incorrect access_token/user_id entered or access closed. : \n Error: {Ex}')
+            if vk_response and 'error' in vk_response:
+                print(f'Vk error: {vk_response["error"]["error_msg"]}', file=sys.stderr)
+                logger.error(f'Vk error: {vk_response["error"]["error_msg"]}')
+                raise VkApiError(vk_response['error']['error_msg'], vk_response['error'].get('error_code')) from Ex
+            raise VkApiError(f'Can not get the number of friends: {Ex}') from Ex
+        else:
+            logger.info('Number of friends received successfully')
+            return result
+
+    async def get_info_about_friends(self, offset: int, count: int) -> dict:
+        """
+        Function makes a web request to VK API
+        Function to get the information about friends of user (with user_id)
+        :param offset: (int) query shift for pagination
+        :param count: (count)
+        :return: (dict) raw vk response data
+        """
+        params = {'user_id': self._vk_user_id,
+                  'order': 'name',
+                  'fields': self._vk_fields,
+                  'offset': offset,
+                  'count': count}
+        try:
+            result = await self._request_friends_get(params)
+            if 'error' in result:
+                raise ValueError(f'VK error: {result["error"]["error_msg"]}')
+        except Exception as Ex:
+            print('An error occurred while getting friends list with information. '
+                  'Possibly incorrect access_token/user_id entered or access closed.', file=sys.stderr)
+            logger.error(f'An error occurred while getting friends list with information. '
+                         f'Possibly incorrect access_token/user_id entered or access closed. : \n Error {Ex}')
+            raise VkApiError(f'Can not get friends list with information: {Ex}') from Ex
+        else:
+            logger.info('Friends list with information received successfully')
+            return result
+
+
+async def async_create_and_fill_vk_friends_report(access_token, vk_user_id, format_report_file, path_of_report_file,
+                                                  concurrency: int = WORKERS, api_url: str = VK_API_URL,
+                                                  fields: tuple = REPORT_FIELDS):
+    """
+    Async analog of services.create_and_fill_vk_friends_report
+    Chunks of friends are requested by tasks, limited by RateLimiter (REQUESTS_PER_SECOND) of every token. While the
+    next chunks are downloading, the received chunks are parsed and written to the report file in offset order (in
+    a thread, so the event loop keeps downloading), the report stays sorted by name
+    No more than "concurrency" chunks are requested or wait to be written at the same time (a sliding window),
+    so memory does not depend on the number of friends
+    :param access_token: (str | TokenPool) one token or a pool of tokens
+    :param vk_user_id: (str)
+    :param format_report_file: (str)
+    :param path_of_report_file: (str)
+    :param concurrency: (int) max number of chunks requested or waiting to be written at the same time
+    :param api_url: (str) base url of VK API methods
+    :param fields: (tuple | str) fields of the report (see services.report_fields)
+    :raises VkApiError: if requests fail or the response of VK can not be parsed
+    """
+    fields = check_report_fields(fields)
+    with create_and_prepare_file(format_report_file, path_of_report_file, owner_id=vk_user_id,
+                                 fields=fields) as report_file:
+        rate_limiter = AdaptiveRateLimiter(REQUESTS_PER_SECOND)
+        async with AsyncVkFriendsParser(access_token, vk_user_id, rate_limiter=rate_limiter, api_url=api_url,
+                                        connections_limit=concurrency, fields=fields) as parser:
+            number_of_friends = await parser.get_number_of_friends()
+            friends_per_request = FRIENDS_PER_REQUEST   # number friends at one "chunk"
+            number_of_requests = number_of_friends//friends_per_request + 1
+            offsets = iter(range(0, number_of_requests * friends_per_request, friends_per_request))
+            tasks: deque[asyncio.Task] = deque()
+
+            def request_next_chunk():
+                offset = next(offsets, None)
+                if offset is not None:
+                    tasks.append(asyncio.create_task(parser.get_info_about_friends(offset=offset,
+                                                                                   count=friends_per_request)))
+
+            def parse_chunk(resp_data: dict) -> list[User]:
+                with METRICS.time('parse_seconds'):
+                    return VkResponseData(resp_data, fields).list_of_users    # get information about friends
+
+            def write_chunk(list_of_friends: list[User]):
+                with METRICS.time('report_write_seconds', report_file=type(report_file).__name__):
+                    report_file.add(list_of_friends)      # save information about friends to file
+
+            for _ in range(concurrency):
+                request_next_chunk()
+            try:
+                while tasks:
+                    resp_data = await tasks.popleft()
+                    request_next_chunk()                  # the window moves when the first chunk is taken
+                    try:
+                        list_of_friends = await asyncio.to_thread(parse_chunk, resp_data)
+                    except Exception as Ex:
+                        print(f'An error occurred while parsing vk response data: {Ex}', file=sys.stderr)
+                        logger.error(f'An error occurred while parsing vk response data: {Ex}')
+                        raise VkApiError(f'Can not parse vk response data: {Ex!r}') from Ex
+                    await asyncio.to_thread(write_chunk, list_of_friends)
+            finally:
+                for task in tasks:
+                    task.cancel()
@@ -0,0 +1,218 @@
+import os
+import sys
+import argparse
+from threading import Lock
+from concurrent.futures import ThreadPoolExecutor
+
+from loguru import logger
+
+from config import ACCESS_TOKENS_ENV, REQUESTS_PER_SECOND, WORKERS, VK_API_URL, USE_EXECUTE, RESPONSE_CACHE_TTL, \
+    RESPONSE_CACHE_MAX_SIZE, FRIENDS_PER_REQUEST, REPORT_FIELDS, STREAM_JSON_ITEMS
+from services import User, available_formats, available_compressions, create_and_fill_vk_friends_report, \
+    create_session, get_report_file_name, check_report_fields, report_fields, AdaptiveRateLimiter, TokenPool, \
+    read_access_tokens
+from cache import ResponseCache
+from delta import create_delta_report, get_path_of_snapshot_file
+from aggregates import FriendsStatistics
+from metrics import print_metrics_summary
+
+
+# Creating reports for many VK user ids in one run:
+# python batch.py user_ids.txt --format csv --output-dir reports --workers 4
+
+
+def read_user_ids(lines) -> list[str]:
+    """
+    Reads VK user ids (one per line) skipping empty lines, comments (#...) and repeated ids
+    :param lines: (Iterable[str]) for example opened file or sys.stdin
+    :return: (list[str]) user ids in the order of the first appearance
+    """
+    user_ids: list[str] = []
+    seen: set[str] = set()
+    for line in lines:
+        user_id = line.split('#')[0].strip()
+        if user_id and user_id not in seen:
+            seen.add(user_id)
+            user_ids.append(user_id)
+    return user_ids
+
+
+def run_batch(access_token: 'str | TokenPool', user_ids: list[str], format_report_file: str, output_directory: str,
+              workers: int = WORKERS, api_url: str = VK_API_URL,
+              use_execute: bool = USE_EXECUTE, cache: ResponseCache | None = None,
+              resume: bool = False, delta: bool = False, check_changes: bool = False,
+              friends_per_request: int = FRIENDS_PER_REQUEST,
+              compression: str | None = None,
+              statistics: FriendsStatistics | None = None,
+              fields: tuple = REPORT_FIELDS,
+              stream_items: bool = STREAM_JSON_ITEMS) -> dict[str, str | None]:
+    """
+    Creates a report for every user id ("output_directory/<user_id>.<format>"), sqlite reports of all users are
+    written to one database "output_directory/friends.sqlite" (rows are keyed by owner_id)
+    Reports are created by a pool of threads, all threads share one keep-alive session and one RateLimiter,
+    so together they do not exceed REQUESTS_PER_SECOND for the access token (and slow down together when VK throttles)
+    With a TokenPool the threads share the pool, so the speed grows with the number of tokens (use as many workers)
+    An error in one report does not stop the others
+    :param access_token: (str | TokenPool) one token or a pool of tokens
+    :param user_ids: (list[str])
+    :param format_report_file: (str) one of available_formats
+    :param output_directory: (str)
+    :param workers: (int) number of reports created at the same time
+    :param api_url: (str) base url of VK API methods
+    :param use_execute: (bool) request chunks with VK API method "execute" (see create_and_fill_vk_friends_report)
+    :param cache: (ResponseCache | None) cache of VK responses shared by all reports
+    :param resume: (bool) continue unfinished reports from their checkpoints (see create_and_fill_vk_friends_report)
+    :param delta: (bool) create delta reports from snapshots of the previous run (see delta.create_delta_report)
+    :param check_changes: (bool) delta reports request information about all friends to find changed friends
+    :param friends_per_request: (int) number friends at one chunk
+    :param compression: (str | None) 'gzip' or 'zstd' - reports are compressed while they are written
+    :param statistics: (FriendsStatistics | None) statistics of friends of all created reports are merged into it
+    :param fields: (tuple | str) fields of reports (see services.report_fields), delta reports have User.user_fields()
+    :param stream_items: (bool) chunks are parsed incrementally from bodies of responses
+                         (see create_and_fill_vk_friends_report)
+    :return: (dict[str, str | None]) user id -> None if the report is created, otherwise error message
+    """
+    fields = check_report_fields(fields)
+    if delta and fields != User.user_fields():
+        raise ValueError(f'Delta reports have only fields {", ".join(User.user_fields())}')
+    os.makedirs(output_directory, exist_ok=True)
+    rate_limiter = AdaptiveRateLimiter(REQUESTS_PER_SECOND)
+    session = create_session(workers)
+    statistics_lock = Lock()
+
+    def create_report(user_id: str) -> str | None:
+        path_report_file = os.path.join(output_directory, user_id)
+        path_of_snapshot_file = get_path_of_snapshot_file(path_report_file)
+        if format_report_file == 'sqlite':        # one database for all users, rows are keyed by owner_id
+            path_report_file = os.path.join(output_directory, 'friends')
+        user_statistics = FriendsStatistics(statistics.today) if statistics is not None else None
+        try:
+            if delta:
+                create_delta_report(access_token, user_id, format_report_file, path_report_file,
+                                    check_changes=check_changes, rate_limiter=rate_limiter, session=session,
+                                    api_url=api_url, cache=cache, compression=compression,
+                                    path_of_snapshot_file=path_of_snapshot_file, statistics=user_statistics)
+            else:
+                create_and_fill_vk_friends_report(access_token, user_id, format_report_file, path_report_file,
+                                                  workers=1, rate_limiter=rate_limiter, session=session,
+                                                  api_url=api_url, use_execute=use_execute, cache=cache,
+                                                  resume=resume, friends_per_request=friends_per_request,
+                                                  compression=compression, statistics=user_statistics,
+                                                  fields=fields, stream_items=stream_items)
+        except (Exception, SystemExit) as Ex:      # VK errors and broken responses should not stop other reports
+            logger.error(f'Report for user {user_id} failed: {Ex!r}')
+            return repr(Ex)
+        logger.info(f'Report successfully created: '
+                    f'{get_report_file_name(path_report_file, format_report_file, compression)}')
+        if statistics is not None:
+            with statistics_lock:
+                statistics.merge(user_statistics)
+        return None
+
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        results = dict(zip(user_ids, executor.map(create_report, user_ids)))
+    session.close()
+    return results
+
+
+def print_summary(results: dict[str, str | None]):
+    """
+    Prints status of every report and the number of successful and failed reports
+    :param results: (dict[str, str | None]) result of run_batch
+    """
+    print('---------------------------------------------------------------')
+    for user_id, error in results.items():
+        print(f'{user_id}: {"OK" if error is None else f"FAILED ({error})"}')
+    number_of_failed = sum(error is not None for error in results.values())
+    print('---------------------------------------------------------------')
+    print(f'Reports created: {len(results) - number_of_failed}, failed: {number_of_failed}')
+    logger.info(f'Batch finished. Reports created: {len(results) - number_of_failed}, failed: {number_of_failed}')
+
+
+def main():
+    argument_parser = argparse.ArgumentParser(description='Creates VK friends reports for many user ids')
+    argument_parser.add_argument('user_ids_file', help='file with VK user ids (one per line), "-" to read stdin')
+    argument_parser.add_argument('--format', default='csv', choices=available_formats)
+    argument_parser.add_argument('--output-dir', default='reports')
+    argument_parser.add_argument('--token-file', help='file with access tokens (one per line), several tokens make '
+                                                      'reports faster (each token has its own rate limit)')
+    argument_parser.add_argument('--compression', choices=available_compressions,
+                                 help='compress reports while they are written (".gz", ".zst")')
+    argument_parser.add_argument('--fields', default=','.join(REPORT_FIELDS),
+                                 help='comma separated fields of reports (only VK fields needed for them are '
+                                      f'requested): {", ".join(report_fields)}')
+    argument_parser.add_argument('--workers', type=int, default=max(WORKERS, 4),
+                                 help='number of reports created at the same time')
+    argument_parser.add_argument('--page-size', type=int, default=FRIENDS_PER_REQUEST,
+                                 help='number of friends at one request (1-5000)')
+    argument_parser.add_argument('--stream-json', action='store_true', default=STREAM_JSON_ITEMS,
+                                 help='parse friends one by one from bodies of VK responses (less memory for big '
+                                      'pages)')
+    argument_parser.add_argument('--execute', action='store_true', default=USE_EXECUTE,
+                                 help='request up to 25 chunks of friends in one web request with VK API "execute"')
+    argument_parser.add_argument('--cache-dir', help='directory of the cache of VK responses (no cache by default)')
+    argument_parser.add_argument('--cache-ttl', type=float, default=RESPONSE_CACHE_TTL,
+                                 help='time to live of cached responses in seconds')
+    argument_parser.add_argument('--cache-max-size', type=int, default=RESPONSE_CACHE_MAX_SIZE,
+                                 help='max size of the cache in bytes')
+    argument_parser.add_argument('--refresh-cache', action='store_true',
+                                 help='do not take responses from the cache, but save new responses to it')
+    argument_parser.add_argument('--resume', action='store_true',
+                                 help='continue reports interrupted by the previous run from their checkpoints')
+    argument_parser.add_argument('--delta', action='store_true',
+                                 help='request only ids of friends and information about new friends, write added, '
+                                      'removed and changed friends (full reports are created from snapshots)')
+    argument_parser.add_argument('--check-changes', action='store_true',
+                                 help='with --delta, request information about all friends to find changed friends')
+    argument_parser.add_argument('--statistics',
+                                 help='write statistics of friends of all reports (countries, cities, ages, sex, '
+                                      'birthdays per month) to this json file and print them')
+    argument_parser.add_argument('--metrics-file', help='write metrics of the run to this file')
+    argument_parser.add_argument('--metrics-format', default='json', choices=('json', 'prometheus'))
+    args = argument_parser.parse_args()
+    try:
+        fields = check_report_fields(args.fields)
+    except ValueError as Ex:
+        argument_parser.error(str(Ex))
+    if args.delta and fields != User.user_fields():
+        argument_parser.error(f'--delta reports have only fields {",".join(User.user_fields())}')
+    if not 1 <= args.page_size <= 5000:                 # VK allows up to 5000 friends in one request
+        argument_parser.error('--page-size should be from 1 to 5000')
+
+    # from the file, from the environment (ACCESS_TOKENS or ACCESS_TOKEN) or from file "config.py"
+    access_tokens = read_access_tokens(args.token_file)
+    if not access_tokens:
+        argument_parser.error(f'There is no access token: use --token-file or the environment variable '
+                              f'{ACCESS_TOKENS_ENV}')
+    access_token = access_tokens[0] if len(access_tokens) == 1 else TokenPool(access_tokens)
+    if args.user_ids_file == '-':
+        user_ids = read_user_ids(sys.stdin)
+    else:
+        with open(args.user_ids_file, 'r', encoding='UTF-8') as user_ids_file:
+            user_ids = read_user_ids(user_ids_file)
+    logger.info(f'Batch started for {len(user_ids)} users')
+
+    cache = None
+    if args.cache_dir:
+        cache = ResponseCache(args.cache_dir, ttl=args.cache_ttl, max_size=args.cache_max_size,
+                              bypass=args.refresh_cache)
+    statistics = FriendsStatistics() if args.statistics else None
+    results = run_batch(access_token, user_ids, args.format, args.output_dir, args.workers, use_execute=args.execute,
+                        cache=cache, resume=args.resume, delta=args.delta, check_changes=args.check_changes,
+                        friends_per_request=args.page_size, compression=args.compression, statistics=statistics,
+                        fields=args.fields, stream_items=args.stream_json)
+    print_summary(results)
+    if statistics is not None:
+        statistics.save(args.statistics)
+        print('---------------------------------------------------------------')
+        print(statistics.format_summary())
+    if cache is not None:
+        print(f'Response cache: {cache.hits} hits, {cache.misses} misses')
+        logger.info(f'Response cache: {cache.hits} hits, {cache.misses} misses')
+    print_metrics_summary(path=args.metrics_file, output_format=args.metrics_format)
+    return 0 if all(error is None for error in results.values()) else 1
+
+
+if __name__ == '__main__':
+    logger.add(open('file.log', 'w'), format='{time} {level} {message}')
+    sys.exit(main())
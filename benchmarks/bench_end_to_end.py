@@ -0,0 +1,116 @@
+import os
+import sys
+import json
+import argparse
+import resource
+import tempfile
+from time import perf_counter
+from multiprocessing import get_context
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services import available_formats, create_and_fill_vk_friends_report, RateLimiter     # noqa: E402
+from fake_vk_server import FakeVkServer                                                       # noqa: E402
+
+
+# End to end benchmark: create_and_fill_vk_friends_report for every format against the local fake VK API server
+# Every run is made in a new process, so peak RSS belongs to this run only
+# python benchmarks/bench_end_to_end.py --friends 100000 --latency 0.05 --output results.json
+# python benchmarks/bench_end_to_end.py --friends 100000 --latency 0.05 --baseline results.json
+
+
+def run_report(api_url: str, format_report_file: str, requests_per_second: float, workers: int,
+               use_execute: bool) -> dict:
+    """
+    Creates the report in a temporary directory (runs in a separate process)
+    :return: (dict) seconds, peak_rss_mb, size_mb and busy time of the pipeline stages
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        path_report_file = os.path.join(directory, 'report')
+        start = perf_counter()
+        timers = create_and_fill_vk_friends_report('token', '1', format_report_file, path_report_file,
+                                                   workers=workers, rate_limiter=RateLimiter(requests_per_second),
+                                                   api_url=api_url, use_execute=use_execute)
+        seconds = perf_counter() - start
+        size = os.path.getsize(f'{path_report_file}.{format_report_file}')
+    return {'seconds': seconds,
+            'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,     # ru_maxrss is in kB
+            'size_mb': size / 2**20,
+            **{f'{name}_busy_seconds': timer.busy for name, timer in timers.items()}}
+
+
+def find_regressions(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """
+    Compares results with the baseline (results of a previous run)
+    :param results: (dict) format -> result
+    :param baseline: (dict) format -> result
+    :param tolerance: (float) allowed relative degradation, for example 0.2
+    :return: (list[str]) descriptions of regressions
+    """
+    regressions = []
+    for format_report_file, result in results.items():
+        old_result = baseline.get(format_report_file)
+        if old_result is None:
+            continue
+        if result['friends_per_second'] < old_result['friends_per_second'] * (1 - tolerance):
+            regressions.append(f'{format_report_file}: friends/second {result["friends_per_second"]:.0f} '
+                               f'< {old_result["friends_per_second"]:.0f}')
+        if result['peak_rss_mb'] > old_result['peak_rss_mb'] * (1 + tolerance):
+            regressions.append(f'{format_report_file}: peak RSS {result["peak_rss_mb"]:.1f} MB '
+                               f'> {old_result["peak_rss_mb"]:.1f} MB')
+        if result['requests'] > old_result['requests']:
+            regressions.append(f'{format_report_file}: requests {result["requests"]} > {old_result["requests"]}')
+    return regressions
+
+
+def main():
+    argument_parser = argparse.ArgumentParser(description='End to end benchmark with the fake VK API server')
+    argument_parser.add_argument('--friends', type=int, default=100_000, help='number of friends of the user')
+    argument_parser.add_argument('--latency', type=float, default=0.0, help='latency of the server in seconds')
+    argument_parser.add_argument('--server-requests-per-second', type=float, default=None,
+                                 help='the server throttles requests above this limit (VK error 6)')
+    argument_parser.add_argument('--requests-per-second', type=float, default=1000,
+                                 help='limit of the client (RateLimiter)')
+    argument_parser.add_argument('--workers', type=int, default=1)
+    argument_parser.add_argument('--execute', action='store_true', help='request chunks with VK API "execute"')
+    argument_parser.add_argument('--formats', nargs='+', default=list(available_formats), choices=available_formats)
+    argument_parser.add_argument('--output', help='write results to this json file')
+    argument_parser.add_argument('--baseline', help='json file with results of a previous run to compare with')
+    argument_parser.add_argument('--tolerance', type=float, default=0.2, help='allowed relative degradation')
+    args = argument_parser.parse_args()
+
+    number_of_active_friends = sum(1 for number in range(args.friends) if number % 97 != 96)   # see make_fake_friend
+    results = {}
+    print(f'{args.friends} friends, latency {args.latency} s, workers {args.workers}, execute {args.execute}')
+    print(f'{"format":<9}{"time, s":>9}{"friends/s":>11}{"peak RSS, MB":>14}{"requests":>10}{"size, MB":>10}'
+          f'{"fetch, s":>10}{"parse, s":>10}{"write, s":>10}')
+    with FakeVkServer(args.friends, requests_per_second=args.server_requests_per_second,
+                      latency=args.latency) as server:
+        for format_report_file in args.formats:
+            number_of_requests = server.number_of_requests
+            with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+                result = executor.submit(run_report, server.url, format_report_file, args.requests_per_second,
+                                         args.workers, args.execute).result()
+            result['requests'] = server.number_of_requests - number_of_requests
+            result['friends_per_second'] = number_of_active_friends / result['seconds']
+            results[format_report_file] = result
+            print(f'{format_report_file:<9}{result["seconds"]:>9.2f}{result["friends_per_second"]:>11.0f}'
+                  f'{result["peak_rss_mb"]:>14.1f}{result["requests"]:>10}{result["size_mb"]:>10.1f}'
+                  f'{result["fetch_busy_seconds"]:>10.2f}{result["parse_busy_seconds"]:>10.2f}'
+                  f'{result["write_busy_seconds"]:>10.2f}')
+
+    if args.output:
+        with open(args.output, 'w', encoding='UTF-8') as output_file:
+            json.dump(results, output_file, indent=2)
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='UTF-8') as baseline_file:
+            regressions = find_regressions(results, json.load(baseline_file), args.tolerance)
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
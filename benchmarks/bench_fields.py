@@ -0,0 +1,42 @@
+import os
+import sys
+import json
+import argparse
+from time import perf_counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services import User, VkResponseData, get_vk_fields, report_fields        # noqa: E402
+from fake_vk_server import make_fake_friend                                     # noqa: E402
+
+
+# Compares response bytes, json decoding and parsing of friends for different projections of report fields
+# python benchmarks/bench_fields.py --friends 100000
+
+
+def main():
+    argument_parser = argparse.ArgumentParser(description='Benchmark of report field projections')
+    argument_parser.add_argument('--friends', type=int, default=100_000)
+    argument_parser.add_argument('--repeat', type=int, default=3)
+    args = argument_parser.parse_args()
+
+    for title, fields in (('all fields', tuple(report_fields)), ('default fields', User.user_fields()),
+                          ('id, first_name', ('id', 'first_name'))):
+        vk_fields = {field.strip() for field in get_vk_fields(fields).split(',')}
+        body = json.dumps({'response': {'count': args.friends,
+                                        'items': [make_fake_friend(number, vk_fields)
+                                                  for number in range(args.friends)]}}, ensure_ascii=False)
+        decode_times, parse_times = [], []
+        for _ in range(args.repeat):
+            start = perf_counter()
+            vk_data = json.loads(body)
+            decode_times.append(perf_counter() - start)
+            start = perf_counter()
+            VkResponseData(vk_data, fields)
+            parse_times.append(perf_counter() - start)
+        print(f'{title:<20}{len(body.encode("UTF-8")) / 2 ** 20:>8.1f} MiB'
+              f'{min(decode_times):>8.3f} s decode{min(parse_times):>8.3f} s parse')
+
+
+if __name__ == '__main__':
+    main()
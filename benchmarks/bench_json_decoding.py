@@ -0,0 +1,47 @@
+import os
+import sys
+import json
+import argparse
+import tracemalloc
+from time import perf_counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services import VkResponseData, decode_json, orjson         # noqa: E402
+from fake_vk_server import make_fake_friend                      # noqa: E402
+
+
+# Compares decoding of pages of friends: json.loads of the text (as requests.Response.json() does), decode_json
+# of bytes (orjson if it is installed) and incremental parsing of the body by VkResponseData (stream_items)
+# Peak memory is measured by tracemalloc (tracing slows down the code, so time and memory are measured separately)
+# python benchmarks/bench_json_decoding.py --friends 5000
+
+
+def main():
+    argument_parser = argparse.ArgumentParser(description='Benchmark of decoding of VK responses')
+    argument_parser.add_argument('--friends', type=int, default=5000, help='friends at one page (VK allows 5000)')
+    argument_parser.add_argument('--repeat', type=int, default=5)
+    args = argument_parser.parse_args()
+
+    body = json.dumps({'response': {'count': args.friends,
+                                    'items': [make_fake_friend(number) for number in range(args.friends)]}},
+                      ensure_ascii=False).encode('UTF-8')
+    print(f'Page of {args.friends} friends: {len(body) / 2 ** 20:.1f} MiB, orjson is '
+          f'{"installed" if orjson is not None else "not installed"}')
+    for method, convert in (('json.loads(text)', lambda data: VkResponseData(json.loads(data.decode('UTF-8')))),
+                            ('decode_json(bytes)', lambda data: VkResponseData(decode_json(data))),
+                            ('stream items', VkResponseData)):
+        times = []
+        for _ in range(args.repeat):
+            start = perf_counter()
+            users = convert(body).list_of_users
+            times.append(perf_counter() - start)
+        tracemalloc.start()
+        convert(body)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f'{method:<22}{min(times):>8.3f} s{peak / 2 ** 20:>8.1f} MiB peak  ({len(users)} users)')
+
+
+if __name__ == '__main__':
+    main()
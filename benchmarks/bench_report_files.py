@@ -0,0 +1,117 @@
+import os
+import sys
+import csv
+import json
+import argparse
+import tempfile
+from time import perf_counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services import User, available_formats, create_and_prepare_file     # noqa: E402
+
+
+# Compares writing of report files: opening the file for every chunk (as it was before)
+# and one open file with a big write buffer (ReportFile now)
+# python benchmarks/bench_report_files.py --rows 1000000 --chunk 1000
+
+
+def make_users(number_of_users: int) -> list[User]:
+    """
+    Creates synthetic users
+    :param number_of_users: (int)
+    :return: (list[User])
+    """
+    users = []
+    for number in range(number_of_users):
+        birth_date = f'19{number % 100:02d}-{number % 12 + 1:02d}-{number % 28 + 1:02d}' if number % 3 else None
+        users.append(User(first_name=f'Name{number}', last_name=f'Surname{number}',
+                          country='Россия' if number % 5 else None, city=f'Город{number % 50}' if number % 5 else None,
+                          birth_date=birth_date, sex='Female' if number % 2 else 'Male'))
+    return users
+
+
+def write_reopening_per_chunk(format_report_file: str, path_report_file: str, chunks: list[list[User]]):
+    """
+    Writes the report the old way: the file is reopened and a new writer is created for every chunk,
+    json is written with one write call per user
+    """
+    path = f'{path_report_file}.{format_report_file}'
+    if format_report_file == 'json':
+        with open(path, 'w', encoding='UTF-8', newline='\n') as json_file:
+            json_file.write('[')
+        for chunk in chunks:
+            with open(path, 'a', encoding='UTF-8', newline='\n') as json_file:
+                for user in chunk:
+                    json_file.write(json.dumps(user.get_dict(), ensure_ascii=False) + ',\n')
+        with open(path, 'a', encoding='UTF-8', newline='\n') as json_file:
+            json_file.write(']')
+        return
+
+    delimiter = '\t' if format_report_file == 'tsv' else ','
+    with open(path, 'w', encoding='UTF-8', newline='') as report_file:
+        csv.writer(report_file, delimiter=delimiter).writerow(User.user_fields())
+    for chunk in chunks:
+        with open(path, 'a', encoding='UTF-8', newline='') as report_file:
+            csv.writer(report_file, delimiter=delimiter).writerows(chunk)
+
+
+def write_with_report_file(format_report_file: str, path_report_file: str, chunks: list[list[User]]):
+    """
+    Writes the report with ReportFile (one open file, buffered writes)
+    """
+    with create_and_prepare_file(format_report_file, path_report_file) as report_file:
+        for chunk in chunks:
+            report_file.add(chunk)
+
+
+def read_io_counters() -> dict[str, int]:
+    """
+    Reads the number of read/write system calls of this process (Linux only)
+    :return: (dict[str, int]) for example {'syscr': 10, 'syscw': 20, ...}, empty dict on other systems
+    """
+    try:
+        with open('/proc/self/io', 'r') as io_file:
+            return {key: int(value) for key, value in (line.split(': ') for line in io_file)}
+    except OSError:
+        return {}
+
+
+def measure(write_function, format_report_file: str, chunks: list[list[User]]) -> tuple[float, int | None, int]:
+    """
+    Runs write_function in a temporary directory
+    :return: (tuple[float, int | None, int]) wall time in seconds, number of write system calls, size of the file
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        path_report_file = os.path.join(directory, 'report')
+        counters_before = read_io_counters()
+        start = perf_counter()
+        write_function(format_report_file, path_report_file, chunks)
+        wall_time = perf_counter() - start
+        counters_after = read_io_counters()
+        syscalls = counters_after['syscw'] - counters_before['syscw'] if counters_after else None
+        size = os.path.getsize(f'{path_report_file}.{format_report_file}')
+    return wall_time, syscalls, size
+
+
+def main():
+    argument_parser = argparse.ArgumentParser(description='Benchmark of report files writing')
+    argument_parser.add_argument('--rows', type=int, default=1_000_000)
+    argument_parser.add_argument('--chunk', type=int, default=1000, help='number of users in one add()')
+    args = argument_parser.parse_args()
+
+    users = make_users(args.rows)
+    chunks = [users[start:start + args.chunk] for start in range(0, len(users), args.chunk)]
+    print(f'{args.rows} users, {len(chunks)} chunks')
+    print(f'{"format":<8}{"method":<22}{"time, s":>10}{"write syscalls":>16}{"size, MB":>10}')
+    for format_report_file in ('csv', 'tsv', 'json'):
+        if format_report_file not in available_formats:
+            continue
+        for method, write_function in (('reopen per chunk', write_reopening_per_chunk),
+                                       ('ReportFile', write_with_report_file)):
+            wall_time, syscalls, size = measure(write_function, format_report_file, chunks)
+            print(f'{format_report_file:<8}{method:<22}{wall_time:>10.2f}{str(syscalls):>16}{size / 2**20:>10.1f}')
+
+
+if __name__ == '__main__':
+    main()
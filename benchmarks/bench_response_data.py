@@ -0,0 +1,68 @@
+import os
+import sys
+import argparse
+from time import perf_counter
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services import User, VkResponseData           # noqa: E402
+from fake_vk_server import make_fake_friend          # noqa: E402
+
+
+# Compares conversion of VK response data to users: friend by friend with strptime (as it was before)
+# and VkResponseData (column by column with cached birth dates)
+# python benchmarks/bench_response_data.py --friends 100000
+
+
+def legacy_list_of_users(vk_data: dict) -> list[User]:
+    """
+    Converts VK response data to users the old way (strptime for every birth date)
+    """
+    def make_title(vk_object):
+        return vk_object.get('title') if vk_object else vk_object
+
+    def make_bd(vk_bd):
+        if not vk_bd:
+            return vk_bd
+        if len(vk_bd.split('.')) == 3:
+            return datetime.strptime(vk_bd, '%d.%m.%Y').isoformat()[:10]
+        elif len(vk_bd.split('.')) == 2:
+            return datetime.strptime(vk_bd + '-2016', '%d.%m-%Y').isoformat()[5:10]
+        return None
+
+    list_of_users = []
+    for friend in vk_data['response']['items']:
+        if friend.get('deactivated'):
+            continue
+        list_of_users.append(User(first_name=friend.get('first_name'), last_name=friend.get('last_name'),
+                                  country=make_title(friend.get('country')), city=make_title(friend.get('city')),
+                                  birth_date=make_bd(friend.get('bdate')),
+                                  sex={1: 'Female', 2: 'Male'}.get(friend['sex'])))
+    return list_of_users
+
+
+def main():
+    argument_parser = argparse.ArgumentParser(description='Benchmark of VK response data conversion')
+    argument_parser.add_argument('--friends', type=int, default=100_000)
+    argument_parser.add_argument('--repeat', type=int, default=3)
+    args = argument_parser.parse_args()
+
+    vk_data = {'response': {'count': args.friends,
+                            'items': [make_fake_friend(number) for number in range(args.friends)]}}
+    for method, convert in (('friend by friend (strptime)', legacy_list_of_users),
+                            ('VkResponseData', lambda data: VkResponseData(data).list_of_users)):
+        times = []
+        for _ in range(args.repeat):
+            start = perf_counter()
+            list_of_users = convert(vk_data)
+            times.append(perf_counter() - start)
+        print(f'{method:<30}{min(times):>8.3f} s  ({len(list_of_users)} users)')
+
+    if legacy_list_of_users(vk_data) != VkResponseData(vk_data).list_of_users:
+        raise AssertionError('VkResponseData result differs from the old conversion')
+    print('Results are identical')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+import os
+import json
+import zlib
+import hashlib
+from time import time
+from threading import Lock
+
+from loguru import logger
+
+from config import RESPONSE_CACHE_TTL, RESPONSE_CACHE_MAX_SIZE
+
+
+class ResponseCache:
+    """
+    On-disk cache of raw VK API responses (for VkFriendsParser)
+    Every response is stored compressed in a separate file, named by the hash of the request (method and params
+    without access_token). Responses older than ttl are not used, when the size of the cache exceeds max_size,
+    the least recently used responses are removed
+    """
+
+    def __init__(self, directory: str, ttl: float = RESPONSE_CACHE_TTL, max_size: int = RESPONSE_CACHE_MAX_SIZE,
+                 bypass: bool = False):
+        """
+        Creates (if necessary) the directory of the cache
+        :param directory: (str)
+        :param ttl: (float) time to live of responses in seconds
+        :param max_size: (int) max size of all responses in bytes
+        :param bypass: (bool) if True, responses are not taken from the cache, but new responses are saved to it
+        """
+        self.directory = directory
+        self.ttl = ttl
+        self.max_size = max_size
+        self.bypass = bypass
+        self.hits = 0
+        self.misses = 0
+        self._lock = Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._size = sum(entry.stat().st_size for entry in self._entries())
+
+    @staticmethod
+    def make_key(method: str, params: dict) -> str:
+        """
+        Makes the key of the request
+        :param method: (str) VK API method, for example 'friends.get'
+        :param params: (dict) params of the request (access_token is ignored)
+        :return: (str) key
+        """
+        params = {key: str(value) for key, value in params.items() if key != 'access_token'}
+        request = json.dumps([method, params], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(request.encode('UTF-8')).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f'{key}.json.z')
+
+    def _entries(self) -> list[os.DirEntry]:
+        return [entry for entry in os.scandir(self.directory) if entry.name.endswith('.json.z')]
+
+    def get(self, key: str) -> dict | None:
+        """
+        Returns the response from the cache
+        :param key: (str) result of make_key
+        :return: (dict | None) response or None if there is no actual response in the cache (or bypass is set)
+        """
+        response = None
+        if not self.bypass:
+            try:
+                with open(self._path(key), 'rb') as cache_file:
+                    entry = json.loads(zlib.decompress(cache_file.read()))
+                if time() - entry['created'] <= self.ttl:
+                    response = entry['response']
+                    os.utime(self._path(key))           # the time of the last use (for LRU)
+            except (OSError, ValueError, KeyError, zlib.error):
+                response = None
+        with self._lock:
+            if response is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return response
+
+    def set(self, key: str, response: dict):
+        """
+        Saves the response to the cache, removes least recently used responses if the cache is too big
+        :param key: (str) result of make_key
+        :param response: (dict) raw VK API response
+        """
+        data = zlib.compress(json.dumps({'created': time(), 'response': response}, ensure_ascii=False).encode('UTF-8'))
+        path = self._path(key)
+        temp_path = f'{path}.{os.getpid()}.{id(data)}.tmp'
+        with open(temp_path, 'wb') as cache_file:
+            cache_file.write(data)
+        with self._lock:                # the replaced response and the size change together
+            try:
+                old_size = os.path.getsize(path)
+            except OSError:
+                old_size = 0
+            os.replace(temp_path, path)                   # other readers never see a half-written response
+            self._size += len(data) - old_size
+            if self._size > self.max_size:
+                self._evict()
+
+    def _evict(self):
+        """
+        Removes least recently used responses until the size of the cache is no more than 3/4 of max_size
+        (must be called with self._lock)
+        """
+        entries = sorted(self._entries(), key=lambda entry: entry.stat().st_mtime)
+        self._size = sum(entry.stat().st_size for entry in entries)
+        for entry in entries:
+            if self._size <= self.max_size * 3 // 4:
+                break
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+            except OSError:
+                continue
+            self._size -= size
+        logger.info(f'Response cache is cleaned, size: {self._size} bytes')
+
+    def clear(self):
+        """
+        Removes all responses
+        """
+        with self._lock:
+            for entry in self._entries():
+                os.remove(entry.path)
+            self._size = 0
@@ -1,4 +1,83 @@
 # write to this variable your VK access token
 ACCESS_TOKEN: str = ''
 
+# several access tokens make reports faster: every token has its own limit of REQUESTS_PER_SECOND and requests go to
+# tokens with free capacity (see services.TokenPool). Tokens are read from the environment variable ACCESS_TOKENS
+# (separated by commas or whitespace) or from a file with one token per line (--token-file), ACCESS_TOKEN otherwise
+ACCESS_TOKENS_ENV = 'ACCESS_TOKENS'
+# seconds a token is not used (while other tokens can be used) after VK throttles it
+TOKEN_THROTTLE_SIDELINE = 5
+# seconds a token is not used after VK rejects it, VK error codes: 5 - authorization failed (invalid or expired
+# token), 29 - rate limit of the method is reached for the token
+TOKEN_ERROR_SIDELINE = 10 * 60
+TOKEN_ERROR_CODES = (5, 29)
+
 FRIENDS_PER_REQUEST = 1000
+
+# delta reports: ids of friends are requested without information (VK allows up to 5000 in one request),
+# information about new friends is requested with users.get (VK allows up to 1000 users in one request)
+FRIEND_IDS_PER_REQUEST = 5000
+USERS_PER_REQUEST = 1000
+
+# fields (columns) of reports, only VK fields needed for them are requested, available fields:
+# id, first_name, last_name, country, city, birth_date, sex, domain, last_seen, education, graduation
+REPORT_FIELDS = ('first_name', 'last_name', 'country', 'city', 'birth_date', 'sex')
+
+# size of the write buffer of report files (in bytes)
+REPORT_FILE_BUFFER_SIZE = 1024 * 1024
+
+# streaming compression of report files (gzip or zstd, zstd requires the zstandard package)
+GZIP_COMPRESS_LEVEL = 6
+ZSTD_COMPRESS_LEVEL = 3
+
+# sqlite reports: seconds to wait for other writers of the same database (batch reports share one database)
+SQLITE_BUSY_TIMEOUT = 60
+
+# json encoder of json/ndjson reports: 'stdlib' (no extra packages) or 'orjson' (faster, requires orjson)
+JSON_BACKEND = 'stdlib'
+
+# parse friends of a page one by one from the body of the VK response instead of decoding the whole page at once
+# (less memory for big pages, see FRIENDS_PER_REQUEST; pages from the cache and "execute" are decoded as usual)
+STREAM_JSON_ITEMS = False
+
+# number of users in one row group of parquet reports
+PARQUET_ROW_GROUP_SIZE = 100_000
+
+VK_API_URL = 'https://api.vk.com/method/'
+VK_API_VERSION = '5.81'
+
+# VK API allows only a few requests per second for one access token
+REQUESTS_PER_SECOND = 3
+
+# number of threads that request pages of friends at the same time (1 - pages are requested one by one)
+WORKERS = 1
+
+# report pipeline: max number of chunks waiting between stages (fetch -> parse -> write), it limits memory
+PIPELINE_QUEUE_SIZE = 4
+# number of processes parsing chunks (0 - chunks are parsed by a thread, processes help only for big chunks)
+PARSE_PROCESSES = 0
+
+# request up to PAGES_PER_EXECUTE chunks of friends in one web request with VK API method "execute" (VK allows up to 25)
+USE_EXECUTE = False
+PAGES_PER_EXECUTE = 25
+
+# friend graph crawl (graph.py): max number of users waiting for requesting their friends at the next hop
+GRAPH_MAX_FRONTIER_SIZE = 1_000_000
+
+# report server (report_server.py): address and number of jobs running at the same time
+SERVER_HOST = '127.0.0.1'
+SERVER_PORT = 8080
+SERVER_WORKERS = 4
+
+# on-disk cache of VK responses (used if a directory is given, for example in batch.py --cache-dir)
+RESPONSE_CACHE_TTL = 6 * 60 * 60          # seconds
+RESPONSE_CACHE_MAX_SIZE = 512 * 1024 * 1024          # bytes
+
+# retries of failed requests (network errors, HTTP 429/5xx, VK errors below) with jittered exponential backoff
+RETRY_ATTEMPTS = 6
+RETRY_BASE_DELAY = 0.5          # seconds, the delay before the n-th retry is random in [0, base * 2 ** n]
+RETRY_MAX_DELAY = 30            # seconds
+REQUEST_TIMEOUT = 30            # seconds
+# VK error codes worth retrying: 1 - unknown error, 6 - too many requests per second, 9 - flood control,
+# 10 - internal server error
+RETRYABLE_VK_ERROR_CODES = (1, 6, 9, 10)
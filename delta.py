@@ -0,0 +1,183 @@
+import os
+import json
+import zlib
+import hashlib
+from time import time
+from typing import NamedTuple
+
+import requests
+from loguru import logger
+
+from config import REQUESTS_PER_SECOND, VK_API_URL
+from aggregates import FriendsStatistics
+from services import User, VkFriendsParser, VkResponseData, RateLimiter, AdaptiveRateLimiter, \
+    create_and_prepare_file
+
+
+# Delta reports: repeated runs for the same user request only ids of friends and information about new friends,
+# the full report is created from the snapshot of the previous run
+
+
+def hash_user(user: User) -> str:
+    """
+    :param user: (User)
+    :return: (str) short hash of all fields of the user (to find changed friends)
+    """
+    data = json.dumps(list(user), ensure_ascii=False).encode('UTF-8')
+    return hashlib.blake2b(data, digest_size=8).hexdigest()
+
+
+class Delta(NamedTuple):
+    added: list[User]
+    removed: list[User]
+    changed: list[User]         # new information about friends, whose information has changed
+
+
+class FriendsSnapshot:
+    """
+    Friends of the user at the moment of a run: ids of all friends in the order of the report (by name), information
+    about every active friend and its hash. Deactivated friends have only ids (no information)
+    Saved as compressed json, the full report can be created from it without requests to VK
+    """
+
+    def __init__(self, vk_user_id: str, ids: list[int], users: dict[int, User], hashes: dict[int, str] | None = None):
+        """
+        :param vk_user_id: (str)
+        :param ids: (list[int]) ids of all friends sorted by name
+        :param users: (dict[int, User]) id -> information about active friend
+        :param hashes: (dict[int, str] | None) id -> hash_user(information), if None, hashes are calculated
+        """
+        self.vk_user_id = str(vk_user_id)
+        self.ids = ids
+        self.users = users
+        self.hashes = hashes if hashes is not None else {user_id: hash_user(user) for user_id, user in users.items()}
+
+    @property
+    def list_of_users(self) -> list[User]:
+        """
+        :return: (list[User]) active friends in the order of the report
+        """
+        return [self.users[user_id] for user_id in self.ids if user_id in self.users]
+
+    def save(self, path: str):
+        """
+        Saves the snapshot (the file is replaced atomically)
+        :param path: (str)
+        """
+        data = {'vk_user_id': self.vk_user_id,
+                'created': time(),
+                'ids': self.ids,
+                'users': [list(self.users[user_id]) if user_id in self.users else None for user_id in self.ids],
+                'hashes': [self.hashes.get(user_id) for user_id in self.ids]}
+        with open(f'{path}.tmp', 'wb') as snapshot_file:
+            snapshot_file.write(zlib.compress(json.dumps(data, ensure_ascii=False).encode('UTF-8')))
+        os.replace(f'{path}.tmp', path)
+
+    @classmethod
+    def load(cls, path: str, vk_user_id: str) -> 'FriendsSnapshot | None':
+        """
+        :param path: (str)
+        :param vk_user_id: (str)
+        :return: (FriendsSnapshot | None) None if there is no snapshot, it is broken or made for another user
+        """
+        try:
+            with open(path, 'rb') as snapshot_file:
+                data = json.loads(zlib.decompress(snapshot_file.read()))
+            if data['vk_user_id'] != str(vk_user_id):
+                logger.info(f'Snapshot {path} is made for another user, it is ignored')
+                return None
+            users, hashes = {}, {}
+            for user_id, user, user_hash in zip(data['ids'], data['users'], data['hashes']):
+                if user is not None:
+                    users[user_id] = User._make(user)
+                    hashes[user_id] = user_hash
+        except (OSError, ValueError, KeyError, TypeError, zlib.error) as Ex:
+            logger.info(f'No snapshot of the previous run ({Ex!r})')
+            return None
+        return cls(vk_user_id, data['ids'], users, hashes)
+
+
+def get_path_of_snapshot_file(path_of_report_file: str) -> str:
+    """
+    :param path_of_report_file: (str) path of the report file without format
+    :return: (str)
+    """
+    return f'{path_of_report_file}.snapshot'
+
+
+def create_delta_report(access_token, vk_user_id, format_report_file, path_of_report_file,
+                        check_changes: bool = False, rate_limiter: RateLimiter | None = None,
+                        session: requests.Session | None = None, api_url: str = VK_API_URL, cache=None,
+                        compression: str | None = None, path_of_snapshot_file: str | None = None,
+                        statistics: FriendsStatistics | None = None) -> Delta:
+    """
+    Incremental analog of services.create_and_fill_vk_friends_report
+    It 1) gets ids of all friends (friends.get without fields, one request for up to 5000 friends)
+       2) compares them with the snapshot of the previous run and requests information (users.get) only about
+          new friends (about all friends if check_changes, to find changed information)
+       3) writes added, removed and changed friends to "<path>_added.<format>", "<path>_removed.<format>",
+          "<path>_changed.<format>"
+       4) writes the full report "<path>.<format>" from the new snapshot and saves the snapshot ("<path>.snapshot")
+    The first run (without snapshot) requests information about all friends, all of them are added
+    :param access_token: (str | services.TokenPool) one token or a pool of tokens
+    :param vk_user_id: (str)
+    :param format_report_file: (str)
+    :param path_of_report_file: (str)
+    :param check_changes: (bool) request information about all friends to find changed friends
+    :param rate_limiter: (RateLimiter | None) limiter shared with other reports using the same access token
+    :param session: (requests.Session | None) keep-alive session shared with other reports
+    :param api_url: (str) base url of VK API methods
+    :param cache: (cache.ResponseCache | None) cache of VK responses
+    :param compression: (str | None) 'gzip' or 'zstd' - reports are compressed while they are written
+    :param path_of_snapshot_file: (str | None) "<path>.snapshot" if None (reports of many users in one sqlite
+                                  database need a snapshot for every user)
+    :param statistics: (FriendsStatistics | None) statistics of all friends (of the full report) are added to it
+    :return: (Delta) added, removed and changed friends
+    """
+    path_of_snapshot_file = path_of_snapshot_file or get_path_of_snapshot_file(path_of_report_file)
+    old_snapshot = FriendsSnapshot.load(path_of_snapshot_file, vk_user_id)
+    old_users = old_snapshot.users if old_snapshot else {}
+    old_hashes = old_snapshot.hashes if old_snapshot else {}
+
+    parser = VkFriendsParser(access_token, vk_user_id, rate_limiter=rate_limiter or AdaptiveRateLimiter(
+        REQUESTS_PER_SECOND), session=session, api_url=api_url, cache=cache)
+    ids = parser.get_ids_of_friends()
+    if check_changes:
+        ids_to_request = ids
+    else:
+        # friends without information in the snapshot (new or deactivated at the previous run) are requested
+        ids_to_request = [user_id for user_id in ids if user_id not in old_users]
+    received_users = {}
+    if ids_to_request:
+        vk_resp_data = VkResponseData(parser.get_users(ids_to_request))
+        received_users = dict(zip(vk_resp_data.ids, vk_resp_data.list_of_users))
+    requested_ids = set(ids_to_request)
+
+    users: dict[int, User] = {}
+    for user_id in ids:
+        if user_id in received_users:
+            users[user_id] = received_users[user_id]
+        elif user_id not in requested_ids and user_id in old_users:
+            users[user_id] = old_users[user_id]
+    new_snapshot = FriendsSnapshot(vk_user_id, ids, users,
+                                   {user_id: old_hashes[user_id] if user_id not in received_users
+                                    else hash_user(user) for user_id, user in users.items()})
+
+    delta = Delta(added=[users[user_id] for user_id in ids if user_id in users and user_id not in old_users],
+                  removed=[old_users[user_id] for user_id in old_snapshot.ids
+                           if user_id in old_users and user_id not in users] if old_snapshot else [],
+                  changed=[users[user_id] for user_id in ids if user_id in received_users and user_id in old_users
+                           and new_snapshot.hashes[user_id] != old_hashes[user_id]])
+    for name, list_of_users in zip(Delta._fields, delta):
+        with create_and_prepare_file(format_report_file, f'{path_of_report_file}_{name}', compression=compression,
+                                     owner_id=vk_user_id) as report_file:
+            report_file.add(list_of_users)
+    with create_and_prepare_file(format_report_file, path_of_report_file, compression=compression,
+                                 owner_id=vk_user_id) as report_file:
+        report_file.add(new_snapshot.list_of_users)
+    new_snapshot.save(path_of_snapshot_file)        # only after the reports are written
+    if statistics is not None:
+        statistics.add(new_snapshot.list_of_users)
+    logger.info(f'Delta report for user {vk_user_id}: {len(delta.added)} added, {len(delta.removed)} removed, '
+                f'{len(delta.changed)} changed, {len(ids_to_request)} users requested')
+    return delta
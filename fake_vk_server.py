@@ -0,0 +1,280 @@
+import re
+import json
+from time import monotonic, sleep
+from collections import deque, Counter
+from threading import Thread, Lock
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+
+# Local stand-in for VK API friends.get and execute, used by tests
+
+
+def make_fake_friend(number: int, vk_fields: set | None = None) -> dict:
+    """
+    Creates synthetic friend data in the format of VK API friends.get
+    Friends are named so that the order of numbers is the order of names
+    :param number: (int) number of the friend
+    :param vk_fields: (set | None) requested VK fields (sex, bdate, city, country, domain, last_seen, education),
+                      None - sex, bdate, city, country
+    :return: (dict)
+    """
+    if vk_fields is None:
+        vk_fields = {'sex', 'bdate', 'city', 'country'}
+    friend = {'id': 100000 + number,
+              'first_name': f'Name{number:07d}',
+              'last_name': f'Surname{number:07d}'}
+    if 'sex' in vk_fields:
+        friend['sex'] = number % 2 + 1
+    friend['track_code'] = f'track{number}'
+    if 'bdate' in vk_fields:
+        if number % 3 == 0:
+            friend['bdate'] = f'{number % 28 + 1}.{number % 12 + 1}.{1950 + number % 50}'
+        elif number % 3 == 1:
+            friend['bdate'] = f'{number % 28 + 1}.{number % 12 + 1}'
+    if number % 5:
+        if 'country' in vk_fields:
+            friend['country'] = {'id': number % 5, 'title': f'Country{number % 5}'}
+        if 'city' in vk_fields:
+            friend['city'] = {'id': number % 50, 'title': f'City{number % 50}'}
+    if 'domain' in vk_fields:
+        friend['domain'] = f'name{number}' if number % 4 else f'id{100000 + number}'
+    if 'last_seen' in vk_fields:
+        friend['last_seen'] = {'time': 1_700_000_000 + number * 3600, 'platform': number % 7 + 1}
+    if 'education' in vk_fields:       # VK sends zeros and empty names if the university is unknown
+        has_university = number % 4 == 0
+        friend.update(university=number % 10 + 1 if has_university else 0,
+                      university_name=f'University{number % 10}' if has_university else '',
+                      faculty=0, faculty_name='', graduation=2000 + number % 20 if has_university else 0)
+    if number % 97 == 96:
+        friend['deactivated'] = 'deleted'
+    return friend
+
+
+class FakeVkServer:
+    """
+    HTTP server in a separate thread that answers friends.get and execute like VK API
+    Supports keep-alive connections and counts requests and connections
+    Can inject failures: VK error 6 for requests above requests_per_second and HTTP 503 for every n-th request,
+    and imitate network latency
+    """
+
+    def __init__(self, number_of_friends: int, private_user_ids: tuple = (), requests_per_second: float | None = None,
+                 server_error_every: int = 0, latency: float = 0, rejected_tokens: tuple = (),
+                 malformed_body_every: int = 0):
+        """
+        Creates (but does not start) the server on a free local port
+        :param number_of_friends: (int) number of synthetic friends of every user
+        :param private_user_ids: (tuple) user ids with closed profiles (VK error 30)
+        :param requests_per_second: (float | None) requests of one access token above this limit (in the last second)
+                                    get VK error 6 (VK limits every token separately)
+        :param server_error_every: (int) every n-th request gets HTTP 503 (0 - never)
+        :param latency: (float) seconds before every answer
+        :param rejected_tokens: (tuple) access tokens that get VK error 5 (authorization failed)
+        :param malformed_body_every: (int) every n-th request gets json that is not an object ("null" or "[]" by turns,
+                                     0 - never)
+        """
+        self.number_of_friends = number_of_friends
+        self.private_user_ids = {str(user_id) for user_id in private_user_ids}
+        self.removed_friend_numbers: set[int] = set()     # can be changed between requests to imitate a new day
+        self.changed_friend_numbers: set[int] = set()     # these friends have moved to another city
+        self.requests_per_second = requests_per_second
+        self.server_error_every = server_error_every
+        self.latency = latency
+        self.rejected_tokens = set(rejected_tokens)
+        self.malformed_body_every = malformed_body_every
+        self.number_of_requests = 0
+        self.requests_by_token: Counter = Counter()
+        self.number_of_connections = 0
+        self.number_of_throttled_requests = 0
+        self.number_of_server_errors = 0
+        self.number_of_malformed_bodies = 0
+        self._request_times: dict[str, deque] = {}     # access token -> times of answered requests in the last second
+        self._lock = Lock()
+        self._httpd = ThreadingHTTPServer(('127.0.0.1', 0), self._make_handler())
+        self._httpd.daemon_threads = True
+        self._thread = Thread(target=self._httpd.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True)
+
+    @property
+    def url(self) -> str:
+        """
+        Base url of API methods (analog of https://api.vk.com/method/)
+        """
+        host, port = self._httpd.server_address[:2]
+        return f'http://{host}:{port}/method/'
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def _get_injected_failure(self, access_token: str) -> int | None:
+        """
+        Decides whether the current request fails (must be called with self._lock after counting the request)
+        :param access_token: (str) access token of the request
+        :return: (int | None) 503 - server error, 5 - authorization failed, 6 - too many requests per second,
+                 0 - json that is not an object, None - request is answered
+        """
+        if self.server_error_every and self.number_of_requests % self.server_error_every == 0:
+            self.number_of_server_errors += 1
+            return 503
+        if self.malformed_body_every and self.number_of_requests % self.malformed_body_every == 0:
+            self.number_of_malformed_bodies += 1
+            return 0
+        if access_token in self.rejected_tokens:
+            return 5
+        if self.requests_per_second:
+            now = monotonic()
+            request_times = self._request_times.setdefault(access_token, deque())
+            while request_times and now - request_times[0] >= 1:
+                request_times.popleft()
+            if len(request_times) >= self.requests_per_second:
+                self.number_of_throttled_requests += 1
+                return 6
+            request_times.append(now)
+        return None
+
+    @staticmethod
+    def get_vk_fields(params: dict) -> set | None:
+        """
+        :param params: (dict) query params
+        :return: (set | None) VK fields requested by the "fields" param, None if it is empty (a shortcut of tests
+                 for sex, bdate, city, country)
+        """
+        vk_fields = {vk_field.strip() for vk_field in params.get('fields', '').split(',') if vk_field.strip()}
+        return vk_fields or None
+
+    def make_friend(self, number: int, vk_fields: set | None = None) -> dict:
+        """
+        make_fake_friend with changes of changed_friend_numbers
+        """
+        friend = make_fake_friend(number, vk_fields)
+        if number in self.changed_friend_numbers and 'city' in friend:
+            friend['city'] = {'id': 1000, 'title': 'NewCity'}
+        return friend
+
+    def friends_get(self, params: dict) -> dict:
+        """
+        Makes response of friends.get for query params
+        :param params: (dict) query params
+        :return: (dict) response data
+        """
+        if params.get('user_id') in self.private_user_ids:
+            return {'error': {'error_code': 30, 'error_msg': 'This profile is private'}}
+        numbers = [number for number in range(self.number_of_friends) if number not in self.removed_friend_numbers]
+        offset = int(params.get('offset', 0))
+        count = int(params.get('count', 5000))
+        page_numbers = numbers[offset:offset + count]
+        if 'fields' not in params:
+            return {'response': {'count': len(numbers), 'items': [100000 + number for number in page_numbers]}}
+        vk_fields = self.get_vk_fields(params)
+        return {'response': {'count': len(numbers),
+                             'items': [self.make_friend(number, vk_fields) for number in page_numbers]}}
+
+    def users_get(self, params: dict) -> dict:
+        """
+        Makes response of users.get for query params (unknown users are returned as deleted, like VK does)
+        :param params: (dict) query params
+        :return: (dict) response data
+        """
+        users = []
+        vk_fields = self.get_vk_fields(params)
+        for user_id in params.get('user_ids', '').split(','):
+            number = int(user_id) - 100000
+            if 0 <= number < self.number_of_friends:
+                users.append(self.make_friend(number, vk_fields))
+            else:
+                users.append({'id': int(user_id), 'first_name': 'DELETED', 'last_name': '', 'deactivated': 'deleted'})
+        return {'response': users}
+
+    def execute(self, params: dict) -> dict:
+        """
+        Makes response of execute for code like 'return [API.friends.get({...}), API.friends.get({...})];'
+        :param params: (dict) query params
+        :return: (dict) response data
+        """
+        calls = re.findall(r'API\.friends\.get\((\{.*?\})\)', params.get('code', ''))
+        if len(calls) > 25:
+            return {'error': {'error_code': 13, 'error_msg': 'Runtime error occurred during code invocation: '
+                                                             'Too many API calls'}}
+        pages, execute_errors = [], []
+        for call in calls:
+            call_params = {key: str(value) for key, value in json.loads(call).items()}
+            page = self.friends_get(call_params)
+            if 'error' in page:
+                pages.append(False)
+                execute_errors.append({'method': 'friends.get', **page['error']})
+            else:
+                pages.append(page['response'])
+        result = {'response': pages}
+        if execute_errors:
+            result['execute_errors'] = execute_errors
+        return result
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'      # keep-alive
+
+            def setup(self):
+                super().setup()
+                with server._lock:
+                    server.number_of_connections += 1
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                self._answer(url.path, url.query)
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('UTF-8')
+                self._answer(urlparse(self.path).path, body)
+
+            def _answer(self, path: str, query: str):
+                params = {key: values[0] for key, values in parse_qs(query).items()}
+                with server._lock:
+                    server.number_of_requests += 1
+                    server.requests_by_token[params.get('access_token', '')] += 1
+                    failure = server._get_injected_failure(params.get('access_token', ''))
+                if server.latency:
+                    sleep(server.latency)
+                if failure == 503:
+                    self._send_json(503, {'error': 'Service Unavailable'})
+                elif failure == 0:
+                    self._send_json(200, None if server.number_of_malformed_bodies % 2 else [])
+                elif failure == 5:
+                    self._send_json(200, {'error': {'error_code': 5, 'error_msg': 'User authorization failed: '
+                                                                                  'invalid access_token'}})
+                elif failure == 6:
+                    self._send_json(200, {'error': {'error_code': 6,
+                                                    'error_msg': 'Too many requests per second'}})
+                elif path.endswith('/friends.get'):
+                    self._send_json(200, server.friends_get(params))
+                elif path.endswith('/users.get'):
+                    self._send_json(200, server.users_get(params))
+                elif path.endswith('/execute'):
+                    self._send_json(200, server.execute(params))
+                else:
+                    self._send_json(404, {'error': {'error_code': 3, 'error_msg': 'Unknown method passed'}})
+
+            def _send_json(self, status: int, data: dict):
+                body = json.dumps(data, ensure_ascii=False).encode('UTF-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
@@ -0,0 +1,222 @@
+import os
+import csv
+import sys
+import argparse
+from array import array
+from typing import NamedTuple
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+
+import requests
+from loguru import logger
+
+from config import ACCESS_TOKENS_ENV, FRIENDS_PER_REQUEST, REQUESTS_PER_SECOND, WORKERS, VK_API_URL, \
+    REPORT_FILE_BUFFER_SIZE, GRAPH_MAX_FRONTIER_SIZE, RESPONSE_CACHE_TTL, RESPONSE_CACHE_MAX_SIZE
+from services import User, VkFriendsParser, VkResponseData, VkApiError, RateLimiter, AdaptiveRateLimiter, \
+    TokenPool, create_session, read_access_tokens
+from cache import ResponseCache
+
+
+# Crawling of the friend graph N hops out from a seed user:
+# python graph.py 1234567 --depth 2 --output graph/res1 --workers 3
+
+
+class IdBitmap:
+    """
+    Compact set of VK ids: one bit for every id, grows up to the biggest added id
+    (1 million of ids takes 125 kB, all VK ids would take about 125 MB)
+    """
+
+    def __init__(self):
+        self._bits = bytearray()
+        self._length = 0
+
+    def add(self, vk_id: int) -> bool:
+        """
+        :param vk_id: (int)
+        :return: (bool) True if the id was not in the set
+        """
+        index, bit = divmod(vk_id, 8)
+        if index >= len(self._bits):
+            self._bits.extend(bytes(max(index + 1 - len(self._bits), len(self._bits) // 2)))
+        if self._bits[index] & (1 << bit):
+            return False
+        self._bits[index] |= 1 << bit
+        self._length += 1
+        return True
+
+    def __contains__(self, vk_id: int) -> bool:
+        index, bit = divmod(vk_id, 8)
+        return index < len(self._bits) and bool(self._bits[index] & (1 << bit))
+
+    def __len__(self) -> int:
+        return self._length
+
+
+class GraphCrawlResult(NamedTuple):
+    number_of_nodes: int
+    number_of_edges: int
+    number_of_expanded: int         # users whose friends are received
+    number_of_skipped: int          # users whose friends are not available (private profiles, errors)
+
+
+def get_friends_with_ids(parser: VkFriendsParser, count: int = FRIENDS_PER_REQUEST) -> tuple[list[int], list[User]]:
+    """
+    Requests all active friends of the parser's user (in chunks of "count" friends)
+    :param parser: (VkFriendsParser)
+    :param count: (int) number friends at one chunk
+    :return: (tuple[list[int], list[User]]) ids of friends and information about them
+    """
+    ids, users = [], []
+    offset, number_of_friends = 0, None
+    while number_of_friends is None or offset < number_of_friends:
+        page = parser.get_info_about_friends(offset=offset, count=count)
+        number_of_friends = page['response']['count']
+        if not page['response']['items']:
+            break
+        vk_resp_data = VkResponseData(page)
+        ids.extend(vk_resp_data.ids)
+        users.extend(vk_resp_data.list_of_users)
+        offset += count
+    return ids, users
+
+
+def crawl_friends_graph(access_token, seed_user_id, path_of_graph_files, depth: int = 2, workers: int = WORKERS,
+                        max_frontier_size: int = GRAPH_MAX_FRONTIER_SIZE, rate_limiter: RateLimiter | None = None,
+                        session: requests.Session | None = None, api_url: str = VK_API_URL,
+                        cache=None) -> GraphCrawlResult:
+    """
+    Breadth-first crawl of the friend graph: friends of the seed user (depth 1), friends of these friends (depth 2)...
+    Friends of every user are requested once, no matter in how many lists the user is
+    Writes "<path>_nodes.csv" (id and information of every user, the same fields as in reports) and
+    "<path>_edges.csv" (pairs of friends, every friendship once)
+    :param access_token: (str | services.TokenPool) one token or a pool of tokens
+    :param seed_user_id: (str | int) numeric VK id of the seed user
+    :param path_of_graph_files: (str) path of the files without suffixes, for example 'graph/res1'
+    :param depth: (int) number of hops from the seed user
+    :param workers: (int) number of users whose friends are requested at the same time
+    :param max_frontier_size: (int) max number of users waiting for requesting their friends at the next hop,
+                              users above the limit are written as nodes, but their friends are not requested
+    :param rate_limiter: (RateLimiter | None) limiter shared with other jobs using the same access token
+    :param session: (requests.Session | None) keep-alive session
+    :param api_url: (str) base url of VK API methods
+    :param cache: (cache.ResponseCache | None) cache of VK responses
+    :return: (GraphCrawlResult)
+    """
+    rate_limiter = rate_limiter or AdaptiveRateLimiter(REQUESTS_PER_SECOND)
+    is_own_session = session is None
+    session = session or create_session(workers)
+
+    def make_parser(vk_user_id) -> VkFriendsParser:
+        return VkFriendsParser(access_token, str(vk_user_id), rate_limiter=rate_limiter, session=session,
+                               api_url=api_url, cache=cache)
+
+    def get_friends(vk_user_id: int) -> tuple[list[int], list[User]] | None:
+        try:
+            return get_friends_with_ids(make_parser(vk_user_id))
+        except VkApiError as Ex:          # private profile, deleted user... the crawl goes on
+            logger.warning(f'Friends of user {vk_user_id} are skipped: {Ex}')
+            return None
+
+    seed_data = VkResponseData(make_parser(seed_user_id).get_users([seed_user_id]))
+    if not seed_data.ids:
+        raise VkApiError(f'User {seed_user_id} is not found or deactivated')
+
+    discovered, expanded = IdBitmap(), IdBitmap()
+    frontier = array('q', seed_data.ids)
+    discovered.add(seed_data.ids[0])
+    number_of_edges = number_of_skipped = 0
+    with open(f'{path_of_graph_files}_nodes.csv', 'w', encoding='UTF-8', newline='',
+              buffering=REPORT_FILE_BUFFER_SIZE) as nodes_file, \
+            open(f'{path_of_graph_files}_edges.csv', 'w', encoding='UTF-8', newline='',
+                 buffering=REPORT_FILE_BUFFER_SIZE) as edges_file:
+        nodes_writer, edges_writer = csv.writer(nodes_file), csv.writer(edges_file)
+        nodes_writer.writerow(('id',) + User.user_fields())
+        edges_writer.writerow(('user_id', 'friend_id'))
+        nodes_writer.writerow((seed_data.ids[0],) + tuple(seed_data.list_of_users[0]))
+
+        for hop in range(depth):
+            next_frontier = array('q')
+            is_truncated = False
+            logger.info(f'Hop {hop + 1}: requesting friends of {len(frontier)} users')
+            with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+                futures = deque()
+                frontier_iterator = iter(frontier)
+                while True:
+                    # no more than 2 * workers users are requested ahead, results are processed in frontier order
+                    for vk_user_id in frontier_iterator:
+                        futures.append((vk_user_id, executor.submit(get_friends, vk_user_id)))
+                        if len(futures) >= 2 * max(workers, 1):
+                            break
+                    if not futures:
+                        break
+                    vk_user_id, future = futures.popleft()
+                    friends = future.result()
+                    if friends is None:
+                        number_of_skipped += 1
+                        continue
+                    expanded.add(vk_user_id)
+                    for friend_id, friend in zip(*friends):
+                        if friend_id == vk_user_id or friend_id in expanded:
+                            continue          # this friendship is written from the friend's list
+                        edges_writer.writerow((vk_user_id, friend_id))
+                        number_of_edges += 1
+                        if discovered.add(friend_id):
+                            nodes_writer.writerow((friend_id,) + tuple(friend))
+                            if hop + 1 == depth:
+                                continue              # friends of the last hop are not requested
+                            if len(next_frontier) < max_frontier_size:
+                                next_frontier.append(friend_id)
+                            elif not is_truncated:
+                                is_truncated = True
+                                logger.warning(f'Frontier of hop {hop + 2} is truncated to {max_frontier_size} users')
+            frontier = next_frontier
+    if is_own_session:
+        session.close()
+
+    result = GraphCrawlResult(number_of_nodes=len(discovered), number_of_edges=number_of_edges,
+                              number_of_expanded=len(expanded), number_of_skipped=number_of_skipped)
+    logger.info(f'Graph crawl finished: {result}')
+    return result
+
+
+def main():
+    argument_parser = argparse.ArgumentParser(description='Crawls the VK friend graph N hops out from a seed user')
+    argument_parser.add_argument('seed_user_id', type=int, help='numeric VK id of the seed user')
+    argument_parser.add_argument('--depth', type=int, default=2, help='number of hops from the seed user')
+    argument_parser.add_argument('--output', default='graph',
+                                 help='path of the files without suffixes ("<output>_nodes.csv", "<output>_edges.csv")')
+    argument_parser.add_argument('--workers', type=int, default=max(WORKERS, 3),
+                                 help='number of users whose friends are requested at the same time')
+    argument_parser.add_argument('--max-frontier-size', type=int, default=GRAPH_MAX_FRONTIER_SIZE)
+    argument_parser.add_argument('--cache-dir', help='directory of the cache of VK responses (no cache by default)')
+    argument_parser.add_argument('--token-file', help='file with access tokens (one per line), several tokens make '
+                                                      'the crawl faster (each token has its own rate limit)')
+    args = argument_parser.parse_args()
+
+    # from the file, from the environment (ACCESS_TOKENS or ACCESS_TOKEN) or from file "config.py"
+    access_tokens = read_access_tokens(args.token_file)
+    if not access_tokens:
+        argument_parser.error(f'There is no access token: use --token-file or the environment variable '
+                              f'{ACCESS_TOKENS_ENV}')
+    access_token = access_tokens[0] if len(access_tokens) == 1 else TokenPool(access_tokens)
+    if os.path.dirname(args.output):
+        os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    cache = None
+    if args.cache_dir:
+        cache = ResponseCache(args.cache_dir, ttl=RESPONSE_CACHE_TTL, max_size=RESPONSE_CACHE_MAX_SIZE)
+    try:
+        result = crawl_friends_graph(access_token, args.seed_user_id, args.output, depth=args.depth,
+                                     workers=args.workers, max_frontier_size=args.max_frontier_size, cache=cache)
+    except VkApiError as Ex:
+        print(f'The graph is not created, VK API error: {Ex}')
+        logger.error(f'The graph is not created, VK API error: {Ex}')
+        return 1
+    print(f'Nodes: {result.number_of_nodes}, edges: {result.number_of_edges}, users with requested friends: '
+          f'{result.number_of_expanded}, skipped: {result.number_of_skipped}')
+    return 0
+
+
+if __name__ == '__main__':
+    logger.add(open('file.log', 'w'), format='{time} {level} {message}')
+    sys.exit(main())
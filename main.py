@@ -1,11 +1,247 @@
-from sys import exit as sexit
+import os
+import sys
+import argparse
 
-from loguru import logger
+from config import ACCESS_TOKEN, FRIENDS_PER_REQUEST, WORKERS, VK_API_URL, USE_EXECUTE, REPORT_FIELDS, \
+    STREAM_JSON_ITEMS, ACCESS_TOKENS_ENV
 
-from services import get_app_launch_info_from_user, create_and_fill_vk_friends_report
 
+# Interactive run (the parameters are asked with input()):
+# python main.py
+# Non-interactive run (for cron, containers...), the token is taken from the environment variable ACCESS_TOKEN
+# (several tokens, separated by commas, make reports faster: ACCESS_TOKEN, ACCESS_TOKENS or --token-file):
+# python main.py 1234567 --format csv --output /data/reports/res1
+# python main.py 1234567 --format ndjson --compression gzip --output - | aws s3 cp - s3://bucket/res1.ndjson.gz
+# python main.py 1234567 7654321 --output reports          (many users: --output is a directory)
+# Heavy modules (services, requests, loguru...) are imported only when they are needed, so --help is instant
 
-def main():
+
+# exit codes
+EXIT_OK = 0
+EXIT_FAILED = 1                 # VK API error, broken response, some reports of many users are not created
+EXIT_USAGE = 2                  # wrong arguments (the same code as argparse errors)
+EXIT_NO_ACCESS_TOKEN = 3
+EXIT_OUTPUT_ERROR = 4           # the report file can not be written
+EXIT_INTERRUPTED = 130          # Ctrl+C / SIGINT
+
+
+def create_argument_parser() -> argparse.ArgumentParser:
+    argument_parser = argparse.ArgumentParser(
+        description='Creates VK friends report. Without user ids the parameters are asked interactively')
+    argument_parser.add_argument('user_ids', nargs='*', help='VK user ids (numeric ids or short names)')
+    argument_parser.add_argument('--user-ids-file', help='file with VK user ids (one per line), "-" to read stdin')
+    argument_parser.add_argument('--token-file', help='file with the access token or several tokens (one per line)')
+    argument_parser.add_argument('--token-env', default='ACCESS_TOKEN',
+                                 help='environment variable with the access token or several tokens separated by '
+                                      f'commas (default ACCESS_TOKEN), then {ACCESS_TOKENS_ENV} and the token from '
+                                      '"config.py" are used')
+    argument_parser.add_argument('--format', default='csv', help='format of the report file (default csv)')
+    argument_parser.add_argument('--output', default='report',
+                                 help='path of the report file without extension (relative or absolute), '
+                                      '"-" to write the report to stdout; a directory for many user ids')
+    argument_parser.add_argument('--compression', help='compress the report while it is written: gzip or zstd')
+    argument_parser.add_argument('--fields', default=','.join(REPORT_FIELDS),
+                                 help='comma separated fields of the report, only VK fields needed for them are '
+                                      'requested: id, first_name, last_name, country, city, birth_date, sex, domain, '
+                                      f'last_seen, education, graduation (default {",".join(REPORT_FIELDS)})')
+    argument_parser.add_argument('--page-size', type=int, default=FRIENDS_PER_REQUEST,
+                                 help='number of friends at one request (1-5000)')
+    argument_parser.add_argument('--workers', type=int, default=WORKERS,
+                                 help='number of requests (reports for many user ids) made at the same time')
+    argument_parser.add_argument('--execute', action='store_true', default=USE_EXECUTE,
+                                 help='request up to 25 chunks of friends in one web request with VK API "execute"')
+    argument_parser.add_argument('--stream-json', action='store_true', default=STREAM_JSON_ITEMS,
+                                 help='parse friends one by one from bodies of VK responses (less memory for big '
+                                      'pages)')
+    argument_parser.add_argument('--cache-dir', help='directory of the cache of VK responses (no cache by default)')
+    argument_parser.add_argument('--api-url', default=VK_API_URL, help='base url of VK API methods')
+    argument_parser.add_argument('--resume', action='store_true',
+                                 help='continue the report interrupted by the previous run from its checkpoint')
+    argument_parser.add_argument('--statistics',
+                                 help='write statistics of friends (countries, cities, ages, sex, birthdays per month) '
+                                      'to this json file')
+    argument_parser.add_argument('--metrics-file', help='write metrics of the run to this file')
+    argument_parser.add_argument('--metrics-format', default='json', choices=('json', 'prometheus'))
+    return argument_parser
+
+
+def read_access_token(args: argparse.Namespace):
+    """
+    Several tokens are united into a pool (requests are spread over the tokens, see services.TokenPool)
+    :param args: (argparse.Namespace) arguments of the command line
+    :return: (str | services.TokenPool) tokens from the file "--token-file", from the environment variable
+             "--token-env", from the environment variable ACCESS_TOKENS_ENV or from "config.py",
+             empty string if there is no token
+    """
+    from services import TokenPool, parse_access_tokens, read_access_tokens
+
+    if args.token_file:
+        access_tokens = read_access_tokens(args.token_file)
+    else:
+        access_tokens = (parse_access_tokens(os.environ.get(args.token_env, '')) or
+                         parse_access_tokens(os.environ.get(ACCESS_TOKENS_ENV, '')) or
+                         parse_access_tokens(ACCESS_TOKEN))
+    if len(access_tokens) > 1:
+        return TokenPool(access_tokens)
+    return access_tokens[0] if access_tokens else ''
+
+
+def read_user_ids_from_arguments(args: argparse.Namespace) -> list[str]:
+    """
+    :param args: (argparse.Namespace) arguments of the command line
+    :return: (list[str]) user ids from the command line and from "--user-ids-file" without repeats
+    """
+    from batch import read_user_ids
+
+    lines = list(args.user_ids)
+    if args.user_ids_file == '-':
+        lines.extend(sys.stdin)
+    elif args.user_ids_file:
+        with open(args.user_ids_file, 'r', encoding='UTF-8') as user_ids_file:
+            lines.extend(user_ids_file)
+    return read_user_ids(lines)
+
+
+def create_cache(cache_directory: str | None):
+    """
+    :param cache_directory: (str | None)
+    :return: (cache.ResponseCache | None) None if the directory is not given
+    """
+    if not cache_directory:
+        return None
+    from cache import ResponseCache
+    from config import RESPONSE_CACHE_TTL, RESPONSE_CACHE_MAX_SIZE
+    return ResponseCache(cache_directory, ttl=RESPONSE_CACHE_TTL, max_size=RESPONSE_CACHE_MAX_SIZE)
+
+
+def create_report(access_token, user_id: str, args: argparse.Namespace, statistics=None) -> str:
+    """
+    Creates the report of one user at "--output" (or writes it to stdout if "--output" is "-")
+    :param access_token: (str | services.TokenPool) one token or a pool of tokens
+    :param user_id: (str)
+    :param args: (argparse.Namespace) arguments of the command line
+    :param statistics: (aggregates.FriendsStatistics | None) statistics of friends are added to it
+    :return: (str) name of the report file or "stdout"
+    """
+    from services import create_and_fill_vk_friends_report, get_report_file_name
+
+    kwargs = dict(workers=args.workers, api_url=args.api_url, use_execute=args.execute,
+                  cache=create_cache(args.cache_dir), friends_per_request=args.page_size, compression=args.compression,
+                  statistics=statistics, fields=args.fields, stream_items=args.stream_json)
+    if args.output == '-':
+        # the report is streamed to stdout chunk by chunk, it never touches the disk
+        create_and_fill_vk_friends_report(access_token, user_id, args.format, sys.stdout.buffer, **kwargs)
+        sys.stdout.flush()
+        return 'stdout'
+
+    if os.path.dirname(args.output):
+        os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    create_and_fill_vk_friends_report(access_token, user_id, args.format, args.output, resume=args.resume, **kwargs)
+    return get_report_file_name(args.output, args.format, args.compression)
+
+
+def save_statistics(statistics, path: str):
+    """
+    Writes statistics of friends to the json file and prints them (to stderr, the report may be in stdout)
+    :param statistics: (aggregates.FriendsStatistics)
+    :param path: (str)
+    """
+    statistics.save(path)
+    print(statistics.format_summary(), file=sys.stderr)
+
+
+def run_non_interactive(args: argparse.Namespace, user_ids: list[str]) -> int:
+    """
+    Creates reports with the parameters of the command line
+    :param args: (argparse.Namespace) arguments of the command line
+    :param user_ids: (list[str]) at least one user id
+    :return: (int) exit code
+    """
+    from loguru import logger
+    from services import available_formats, available_compressions, check_report_fields, VkApiError
+
+    if args.format not in available_formats:
+        print(f'Unknown format "{args.format}", available formats: {", ".join(available_formats)}', file=sys.stderr)
+        return EXIT_USAGE
+    if args.compression is not None and args.compression not in available_compressions:
+        print(f'Unknown compression "{args.compression}", available: {", ".join(available_compressions)}',
+              file=sys.stderr)
+        return EXIT_USAGE
+    try:
+        check_report_fields(args.fields)
+    except ValueError as Ex:
+        print(Ex, file=sys.stderr)
+        return EXIT_USAGE
+    if not 1 <= args.page_size <= 5000:                 # VK allows up to 5000 friends in one request
+        print('--page-size should be from 1 to 5000', file=sys.stderr)
+        return EXIT_USAGE
+    if args.output == '-' and len(user_ids) > 1:
+        print('Reports of many users can not be written to stdout, give a directory with --output', file=sys.stderr)
+        return EXIT_USAGE
+    if args.output.endswith(('/', os.sep)) and len(user_ids) == 1:
+        print('--output should be a path of the file without extension, not a directory', file=sys.stderr)
+        return EXIT_USAGE
+    try:
+        access_token = read_access_token(args)
+    except OSError as Ex:
+        print(f'The access token is not read: {Ex}', file=sys.stderr)
+        return EXIT_NO_ACCESS_TOKEN
+    if not access_token:
+        print(f'There is no access token: use --token-file or the environment variable {args.token_env}',
+              file=sys.stderr)
+        return EXIT_NO_ACCESS_TOKEN
+    statistics = None
+    if args.statistics:
+        from aggregates import FriendsStatistics
+        statistics = FriendsStatistics()
+
+    if len(user_ids) > 1:
+        from batch import run_batch, print_summary
+        logger.info(f'Reports are requested for {len(user_ids)} users')
+        try:
+            results = run_batch(access_token, user_ids, args.format, args.output, args.workers,
+                                api_url=args.api_url, use_execute=args.execute, cache=create_cache(args.cache_dir),
+                                resume=args.resume, friends_per_request=args.page_size,
+                                compression=args.compression, statistics=statistics, fields=args.fields,
+                                stream_items=args.stream_json)
+            if statistics is not None:
+                save_statistics(statistics, args.statistics)
+        except OSError as Ex:
+            print(f'Reports are not created: {Ex}', file=sys.stderr)
+            logger.error(f'Reports are not created: {Ex}')
+            return EXIT_OUTPUT_ERROR
+        print_summary(results)
+        return EXIT_OK if all(error is None for error in results.values()) else EXIT_FAILED
+
+    try:
+        path_report_file = create_report(access_token, user_ids[0], args, statistics)
+        if statistics is not None:
+            save_statistics(statistics, args.statistics)
+    except VkApiError as Ex:
+        print(f'The report is not created, VK API error: {Ex}', file=sys.stderr)
+        logger.error(f'The report is not created, VK API error: {Ex}')
+        return EXIT_FAILED
+    except OSError as Ex:
+        print(f'The report is not created: {Ex}', file=sys.stderr)
+        logger.error(f'The report is not created: {Ex}')
+        return EXIT_OUTPUT_ERROR
+    except ValueError as Ex:
+        print(f'The report is not created: {Ex}', file=sys.stderr)
+        logger.error(f'The report is not created: {Ex}')
+        return EXIT_FAILED
+    logger.info(f'Report successfully created: {path_report_file}')
+    print(f'Report successfully created: {path_report_file}', file=sys.stderr)
+    return EXIT_OK
+
+
+def run_interactive(args: argparse.Namespace) -> int:
+    """
+    Asks the parameters of the report with input() and creates it
+    :param args: (argparse.Namespace) arguments of the command line
+    :return: (int) exit code
+    """
+    from loguru import logger
+    from services import get_app_launch_info_from_user, create_and_fill_vk_friends_report, VkApiError
 
     print('Hello, welcome to VK get friends report service')
     print('-----------------------------------------------')
@@ -17,19 +253,66 @@ def main():
                  Make sure the entered data is correct and try again''')
         print(f'Error: {Ex}')
         logger.error(f'An error occurred while passing parameters to start the service: {Ex}')
-        sexit()
+        return EXIT_USAGE
     else:
         logger.info('Parameters to start the service successfully accepted')
 
         print('-----------------------------------------------')
         print('........Preparing report file........Please wait........')
-        create_and_fill_vk_friends_report(access_token, user_id, format_report_file, path_report_file)
+        try:
+            create_and_fill_vk_friends_report(access_token, user_id, format_report_file, path_report_file,
+                                              resume=args.resume)
+        except VkApiError as Ex:
+            print(f'The report is not created, VK API error: {Ex}')
+            logger.error(f'The report is not created, VK API error: {Ex}')
+            return EXIT_FAILED
+        except OSError as Ex:
+            print(f'The report is not created: {Ex}')
+            logger.error(f'The report is not created: {Ex}')
+            return EXIT_OUTPUT_ERROR
+        except ValueError as Ex:
+            print(f'The report is not created: {Ex}')
+            logger.error(f'The report is not created: {Ex}')
+            return EXIT_FAILED
 
         logger.info(f'Report successfully created: {path_report_file}.{format_report_file}')
         print('---------------------------------------------------------------')
         print(f'Report successfully created: {path_report_file}.{format_report_file}')
+        return EXIT_OK
+
+
+def main(argv: list[str] | None = None) -> int:
+    """
+    :param argv: (list[str] | None) arguments of the command line (sys.argv[1:] if None)
+    :return: (int) exit code
+    """
+    args = create_argument_parser().parse_args(argv)
+    try:
+        user_ids = read_user_ids_from_arguments(args)
+    except OSError as Ex:
+        print(f'User ids are not read: {Ex}', file=sys.stderr)
+        return EXIT_USAGE
+    if not user_ids and (args.user_ids or args.user_ids_file):
+        print('There are no user ids', file=sys.stderr)
+        return EXIT_USAGE
+
+    from metrics import print_metrics_summary
+    try:
+        if user_ids:
+            exit_code = run_non_interactive(args, user_ids)
+        else:
+            exit_code = run_interactive(args)
+    except KeyboardInterrupt:
+        print('Interrupted', file=sys.stderr)
+        return EXIT_INTERRUPTED
+    if exit_code in (EXIT_OK, EXIT_FAILED):
+        # the report may be in stdout, so the summary goes to stderr in non-interactive mode
+        print_metrics_summary(path=args.metrics_file, output_format=args.metrics_format,
+                              output=sys.stderr if user_ids else sys.stdout)
+    return exit_code
 
 
 if __name__ == '__main__':
+    from loguru import logger
     logger.add(open('file.log', 'w'), format='{time} {level} {message}')
-    main()
+    sys.exit(main())
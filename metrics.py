@@ -0,0 +1,201 @@
+import os
+import json
+from time import monotonic
+from threading import Lock
+from contextlib import contextmanager
+
+from loguru import logger
+
+
+# Metrics of a run: counters (requests, bytes, retries...) and timings (latency of requests, parsing, writing...)
+# Services record to the module-level registry METRICS, main.py and batch.py print the summary at the end of the run
+# and can dump the metrics as json or as a Prometheus textfile (for node_exporter textfile collector)
+
+
+# upper bounds of histogram buckets of timings (seconds)
+TIMING_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class Timing:
+    """
+    Number, sum, max and histogram of observed durations
+    """
+    def __init__(self):
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.buckets = [0] * len(TIMING_BUCKETS)        # not cumulative, the last bucket of Prometheus is count
+
+    def observe(self, seconds: float):
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+        for index, upper_bound in enumerate(TIMING_BUCKETS):
+            if seconds <= upper_bound:
+                self.buckets[index] += 1
+                break
+
+    def get_dict(self) -> dict:
+        return {'count': self.count, 'sum': self.sum, 'max': self.max,
+                'buckets': dict(zip(map(str, TIMING_BUCKETS), self.buckets))}
+
+
+def _make_key(name: str, labels: dict) -> tuple:
+    return name, tuple(sorted(labels.items()))
+
+
+def _format_key(key: tuple) -> str:
+    name, labels = key
+    if not labels:
+        return name
+    return name + '{' + ','.join(f'{label}="{value}"' for label, value in labels) + '}'
+
+
+def _format_value(value: float) -> str:
+    """
+    Counters and sums are printed exactly (format ':g' rounds them to 6 significant digits)
+    :param value: (float)
+    :return: (str)
+    """
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class Metrics:
+    """
+    Thread safe registry of counters and timings, both can have labels:
+    metrics.increment('vk_requests_total', method='friends.get')
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self.counters: dict[tuple, float] = {}
+        self.timings: dict[tuple, Timing] = {}
+
+    def increment(self, name: str, value: float = 1, **labels):
+        """
+        Increases the counter
+        :param name: (str) name of the counter, for example 'vk_requests_total'
+        :param value: (float)
+        :param labels: (str) labels of the counter, for example method='friends.get'
+        """
+        key = _make_key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, **labels):
+        """
+        Adds the duration to the timing
+        :param name: (str) name of the timing, for example 'vk_request_seconds'
+        :param seconds: (float)
+        :param labels: (str) labels of the timing, for example method='friends.get'
+        """
+        key = _make_key(name, labels)
+        with self._lock:
+            timing = self.timings.get(key)
+            if timing is None:
+                timing = self.timings[key] = Timing()
+            timing.observe(seconds)
+
+    @contextmanager
+    def time(self, name: str, **labels):
+        """
+        Context manager observing the duration of its block: with metrics.time('parse_seconds'): ...
+        """
+        start = monotonic()
+        try:
+            yield
+        finally:
+            self.observe(name, monotonic() - start, **labels)
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.timings.clear()
+
+    def get_dict(self) -> dict:
+        """
+        :return: (dict) {'counters': {name{labels}: value}, 'timings': {name{labels}: {count, sum, max, buckets}}}
+        """
+        with self._lock:
+            return {'counters': {_format_key(key): value for key, value in sorted(self.counters.items())},
+                    'timings': {_format_key(key): timing.get_dict() for key, timing in sorted(self.timings.items())}}
+
+    def format_summary(self) -> str:
+        """
+        :return: (str) human readable table of all counters and timings
+        """
+        lines = []
+        with self._lock:
+            for key, value in sorted(self.counters.items()):
+                lines.append(f'{_format_key(key):<60} {_format_value(value)}')
+            for key, timing in sorted(self.timings.items()):
+                mean = timing.sum / timing.count if timing.count else 0
+                lines.append(f'{_format_key(key):<60} count {timing.count}, total {timing.sum:.3f} s, '
+                             f'mean {mean * 1000:.1f} ms, max {timing.max * 1000:.1f} ms')
+        return '\n'.join(lines)
+
+    def format_prometheus(self, prefix: str = 'vk_friends_report_') -> str:
+        """
+        :param prefix: (str) prefix of all metric names
+        :return: (str) metrics in Prometheus text format (timings are histograms)
+        """
+        lines = []
+        with self._lock:
+            for name in sorted({key[0] for key in self.counters}):
+                lines.append(f'# TYPE {prefix}{name} counter')
+                for key, value in sorted(self.counters.items()):
+                    if key[0] == name:
+                        lines.append(f'{prefix}{_format_key(key)} {_format_value(value)}')
+            for name in sorted({key[0] for key in self.timings}):
+                lines.append(f'# TYPE {prefix}{name} histogram')
+                for (timing_name, labels), timing in sorted(self.timings.items()):
+                    if timing_name != name:
+                        continue
+                    cumulative = 0
+                    for upper_bound, number in zip(TIMING_BUCKETS, timing.buckets):
+                        cumulative += number
+                        bucket_key = (f'{name}_bucket', labels + (('le', upper_bound),))
+                        lines.append(f'{prefix}{_format_key(bucket_key)} {cumulative}')
+                    bucket_key = (f'{name}_bucket', labels + (('le', '+Inf'),))
+                    lines.append(f'{prefix}{_format_key(bucket_key)} {timing.count}')
+                    lines.append(f'{prefix}{_format_key((f"{name}_sum", labels))} {_format_value(timing.sum)}')
+                    lines.append(f'{prefix}{_format_key((f"{name}_count", labels))} {timing.count}')
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, path: str, output_format: str = 'json'):
+        """
+        Writes metrics to the file (atomically, so a collector never reads a half-written file)
+        :param path: (str)
+        :param output_format: (str) 'json' or 'prometheus'
+        """
+        if output_format == 'prometheus':
+            data = self.format_prometheus()
+        else:
+            data = json.dumps(self.get_dict(), indent=2)
+        with open(f'{path}.tmp', 'w', encoding='UTF-8') as metrics_file:
+            metrics_file.write(data)
+        os.replace(f'{path}.tmp', path)
+        logger.info(f'Metrics are written to {path}')
+
+
+METRICS = Metrics()
+
+
+def print_metrics_summary(metrics: Metrics = METRICS, path: str | None = None, output_format: str = 'json',
+                          output=None):
+    """
+    Prints and logs the summary of the run, writes metrics to the file if the path is given
+    :param metrics: (Metrics)
+    :param path: (str | None) file for the machine readable dump
+    :param output_format: (str) 'json' or 'prometheus'
+    :param output: (TextIO | None) stream for the summary (sys.stdout if None)
+    """
+    summary = metrics.format_summary()
+    print('---------------------------------------------------------------', file=output)
+    print('Metrics of the run:', file=output)
+    print(summary, file=output)
+    logger.info(f'Metrics of the run:\n{summary}')
+    if path:
+        metrics.dump(path, output_format)
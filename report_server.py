@@ -0,0 +1,521 @@
+import os
+import sys
+import json
+import glob
+import uuid
+import shutil
+import sqlite3
+import argparse
+from time import time
+from threading import Thread, Lock, Condition, Event
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+from loguru import logger
+
+from config import ACCESS_TOKENS_ENV, REQUESTS_PER_SECOND, VK_API_URL, USE_EXECUTE, FRIENDS_PER_REQUEST, \
+    REPORT_FILE_BUFFER_SIZE, SQLITE_BUSY_TIMEOUT, SERVER_HOST, SERVER_PORT, SERVER_WORKERS, REPORT_FIELDS
+from services import AdaptiveRateLimiter, available_formats, available_compressions, create_session, \
+    create_and_fill_vk_friends_report, get_report_file_name, check_report_fields, TokenPool, read_access_tokens
+from cache import ResponseCache
+from metrics import METRICS
+
+
+# Long-running local HTTP service creating reports for many jobs without process startup per report:
+# python report_server.py --directory jobs --port 8080 --workers 4
+# curl -X POST localhost:8080/jobs -d '{"user_id": "1", "format": "csv"}'        -> {"id": "...", "status": "queued"}
+# curl localhost:8080/jobs/<id>                                                   -> status of the job
+# curl localhost:8080/jobs/<id>/report -o report.csv                              -> the report of the finished job
+# Jobs are kept in a sqlite database, jobs interrupted by a restart are continued from their checkpoints
+
+# statuses of jobs
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = 'queued', 'running', 'done', 'failed', 'cancelled'
+
+# max size of the body of POST /jobs (in bytes)
+MAX_REQUEST_BODY_SIZE = 16 * 1024 * 1024
+
+content_types = {'csv': 'text/csv; charset=utf-8', 'tsv': 'text/tab-separated-values; charset=utf-8',
+                 'json': 'application/json', 'ndjson': 'application/x-ndjson',
+                 'sqlite': 'application/vnd.sqlite3', 'parquet': 'application/vnd.apache.parquet',
+                 'gzip': 'application/gzip', 'zstd': 'application/zstd'}
+
+
+def parse_job(data) -> dict:
+    """
+    Checks the description of a job sent by a client
+    :param data: (dict) {"user_id": "1", "format": "csv", "compression": null, "fields": ["first_name", "city"]}
+                 (fields of reports are REPORT_FIELDS if "fields" is null)
+    :return: (dict) user_id, format, compression and fields of the job
+    """
+    if not isinstance(data, dict):
+        raise ValueError('a job must be a json object')
+    unknown_keys = set(data) - {'user_id', 'format', 'compression', 'fields'}
+    if unknown_keys:
+        raise ValueError(f'unknown keys of the job: {", ".join(sorted(unknown_keys))}')
+    user_id = data.get('user_id')
+    if isinstance(user_id, int) and not isinstance(user_id, bool):
+        user_id = str(user_id)
+    if not isinstance(user_id, str) or not user_id.strip():
+        raise ValueError('"user_id" is required')
+    format_report_file = data.get('format') or 'csv'
+    if format_report_file not in available_formats:
+        raise ValueError(f'"format" must be one of {", ".join(available_formats)}')
+    compression = data.get('compression')
+    if compression is not None and compression not in available_compressions:
+        raise ValueError(f'"compression" must be one of {", ".join(available_compressions)} or null')
+    if compression and format_report_file == 'sqlite':
+        raise ValueError('sqlite reports are not compressed')
+    fields = data.get('fields')
+    if fields is not None:
+        if not isinstance(fields, list) or not all(isinstance(field, str) for field in fields):
+            raise ValueError('"fields" must be a list of field names or null')
+        fields = list(check_report_fields(fields))
+    return {'user_id': user_id.strip(), 'format': format_report_file, 'compression': compression, 'fields': fields}
+
+
+class JobQueue:
+    """
+    Persistent thread safe queue of report jobs in a sqlite database
+    Jobs are taken in the order of submission, jobs left running by a stopped server are queued again on opening
+    """
+
+    def __init__(self, path: str):
+        """
+        Opens (creates if necessary) the database of jobs
+        :param path: (str) path of the database file
+        """
+        self._lock = Lock()
+        self._job_added = Condition(self._lock)
+        self._connection = sqlite3.connect(path, timeout=SQLITE_BUSY_TIMEOUT, check_same_thread=False,
+                                           isolation_level=None)
+        self._connection.row_factory = sqlite3.Row
+        self._connection.execute('PRAGMA journal_mode = WAL')
+        self._connection.execute('PRAGMA synchronous = NORMAL')
+        self._connection.execute('CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, user_id TEXT NOT NULL, '
+                                 'format TEXT NOT NULL, compression TEXT, fields TEXT, status TEXT NOT NULL, '
+                                 'error TEXT, created REAL NOT NULL, started REAL, finished REAL)')
+        self._connection.execute('CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status)')
+        number_of_interrupted = self._connection.execute('UPDATE jobs SET status = ?, started = NULL '
+                                                         'WHERE status = ?', (QUEUED, RUNNING)).rowcount
+        if number_of_interrupted:
+            logger.info(f'{number_of_interrupted} interrupted jobs are queued again')
+
+    @staticmethod
+    def _make_job(row: sqlite3.Row | None) -> dict | None:
+        if row is None:
+            return None
+        job = dict(row)
+        job['fields'] = json.loads(job['fields']) if job['fields'] is not None else None
+        return job
+
+    def submit(self, jobs: list[dict]) -> list[dict]:
+        """
+        Adds jobs to the end of the queue (all or none of them)
+        :param jobs: (list[dict]) results of parse_job
+        :return: (list[dict]) added jobs with their ids and statuses
+        """
+        created = time()
+        rows = [(uuid.uuid4().hex, job['user_id'], job['format'], job['compression'],
+                 json.dumps(job['fields']) if job['fields'] is not None else None, QUEUED, created) for job in jobs]
+        with self._lock:
+            self._connection.execute('BEGIN IMMEDIATE')
+            try:
+                self._connection.executemany('INSERT INTO jobs (id, user_id, format, compression, fields, status, '
+                                             'created) VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+            except BaseException:
+                self._connection.execute('ROLLBACK')
+                raise
+            self._connection.execute('COMMIT')
+            self._job_added.notify(len(rows))
+        METRICS.increment('server_jobs_submitted_total', len(rows))
+        return [{'id': row[0], **job, 'status': QUEUED, 'error': None, 'created': created, 'started': None,
+                 'finished': None} for row, job in zip(rows, jobs)]
+
+    def _take_queued(self) -> dict | None:
+        """
+        Marks the oldest queued job running (must be called with self._lock)
+        :return: (dict | None) the job, None if there are no queued jobs
+        """
+        row = self._connection.execute('SELECT id FROM jobs WHERE status = ? ORDER BY rowid LIMIT 1',
+                                       (QUEUED,)).fetchone()
+        if row is None:
+            return None
+        self._connection.execute('UPDATE jobs SET status = ?, started = ? WHERE id = ?', (RUNNING, time(), row['id']))
+        return self._make_job(self._connection.execute('SELECT * FROM jobs WHERE id = ?', (row['id'],)).fetchone())
+
+    def take(self, timeout: float) -> dict | None:
+        """
+        Takes the oldest queued job and marks it running
+        :param timeout: (float) seconds to wait for a job if the queue is empty
+        :return: (dict | None) the job, None if there is no job after timeout (or after wake_up)
+        """
+        with self._lock:
+            job = self._take_queued()
+            if job is None:
+                self._job_added.wait(timeout)
+                job = self._take_queued()
+        return job
+
+    def wake_up(self):
+        """
+        Wakes up all threads waiting in take() (for example to stop them)
+        """
+        with self._lock:
+            self._job_added.notify_all()
+
+    def finish(self, job_id: str, error: str | None = None):
+        """
+        Marks the running job done (or failed)
+        :param job_id: (str)
+        :param error: (str | None) error message if the job failed
+        """
+        status = DONE if error is None else FAILED
+        with self._lock:
+            self._connection.execute('UPDATE jobs SET status = ?, error = ?, finished = ? WHERE id = ?',
+                                     (status, error, time(), job_id))
+        METRICS.increment('server_jobs_finished_total', status=status)
+
+    def get(self, job_id: str) -> dict | None:
+        """
+        :param job_id: (str)
+        :return: (dict | None) the job, None if there is no such job
+        """
+        with self._lock:
+            return self._make_job(self._connection.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone())
+
+    def list(self, status: str | None = None, limit: int = 100, offset: int = 0) -> list[dict]:
+        """
+        :param status: (str | None) only jobs with this status (all jobs if None)
+        :param limit: (int)
+        :param offset: (int)
+        :return: (list[dict]) jobs in the order of submission
+        """
+        query, params = 'SELECT * FROM jobs', ()
+        if status is not None:
+            query, params = query + ' WHERE status = ?', (status,)
+        with self._lock:
+            rows = self._connection.execute(f'{query} ORDER BY rowid LIMIT ? OFFSET ?',
+                                            params + (limit, offset)).fetchall()
+        return [self._make_job(row) for row in rows]
+
+    def count(self) -> dict[str, int]:
+        """
+        :return: (dict[str, int]) status -> number of jobs
+        """
+        with self._lock:
+            rows = self._connection.execute('SELECT status, count(*) FROM jobs GROUP BY status').fetchall()
+        return {status: number for status, number in rows}
+
+    def cancel(self, job_id: str) -> bool:
+        """
+        Cancels the queued job
+        :param job_id: (str)
+        :return: (bool) False if the job is not queued
+        """
+        with self._lock:
+            return self._connection.execute('UPDATE jobs SET status = ?, finished = ? WHERE id = ? AND status = ?',
+                                            (CANCELLED, time(), job_id, QUEUED)).rowcount == 1
+
+    def delete(self, job_id: str) -> bool:
+        """
+        Deletes the finished (done, failed or cancelled) job
+        :param job_id: (str)
+        :return: (bool) False if the job is queued, running or does not exist
+        """
+        with self._lock:
+            return self._connection.execute('DELETE FROM jobs WHERE id = ? AND status IN (?, ?, ?)',
+                                            (job_id, DONE, FAILED, CANCELLED)).rowcount == 1
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+class ReportServer:
+    """
+    HTTP server of report jobs with a pool of worker threads
+    All workers share one keep-alive session, one AdaptiveRateLimiter (the access token is the same)
+    and one response cache, so a job does not pay for new connections and jobs together do not exceed
+    REQUESTS_PER_SECOND. With a TokenPool workers share the pool, every token has its own limit.
+    An error in one job does not stop the others
+    Reports are written to "directory/reports/<job id>.<format>", jobs are kept in "directory/jobs.sqlite"
+    """
+
+    def __init__(self, directory: str, access_token: 'str | TokenPool', host: str = SERVER_HOST,
+                 port: int = SERVER_PORT, workers: int = SERVER_WORKERS, api_url: str = VK_API_URL,
+                 use_execute: bool = USE_EXECUTE, cache: ResponseCache | None = None,
+                 friends_per_request: int = FRIENDS_PER_REQUEST):
+        """
+        Creates (but does not start) the server
+        :param directory: (str) directory of the database of jobs and of reports
+        :param access_token: (str | TokenPool) VK access token or pool of tokens of all jobs
+        :param host: (str)
+        :param port: (int) 0 - any free port
+        :param workers: (int) number of jobs running at the same time
+        :param api_url: (str) base url of VK API methods
+        :param use_execute: (bool) request chunks with VK API method "execute" (see create_and_fill_vk_friends_report)
+        :param cache: (ResponseCache | None) cache of VK responses shared by all jobs
+        :param friends_per_request: (int) number friends at one chunk
+        """
+        self.directory = directory
+        self.reports_directory = os.path.join(directory, 'reports')
+        os.makedirs(self.reports_directory, exist_ok=True)
+        self.access_token = access_token
+        self.api_url = api_url
+        self.use_execute = use_execute
+        self.cache = cache
+        self.friends_per_request = friends_per_request
+        self.queue = JobQueue(os.path.join(directory, 'jobs.sqlite'))
+        self.rate_limiter = AdaptiveRateLimiter(REQUESTS_PER_SECOND)
+        self.session = create_session(workers)
+        self._stopped = Event()
+        self._workers = [Thread(target=self._run_worker, name=f'report-worker-{number}', daemon=True)
+                         for number in range(workers)]
+        self._httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self._httpd.daemon_threads = True
+        self._thread = Thread(target=self._httpd.serve_forever, kwargs={'poll_interval': 0.1}, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def get_path_of_report_file(self, job: dict) -> str:
+        """
+        :param job: (dict)
+        :return: (str) path of the report file of the job without extension
+        """
+        return os.path.join(self.reports_directory, job['id'])
+
+    def start(self):
+        for worker in self._workers:
+            worker.start()
+        self._thread.start()
+        logger.info(f'Report server is listening on {self.url} with {len(self._workers)} workers')
+
+    def stop(self, wait: bool = True):
+        """
+        Stops accepting requests and jobs
+        :param wait: (bool) wait for running jobs, otherwise they are continued from checkpoints after a restart
+        """
+        self._stopped.set()
+        self.queue.wake_up()
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        if wait:
+            for worker in self._workers:
+                worker.join()
+            self.queue.close()
+            self.session.close()
+
+    def join(self):
+        """
+        Waits until the server is stopped
+        """
+        self._thread.join()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def _run_worker(self):
+        while not self._stopped.is_set():
+            job = self.queue.take(timeout=1)
+            if job is not None:
+                self.queue.finish(job['id'], self.run_job(job))
+
+    def run_job(self, job: dict) -> str | None:
+        """
+        Creates the report of the job (continues it from the checkpoint if the job was interrupted)
+        :param job: (dict)
+        :return: (str | None) None if the report is created, otherwise error message
+        """
+        logger.info(f'Job {job["id"]} started: report for user {job["user_id"]} ({job["format"]})')
+        try:
+            with METRICS.time('server_job_seconds', format=job['format']):
+                create_and_fill_vk_friends_report(self.access_token, job['user_id'], job['format'],
+                                                  self.get_path_of_report_file(job), workers=1,
+                                                  rate_limiter=self.rate_limiter, session=self.session,
+                                                  api_url=self.api_url, use_execute=self.use_execute,
+                                                  cache=self.cache, resume=True,
+                                                  friends_per_request=self.friends_per_request,
+                                                  compression=job['compression'],
+                                                  fields=job['fields'] or REPORT_FIELDS)
+        except (Exception, SystemExit) as Ex:      # VK errors and broken responses should not stop other jobs
+            logger.error(f'Job {job["id"]} failed: {Ex!r}')
+            return repr(Ex)
+        logger.info(f'Job {job["id"]} done')
+        return None
+
+    def delete_files_of_job(self, job: dict):
+        """
+        Removes the report file of the job and its checkpoint
+        :param job: (dict)
+        """
+        for path in glob.glob(glob.escape(self.get_path_of_report_file(job)) + '.*'):
+            os.remove(path)
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'      # keep-alive
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                parts = url.path.strip('/').split('/')
+                if parts == ['health']:
+                    self._send_json(200, {'status': 'ok', 'workers': len(server._workers),
+                                          'jobs': server.queue.count()})
+                elif parts == ['metrics']:
+                    self._send(200, METRICS.format_prometheus().encode('UTF-8'), 'text/plain; version=0.0.4')
+                elif parts == ['jobs']:
+                    self._list_jobs(parse_qs(url.query))
+                elif len(parts) == 2 and parts[0] == 'jobs':
+                    job = self._get_job(parts[1])
+                    if job is not None:
+                        self._send_json(200, job)
+                elif len(parts) == 3 and parts[0] == 'jobs' and parts[2] == 'report':
+                    job = self._get_job(parts[1])
+                    if job is not None:
+                        self._send_report(job)
+                else:
+                    self._send_error(404, 'not found')
+
+            def do_POST(self):
+                if urlparse(self.path).path.strip('/') != 'jobs':
+                    self._send_error(404, 'not found')
+                    return
+                try:
+                    length = int(self.headers.get('Content-Length', 0))
+                except ValueError:
+                    length = -1
+                if not 0 <= length <= MAX_REQUEST_BODY_SIZE:
+                    self._send_error(400, f'Content-Length must be from 0 to {MAX_REQUEST_BODY_SIZE} bytes')
+                    self.close_connection = True        # the body is not read
+                    return
+                try:
+                    data = json.loads(self.rfile.read(length) or b'null')
+                    jobs = [parse_job(item) for item in data] if isinstance(data, list) else [parse_job(data)]
+                except ValueError as Ex:        # json.JSONDecodeError is a ValueError too
+                    self._send_error(400, str(Ex))
+                    return
+                added_jobs = server.queue.submit(jobs)
+                self._send_json(202, added_jobs if isinstance(data, list) else added_jobs[0])
+
+            def do_DELETE(self):
+                parts = urlparse(self.path).path.strip('/').split('/')
+                if len(parts) != 2 or parts[0] != 'jobs':
+                    self._send_error(404, 'not found')
+                    return
+                job = self._get_job(parts[1])
+                if job is None:
+                    return
+                if server.queue.cancel(job['id']):
+                    self._send_json(200, server.queue.get(job['id']))
+                elif server.queue.delete(job['id']):
+                    server.delete_files_of_job(job)
+                    self._send_json(200, {**job, 'status': 'deleted'})
+                else:
+                    self._send_error(409, f'the job is {job["status"]}')
+
+            def _get_job(self, job_id: str) -> dict | None:
+                """
+                :return: (dict | None) the job, None if there is no such job (the answer 404 is sent)
+                """
+                job = server.queue.get(job_id)
+                if job is None:
+                    self._send_error(404, f'no job {job_id}')
+                return job
+
+            def _list_jobs(self, query: dict):
+                status = query.get('status', [None])[0]
+                try:
+                    limit = min(int(query.get('limit', ['100'])[0]), 10000)
+                    offset = int(query.get('offset', ['0'])[0])
+                except ValueError:
+                    self._send_error(400, '"limit" and "offset" must be integers')
+                    return
+                self._send_json(200, {'counts': server.queue.count(),
+                                      'jobs': server.queue.list(status, limit, offset)})
+
+            def _send_report(self, job: dict):
+                if job['status'] != DONE:
+                    self._send_error(409, f'the job is {job["status"]}')
+                    return
+                path = get_report_file_name(server.get_path_of_report_file(job), job['format'], job['compression'])
+                try:
+                    report_file = open(path, 'rb')
+                except FileNotFoundError:
+                    self._send_error(410, 'the report file is removed')
+                    return
+                with report_file:
+                    self.send_response(200)
+                    self.send_header('Content-Type', content_types[job['compression'] or job['format']])
+                    self.send_header('Content-Length', str(os.fstat(report_file.fileno()).st_size))
+                    self.send_header('Content-Disposition', f'attachment; filename="{job["user_id"]}'
+                                                            f'{os.path.basename(path)[len(job["id"]):]}"')
+                    self.end_headers()
+                    shutil.copyfileobj(report_file, self.wfile, REPORT_FILE_BUFFER_SIZE)
+
+            def _send_error(self, status: int, message: str):
+                self._send_json(status, {'error': message})
+
+            def _send_json(self, status: int, data: dict | list):
+                self._send(status, json.dumps(data, ensure_ascii=False).encode('UTF-8'),
+                           'application/json; charset=utf-8')
+
+            def _send(self, status: int, body: bytes, content_type: str):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logger.debug(f'{self.address_string()} {format % args}')
+
+        return Handler
+
+
+def main():
+    argument_parser = argparse.ArgumentParser(description='HTTP server creating VK friends reports for queued jobs')
+    argument_parser.add_argument('--directory', default='jobs', help='directory of the database of jobs and reports')
+    argument_parser.add_argument('--host', default=SERVER_HOST)
+    argument_parser.add_argument('--port', type=int, default=SERVER_PORT)
+    argument_parser.add_argument('--workers', type=int, default=SERVER_WORKERS,
+                                 help='number of jobs running at the same time')
+    argument_parser.add_argument('--execute', action='store_true', default=USE_EXECUTE,
+                                 help='request up to 25 chunks of friends in one web request with VK API "execute"')
+    argument_parser.add_argument('--cache-dir', help='directory of the cache of VK responses (no cache by default)')
+    argument_parser.add_argument('--token-file', help='file with access tokens (one per line), several tokens make '
+                                                      'jobs faster (each token has its own rate limit)')
+    argument_parser.add_argument('--api-url', default=VK_API_URL, help=argparse.SUPPRESS)
+    args = argument_parser.parse_args()
+
+    # from the file, from the environment (ACCESS_TOKENS or ACCESS_TOKEN) or from file "config.py"
+    access_tokens = read_access_tokens(args.token_file)
+    if not access_tokens:
+        print(f'No access token: use --token-file, set the environment variable {ACCESS_TOKENS_ENV} (or ACCESS_TOKEN) '
+              f'or ACCESS_TOKEN in "config.py"', file=sys.stderr)
+        return 3
+    access_token = access_tokens[0] if len(access_tokens) == 1 else TokenPool(access_tokens)
+    cache = ResponseCache(args.cache_dir) if args.cache_dir else None
+    server = ReportServer(args.directory, access_token, args.host, args.port, args.workers, api_url=args.api_url,
+                          use_execute=args.execute, cache=cache)
+    server.start()
+    print(f'Listening on {server.url}, press Ctrl+C to stop')
+    try:
+        server.join()
+    except KeyboardInterrupt:
+        # running jobs are not waited for, they are continued from their checkpoints after the next start
+        server.stop(wait=False)
+    return 0
+
+
+if __name__ == '__main__':
+    logger.add(open('file.log', 'w'), format='{time} {level} {message}')
+    sys.exit(main())
@@ -1,18 +1,49 @@
+import io
 import json
+import gzip
+import math
+import importlib.util
 import os
+import re
+import sys
 import csv
-from sys import exit as sexit
-from time import sleep
-from typing import NamedTuple, Literal
-from datetime import datetime
+import random
+import sqlite3
+from time import sleep, monotonic
+from threading import Lock, Thread, Event
+from queue import Queue, Full, Empty
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Future
+from typing import NamedTuple, Literal, IO
+from datetime import datetime, date, timezone
 from abc import abstractmethod, ABC
+from functools import lru_cache
+from array import array
+from json.encoder import encode_basestring
 
 import requests
 from loguru import logger
-
-from config import ACCESS_TOKEN, FRIENDS_PER_REQUEST
-
-available_formats = ('csv', 'tsv', 'json')
+try:
+    import orjson                   # optional fast json backend (encoding of reports, decoding of VK responses)
+except ImportError:
+    orjson = None
+
+from metrics import METRICS
+from aggregates import FriendsStatistics
+from config import ACCESS_TOKEN, FRIENDS_PER_REQUEST, REQUESTS_PER_SECOND, WORKERS, VK_API_URL, VK_API_VERSION, \
+    PAGES_PER_EXECUTE, USE_EXECUTE, REPORT_FILE_BUFFER_SIZE, JSON_BACKEND, PARQUET_ROW_GROUP_SIZE, RETRY_ATTEMPTS, \
+    RETRY_BASE_DELAY, RETRY_MAX_DELAY, REQUEST_TIMEOUT, RETRYABLE_VK_ERROR_CODES, FRIEND_IDS_PER_REQUEST, \
+    USERS_PER_REQUEST, PIPELINE_QUEUE_SIZE, PARSE_PROCESSES, GZIP_COMPRESS_LEVEL, ZSTD_COMPRESS_LEVEL, \
+    SQLITE_BUSY_TIMEOUT, REPORT_FIELDS, STREAM_JSON_ITEMS, ACCESS_TOKENS_ENV, TOKEN_THROTTLE_SIDELINE, \
+    TOKEN_ERROR_SIDELINE, TOKEN_ERROR_CODES
+
+available_formats = ('csv', 'tsv', 'json', 'ndjson', 'sqlite')
+if importlib.util.find_spec('pyarrow'):            # parquet reports require optional package pyarrow
+    available_formats += ('parquet',)
+available_compressions = ('gzip',)
+if importlib.util.find_spec('zstandard'):          # zstd compression requires optional package zstandard
+    available_compressions += ('zstd',)
+compression_extensions = {'gzip': 'gz', 'zstd': 'zst'}
 
 # USER
 
@@ -27,15 +58,9 @@ class User(NamedTuple):
 
     def __eq__(self, other):        # Needed for tests
         if isinstance(other, User):
-            is_equals_first_name = self.first_name == other.first_name
-            is_equals_last_name = self.last_name == other.last_name
-            is_equals_country = self.country == other.country
-            is_equals_city = self.city == other.city
-            is_equals_birth_date = self.birth_date == other.birth_date
-            is_equals_sex = self.sex == other.sex
-            return all((is_equals_first_name, is_equals_last_name, is_equals_country, is_equals_city,
-                        is_equals_birth_date, is_equals_sex))
-
+            return tuple.__eq__(self, other)
+        if isinstance(other, UserView):
+            return tuple.__eq__(self, tuple(other))
         return False
 
     def get_dict(self) -> dict:
@@ -60,69 +85,568 @@ class User(NamedTuple):
     sex: str | None
 
 
+class UserView:
+    """
+    Lightweight read-only view of one user in UserStore, behaves like User (attributes, iteration, get_dict)
+    """
+    __slots__ = ('_store', '_index')
+
+    def __init__(self, store: 'UserStore', index: int):
+        self._store = store
+        self._index = index
+
+    first_name = property(lambda self: self._store.first_names[self._index])
+    last_name = property(lambda self: self._store.last_names[self._index])
+    country = property(lambda self: self._store.get_value('country', self._index))
+    city = property(lambda self: self._store.get_value('city', self._index))
+    birth_date = property(lambda self: self._store.get_value('birth_date', self._index))
+    sex = property(lambda self: self._store.get_value('sex', self._index))
+
+    def __iter__(self):
+        return iter(self._store.get_row(self._index))
+
+    def __len__(self):
+        return len(User.user_fields())
+
+    def __getitem__(self, item):
+        return self._store.get_row(self._index)[item]
+
+    def __eq__(self, other):
+        if isinstance(other, (User, UserView)):
+            return self._store.get_row(self._index) == tuple(other)
+        return False
+
+    def __repr__(self):
+        return repr(self.to_user()).replace('User(', 'UserView(', 1)
+
+    def to_user(self) -> User:
+        """
+        Creates User with the same data
+        :return: (User)
+        """
+        return User._make(self._store.get_row(self._index))
+
+    def get_dict(self) -> dict:
+        """
+        Convert user to dict object
+        :return: user_dict (dict)
+        """
+        return dict(zip(User.user_fields(), self._store.get_row(self._index)))
+
+
+class UserStore:
+    """
+    Compact storage of many users (for buffering big friend lists)
+    Names are kept in lists, values of country, city, birth_date and sex are interned: the store keeps every distinct
+    value once and an array of its numbers for users
+    store[i] returns UserView, store.rows() returns tuples (like User) without creating objects for every user
+    The store keeps only User.user_fields() (reports with other fields get a projection of them, see iter_rows)
+    """
+    __slots__ = ('first_names', 'last_names', '_values', '_numbers_of_values', '_columns')
+    fields = User.user_fields()
+    interned_fields = ('country', 'city', 'birth_date', 'sex')
+
+    def __init__(self, list_of_users: list[User] = ()):
+        """
+        Creates a store
+        :param list_of_users: (list[User]) users to add to the store
+        """
+        self.first_names: list[str] = []
+        self.last_names: list[str] = []
+        self._values: dict[str, list] = {field: [None] for field in self.interned_fields}      # 0 is None
+        self._numbers_of_values: dict[str, dict] = {field: {None: 0} for field in self.interned_fields}
+        self._columns: dict[str, array] = {field: array('I') for field in self.interned_fields}
+        if list_of_users:
+            self.extend(list_of_users)
+
+    def _intern(self, field: str, values: list) -> array:
+        """
+        Converts values of the field to numbers of distinct values
+        :param field: (str) one of interned_fields
+        :param values: (list)
+        :return: (array) numbers of values
+        """
+        numbers_of_values = self._numbers_of_values[field]
+        distinct_values = self._values[field]
+        numbers = array('I')
+        for value in values:
+            number = numbers_of_values.get(value)
+            if number is None:
+                number = numbers_of_values[value] = len(distinct_values)
+                distinct_values.append(value)
+            numbers.append(number)
+        return numbers
+
+    def add_columns(self, columns: dict[str, list]):
+        """
+        Adds users given as columns (for example VkResponseData.columns)
+        :param columns: (dict[str, list]) field name -> list of values
+        """
+        self.first_names.extend(columns['first_name'])
+        self.last_names.extend(columns['last_name'])
+        for field in self.interned_fields:
+            self._columns[field].extend(self._intern(field, columns[field]))
+
+    def extend(self, list_of_users: list[User]):
+        """
+        Adds users
+        :param list_of_users: (list[User])
+        """
+        if not list_of_users:
+            return
+        columns = zip(*list_of_users)
+        self.add_columns(dict(zip(User.user_fields(), (list(column) for column in columns))))
+
+    def append(self, user: User):
+        self.extend([user])
+
+    def get_value(self, field: str, index: int):
+        """
+        :param field: (str) one of interned_fields
+        :param index: (int) index of user
+        :return: value of the field of the user
+        """
+        return self._values[field][self._columns[field][index]]
+
+    def get_row(self, index: int) -> tuple:
+        """
+        :param index: (int) index of user
+        :return: (tuple) values of the user in the order of User.user_fields()
+        """
+        values, columns = self._values, self._columns
+        return (self.first_names[index], self.last_names[index],
+                values['country'][columns['country'][index]], values['city'][columns['city'][index]],
+                values['birth_date'][columns['birth_date'][index]], values['sex'][columns['sex'][index]])
+
+    def rows(self):
+        """
+        :return: (Iterator[tuple]) values of every user in the order of User.user_fields()
+        """
+        values, columns = self._values, self._columns
+        return zip(self.first_names, self.last_names,
+                   map(values['country'].__getitem__, columns['country']),
+                   map(values['city'].__getitem__, columns['city']),
+                   map(values['birth_date'].__getitem__, columns['birth_date']),
+                   map(values['sex'].__getitem__, columns['sex']))
+
+    def __len__(self):
+        return len(self.first_names)
+
+    def __getitem__(self, index: int) -> UserView:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('UserStore index out of range')
+        return UserView(self, index)
+
+    def __iter__(self):
+        return (UserView(self, index) for index in range(len(self)))
+
+
+def iter_rows(list_of_users: list[User] | UserStore, fields: tuple = User.user_fields()):
+    """
+    Returns users as tuples of values (for report files), without creating objects for users of UserStore
+    :param list_of_users: (list[User] | UserStore) users with values of fields (UserStore is projected to fields)
+    :param fields: (tuple) fields of the report file
+    :return: (Iterable[tuple])
+    :raises ValueError: if UserStore does not have some of fields
+    """
+    if not isinstance(list_of_users, UserStore):
+        return list_of_users
+    if fields == UserStore.fields:
+        return list_of_users.rows()
+    missing_fields = [field for field in fields if field not in UserStore.fields]
+    if missing_fields:
+        raise ValueError(f'UserStore has no fields {", ".join(missing_fields)} of the report')
+    indexes = [UserStore.fields.index(field) for field in fields]
+    return (tuple(row[index] for index in indexes) for row in list_of_users.rows())
+
+
+# Fields of reports
+
+class ReportField(NamedTuple):
+    """
+    Field of friends that can be in reports
+    """
+    name: str                   # name of the column in reports
+    vk_fields: tuple            # values of the "fields" param of VK API needed for it (VK always returns id and names)
+    type: type                  # str or int: type of the column in sqlite and parquet reports
+
+
+# every field of reports, a report has any of them in any order (User.user_fields() by default)
+report_fields: dict[str, ReportField] = {field.name: field for field in (
+    ReportField('id', (), int),
+    ReportField('first_name', (), str),
+    ReportField('last_name', (), str),
+    ReportField('country', ('country',), str),
+    ReportField('city', ('city',), str),
+    ReportField('birth_date', ('bdate',), str),                # '1998-03-02' or '03-02' (without year)
+    ReportField('sex', ('sex',), str),                         # 'Female' or 'Male'
+    ReportField('domain', ('domain',), str),                   # short address of the page, for example 'durov'
+    ReportField('last_seen', ('last_seen',), str),             # UTC time of the last visit, '2024-01-31T23:59:59'
+    ReportField('education', ('education',), str),             # name of the university
+    ReportField('graduation', ('education',), int),            # year of graduation
+)}
+
+# VK returns objects of friends (not only ids) only if some fields are requested, "sex" is the shortest one
+_MINIMAL_VK_FIELD = 'sex'
+
+
+def check_report_fields(fields) -> tuple:
+    """
+    Checks names of fields of a report
+    :param fields: (Iterable[str] | str) names of fields, a string is split by commas ('first_name,last_name')
+    :return: (tuple) names of fields
+    """
+    if isinstance(fields, str):
+        fields = [field.strip() for field in fields.split(',') if field.strip()]
+    fields = tuple(fields)
+    unknown_fields = [field for field in fields if field not in report_fields]
+    if unknown_fields:
+        raise ValueError(f'Unknown fields of reports: {", ".join(map(str, unknown_fields))}, '
+                         f'available: {", ".join(report_fields)}')
+    if not fields:
+        raise ValueError('A report must have at least one field')
+    if len(set(fields)) != len(fields):
+        raise ValueError(f'Fields of the report are repeated: {", ".join(fields)}')
+    return fields
+
+
+def get_vk_fields(fields: tuple) -> str:
+    """
+    :param fields: (tuple) names of fields of the report
+    :return: (str) value of the "fields" param of friends.get and users.get with only VK fields needed for the report
+             ('sex, bdate, city, country' for User.user_fields())
+    """
+    # reversed: User.user_fields() gives the same param as before, so keys of cached responses do not change
+    vk_fields = [vk_field for field in reversed(fields) for vk_field in report_fields[field].vk_fields]
+    return ', '.join(dict.fromkeys(vk_fields)) or _MINIMAL_VK_FIELD
+
+
+# JSON encoding
+
+def _encode_json_value(value) -> str:
+    """
+    Encodes one value of User to json (the same result as json.dumps(value, ensure_ascii=False))
+    :param value: (str | int | None)
+    :return: (str)
+    """
+    if value.__class__ is str:
+        return encode_basestring(value)
+    if value is None:
+        return 'null'
+    return json.dumps(value, ensure_ascii=False)
+
+
+def make_user_json_encoder(fields: tuple = User.user_fields(), backend: str = JSON_BACKEND):
+    """
+    Creates a function that converts User to a json object string without creating a dict for every user
+    "stdlib" backend: key names are encoded once into a template, the result is the same as
+                      json.dumps(user.get_dict(), ensure_ascii=False)
+    "orjson" backend: uses orjson (if installed), the result is compact json
+    :param fields: (tuple) names of keys in the order of values of User
+    :param backend: (str) "stdlib" or "orjson"
+    :return: (Callable[[User], str])
+    """
+    if backend == 'orjson':
+        if orjson is None:
+            raise ImportError('json backend "orjson" requires the orjson package (pip install orjson)')
+        return lambda user: orjson.dumps(dict(zip(fields, user))).decode('UTF-8')
+
+    keys = [encode_basestring(field).replace('%', '%%') for field in fields]
+    template = '{' + ', '.join(f'{key}: %s' for key in keys) + '}'
+    return lambda user: template % tuple(map(_encode_json_value, user))
+
+
+# JSON decoding
+
+_json_decoder = json.JSONDecoder()
+_json_whitespace = re.compile(r'[ \t\n\r]*')
+_vk_response_start = re.compile(rb'[ \t\n\r]*{[ \t\n\r]*"response"[ \t\n\r]*:')
+_vk_response_end = re.compile(rb'][ \t\n\r]*}[ \t\n\r]*}[ \t\n\r]*$')
+
+
+def decode_json(data: bytes | str):
+    """
+    Decodes json with orjson if it is installed, otherwise with the standard library (the result is the same)
+    Bytes are decoded without converting them to str first
+    :param data: (bytes | str)
+    :return: decoded value
+    :raises ValueError: if data is not json
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def is_vk_response_body(body: bytes) -> bool:
+    """
+    Cheap check of the not decoded body of a VK response: True if it looks like a successful response with items
+    ({"response": {..., "items": [...]}}) and is not truncated, errors are small and can be decoded to be checked
+    as usual (so can unusual responses, False only means that the body has to be decoded)
+    :param body: (bytes)
+    :return: (bool)
+    """
+    return _vk_response_start.match(body) is not None and _vk_response_end.search(body, len(body) - 64) is not None
+
+
+def _skip_json_whitespace(text: str, index: int) -> int:
+    return _json_whitespace.match(text, index).end()
+
+
+def _expect_json_char(text: str, index: int, char: str) -> int:
+    """
+    :return: (int) index after the char (whitespace before it is skipped)
+    :raises ValueError: if there is another char
+    """
+    index = _skip_json_whitespace(text, index)
+    if not text.startswith(char, index):
+        raise ValueError(f'Expected {char!r} at position {index} of json')
+    return index + 1
+
+
+def iter_json_items(body: bytes | str, path: tuple = ('response', 'items')):
+    """
+    Generator that parses raw vk response data ({"response": {"count": ..., "items": [...]}}) incrementally and
+    yields items of the array one by one, so dicts of all items of the page do not exist at the same time
+    Other values on the way to the array (for example "count") are parsed and dropped, json after the array
+    is not checked
+    :param body: (bytes | str) not decoded body of the VK response
+    :param path: (tuple) keys of objects leading to the array
+    :return: (Iterator[dict]) items
+    :raises ValueError: if body is not json or there is no array at the path
+    """
+    text = body.decode('UTF-8') if isinstance(body, bytes) else body
+    raw_decode = _json_decoder.raw_decode
+    index = 0
+    for key in path:
+        index = _expect_json_char(text, index, '{')
+        while True:
+            index = _skip_json_whitespace(text, index)
+            if text.startswith('}', index):
+                raise ValueError(f'There is no "{key}" in json')
+            name, index = raw_decode(text, index)
+            index = _expect_json_char(text, index, ':')
+            if name == key:
+                break
+            _, index = raw_decode(text, _skip_json_whitespace(text, index))
+            index = _skip_json_whitespace(text, index)
+            if text.startswith(',', index):
+                index += 1
+    index = _skip_json_whitespace(text, _expect_json_char(text, index, '['))
+    if text.startswith(']', index):
+        return
+    while True:
+        item, index = raw_decode(text, index)
+        yield item
+        index = _skip_json_whitespace(text, index)
+        if text.startswith(',', index):
+            index = _skip_json_whitespace(text, index + 1)
+        elif text.startswith(']', index):
+            return
+        else:
+            raise ValueError(f'Expected \',\' or \']\' at position {index} of json')
+
+
 # Report files
 
+def get_report_file_name(path_report_file: str, format_report_file: str, compression: str | None = None) -> str:
+    """
+    :param path_report_file: (str) path of the report file without extension
+    :param format_report_file: (str)
+    :param compression: (str | None) 'gzip', 'zstd' or None
+    :return: (str) name of the report file, for example 'results/res1.csv' or 'results/res1.csv.gz'
+    """
+    file_name = f'{path_report_file}.{format_report_file}'
+    if compression is None or format_report_file == 'parquet':      # parquet compresses its columns itself
+        return file_name
+    return f'{file_name}.{compression_extensions[compression]}'
+
+
+class _KeepOpenStream(io.RawIOBase):
+    """
+    Raw stream writing to a stream of the caller (sys.stdout.buffer, a pipe, a socket file...)
+    Closing it only flushes the stream of the caller, so the caller can go on using it
+    """
+
+    def __init__(self, stream):
+        self._stream = stream
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        written = self._stream.write(data)
+        return len(data) if written is None else written
+
+    def flush(self):
+        if not self.closed:
+            self._stream.flush()
+
+
 class ReportFile(ABC):
     """
     An abstract class for writing report in different formats
     To create a new format, you must inherit from this class and implement three methods: __init__ , add, complete
+    The file is opened once in __init__ (in self.file) and closed in complete(), writes between them are buffered
+    Can be used as a context manager: with create_and_prepare_file(...) as report_file: ...
+    The report is written to a file (path without extension), to a file descriptor or to a file object of the caller
+    (for example sys.stdout or a pipe, they stay open), with optional streaming gzip/zstd compression
+    commit() returns the position after the written data, a file created with resume_position=position continues
+    from this position (everything written after it is removed). Only uncompressed files given by path are resumable
+    The report has columns of "fields" (see report_fields), users are given as User or tuples in the order of fields
     """
+    file = None
+    resumable = True
+    fields: tuple = User.user_fields()
+    _sink_stream = None             # binary stream under self.file (and under the compressor)
 
     @abstractmethod
-    def __init__(self, path_report_file: str):
+    def __init__(self, path_report_file: str | int | IO, buffer_size: int = REPORT_FILE_BUFFER_SIZE,
+                 resume_position: int | None = None, compression: str | None = None,
+                 fields: tuple = User.user_fields()):
         """
         Creates and prepares a file for writing data
-        :param path_report_file: (str)
+        :param path_report_file: (str | int | IO) path without extension, file descriptor or file object
+        :param buffer_size: (int) size of the write buffer in bytes
+        :param resume_position: (int | None) position returned by commit() to continue an unfinished file from
+        :param compression: (str | None) streaming compression: one of available_compressions or None
+        :param fields: (tuple) names of columns (see report_fields)
         """
         pass
 
+    def _open_sink(self, sink: str | int | IO, format_report_file: str, resume_position: int | None,
+                   compression: str | None, buffer_size: int, newline: str | None = None) -> IO:
+        """
+        Opens the report for writing: creates a new file (or truncates the existing one to resume_position
+        and opens it for appending), or wraps the file descriptor or the file object of the caller
+        :param sink: (str | int | IO) path without extension, file descriptor or file object (binary, or text with
+                     binary buffer like sys.stdout)
+        :param format_report_file: (str) extension of the file
+        :param resume_position: (int | None)
+        :param compression: (str | None) one of available_compressions or None
+        :param buffer_size: (int) size of the write buffer in bytes
+        :param newline: (str | None) newline of the text stream, None - binary stream is returned
+        :return: (IO) text stream (UTF-8) or binary stream for writing the report
+        """
+        if compression is not None and compression not in available_compressions:
+            raise ValueError(f'Unknown compression "{compression}", available: {", ".join(available_compressions)}')
+        self.resumable = self.resumable and isinstance(sink, str) and compression is None
+        if resume_position is not None and not self.resumable:
+            raise ValueError('Only uncompressed report files given by path can be resumed')
+
+        if isinstance(sink, str):
+            path = get_report_file_name(sink, format_report_file, compression)
+            if resume_position is None:
+                sink_stream = open(path, 'wb', buffering=buffer_size)
+            else:
+                with open(path, 'r+b') as unfinished_file:
+                    unfinished_file.truncate(resume_position)
+                sink_stream = open(path, 'ab', buffering=buffer_size)
+        elif isinstance(sink, int):
+            sink_stream = open(sink, 'wb', buffering=buffer_size, closefd=False)
+        else:
+            if isinstance(sink, io.TextIOBase):
+                if not hasattr(sink, 'buffer'):
+                    raise ValueError('Text streams without binary buffer can not be report sinks')
+                sink.flush()                # text written before the report goes first
+                sink = sink.buffer
+            sink_stream = io.BufferedWriter(_KeepOpenStream(sink), buffer_size)
+        self._sink_stream = sink_stream
+
+        stream = sink_stream
+        if compression == 'gzip':
+            stream = gzip.GzipFile(fileobj=sink_stream, mode='wb', compresslevel=GZIP_COMPRESS_LEVEL, mtime=0)
+        elif compression == 'zstd':
+            import zstandard
+            stream = zstandard.ZstdCompressor(level=ZSTD_COMPRESS_LEVEL).stream_writer(sink_stream, closefd=False)
+        if newline is None:
+            return stream
+        return io.TextIOWrapper(stream, encoding='UTF-8', newline=newline)
+
+    def commit(self) -> int:
+        """
+        Flushes the buffer, so everything added before is on the disk
+        :return: (int) position (in bytes) after the written data
+        """
+        if not self.resumable:
+            raise ValueError('The report can not be resumed, so there is no position to commit')
+        self.file.flush()
+        return getattr(self.file, 'buffer', self.file).tell()
+
     @abstractmethod
-    def add(self, list_of_users: list[User]):
+    def add(self, list_of_users: list[User] | UserStore):
         """
         Appends data to an existing file
-        :param list_of_users: (list[User])
+        :param list_of_users: (list[User] | UserStore)
         """
         pass
 
     @abstractmethod
     def complete(self):
         """
-        Refine the file if necessary
+        Refine the file if necessary, flush the buffer and close the file
         :return:
         """
         pass
 
+    def close(self):
+        """
+        Flushes the buffer and closes the file (without refining), file objects of the caller stay open
+        """
+        if self.file is not None and not self.file.closed:
+            self.file.close()
+        if self._sink_stream is not None and not self._sink_stream.closed:
+            self._sink_stream.close()           # the compressor does not close its stream
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.complete()
+        else:
+            self.close()
+
 
 class CsvReportFile(ReportFile):
     """
     Class for writing report in csv file report
     """
 
-    def __init__(self, path_report_file: str):
+    def __init__(self, path_report_file: str | int | IO, buffer_size: int = REPORT_FILE_BUFFER_SIZE,
+                 resume_position: int | None = None, compression: str | None = None,
+                 fields: tuple = User.user_fields()):
         """
         Creates a csv file in path_report_file and writes table header
         For example: if path_report_file = 'results/res1', 'results/res1.csv' will be created
-        :param path_report_file: (str)
+        :param path_report_file: (str | int | IO) path without extension, file descriptor or file object
+        :param buffer_size: (int) size of the write buffer in bytes
+        :param resume_position: (int | None) position returned by commit() to continue an unfinished file from
+        :param compression: (str | None) 'gzip' or 'zstd' - the file is compressed while it is written ('.gz', '.zst')
+        :param fields: (tuple) names of columns (see report_fields)
         """
         self.path_report_file = path_report_file     # Saves the path to an instance of the class
-        with open(f'{path_report_file}.csv', 'w', encoding='UTF-8', newline='') as csv_file:  # Creating csv file and
-            writer = csv.writer(csv_file, delimiter=',')
-            writer.writerow(User.user_fields())                                               # write table header
-
-    def add(self, list_of_users: list[User]):
+        self.fields = fields
+        self.file = self._open_sink(path_report_file, 'csv', resume_position, compression, buffer_size,
+                                    newline='')
+        self._writer = csv.writer(self.file, delimiter=',')
+        if resume_position is None:
+            self._writer.writerow(self.fields)                                                # write table header
+            self.file.flush()
+
+    def add(self, list_of_users: list[User] | UserStore):
         """
         Adds user records to a csv file
-        :param list_of_users: (list[User])
+        :param list_of_users: (list[User] | UserStore)
         """
-        with open(f'{self.path_report_file}.csv', 'a', encoding='UTF-8', newline='') as csv_file:
-            writer = csv.writer(csv_file, delimiter=',')
-            writer.writerows(list_of_users)
+        self._writer.writerows(iter_rows(list_of_users, self.fields))
 
     def complete(self):
         """
-        This is not necessary for csv files
+        Flushes the buffer and closes the csv file
         """
-        pass
+        self.close()
 
 
 class TsvReportFile(ReportFile):
@@ -130,64 +654,359 @@ class TsvReportFile(ReportFile):
     Class for writing report in tsv file report
     """
 
-    def __init__(self, path_report_file: str):
+    def __init__(self, path_report_file: str | int | IO, buffer_size: int = REPORT_FILE_BUFFER_SIZE,
+                 resume_position: int | None = None, compression: str | None = None,
+                 fields: tuple = User.user_fields()):
         """
         Creates a tsv file in path_report_file and writes table header
         For example: if path_report_file = 'results/res1', 'results/res1.tsv' will be created
-        :param path_report_file: (str)
+        :param path_report_file: (str | int | IO) path without extension, file descriptor or file object
+        :param buffer_size: (int) size of the write buffer in bytes
+        :param resume_position: (int | None) position returned by commit() to continue an unfinished file from
+        :param compression: (str | None) 'gzip' or 'zstd' - the file is compressed while it is written ('.gz', '.zst')
+        :param fields: (tuple) names of columns (see report_fields)
         """
         self.path_report_file = path_report_file      # Saves the path to an instance of the class
-        with open(f'{path_report_file}.tsv', 'w', encoding='UTF-8', newline='') as tsv_file:   # Creating tsv file and
-            writer = csv.writer(tsv_file, delimiter='\t')
-            writer.writerow(User.user_fields())                                                # write table header
-
-    def add(self, list_of_users: list[User]):
+        self.fields = fields
+        self.file = self._open_sink(path_report_file, 'tsv', resume_position, compression, buffer_size,
+                                    newline='')
+        self._writer = csv.writer(self.file, delimiter='\t')
+        if resume_position is None:
+            self._writer.writerow(self.fields)                                                # write table header
+            self.file.flush()
+
+    def add(self, list_of_users: list[User] | UserStore):
         """
         Adds user records to a tsv file
-        :param list_of_users: (list[User])
+        :param list_of_users: (list[User] | UserStore)
         """
-        with open(f'{self.path_report_file}.tsv', 'a', encoding='UTF-8', newline='') as tsv_file:
-            writer = csv.writer(tsv_file, delimiter='\t')
-            writer.writerows(list_of_users)
+        self._writer.writerows(iter_rows(list_of_users, self.fields))
 
     def complete(self):
         """
-        This is not necessary for tsv files
+        Flushes the buffer and closes the tsv file
         """
-        pass
+        self.close()
 
 
 class JsonReportFile(ReportFile):
     """
-    Class for writing report in json file report
+    Class for writing report in json file report (json list of objects, one object per line)
     """
 
-    def __init__(self, path_report_file: str):
+    def __init__(self, path_report_file: str | int | IO, buffer_size: int = REPORT_FILE_BUFFER_SIZE,
+                 resume_position: int | None = None, json_backend: str = JSON_BACKEND,
+                 compression: str | None = None, fields: tuple = User.user_fields()):
         """
         Creates a json file in path_report_file and writes '[' to start creation json_list
         For example: if path_report_file = 'results/res1', 'results/res1.json' will be created
-        :param path_report_file: (str)
+        :param path_report_file: (str | int | IO) path without extension, file descriptor or file object
+        :param buffer_size: (int) size of the write buffer in bytes
+        :param resume_position: (int | None) position returned by commit() to continue an unfinished file from
+        :param json_backend: (str) "stdlib" or "orjson" (see make_user_json_encoder)
+        :param compression: (str | None) 'gzip' or 'zstd' - the file is compressed while it is written ('.gz', '.zst')
+        :param fields: (tuple) names of keys of objects (see report_fields)
         """
         self.path_report_file = path_report_file    # Saves the path to an instance of the class
-        with open(f'{path_report_file}.json', 'w', encoding='UTF-8', newline='\n') as json_file:
-            json_file.write('[')
+        self.fields = fields
+        self._encode_user = make_user_json_encoder(fields, backend=json_backend)
+        # the first object is written without a separator ('[' takes 1 byte)
+        self._is_empty = resume_position is None or resume_position <= 1
+        self.file = self._open_sink(path_report_file, 'json', resume_position, compression, buffer_size,
+                                    newline='\n')
+        if resume_position is None:
+            self.file.write('[')
+            self.file.flush()
+
+    def add(self, list_of_users: list[User] | UserStore):
+        """
+        Adds user records to a json file (one write for the whole chunk), objects are separated by ',\\n'
+        :param list_of_users: (list[User] | UserStore)
+        """
+        if not list_of_users:
+            return
+        users_json = ',\n'.join(map(self._encode_user, iter_rows(list_of_users, self.fields)))
+        self.file.write(users_json if self._is_empty else ',\n' + users_json)
+        self._is_empty = False
 
-    def add(self, list_of_users: list[User]):
+    def complete(self):
         """
-        Adds user records to a json file
-        :param list_of_users: (list[User])
+        Writes to file ']' to finish json_list, flushes the buffer and closes the json file
         """
-        with open(f'{self.path_report_file}.json', 'a', encoding='UTF-8', newline='\n') as json_file:
-            for user in list_of_users:
-                user_json = json.dumps(user.get_dict(), ensure_ascii=False)
-                json_file.write(user_json+',\n')
+        if not self.file.closed:
+            self.file.write(']\n')
+        self.close()
+
+
+class NdjsonReportFile(ReportFile):
+    """
+    Class for writing report in ndjson file report (one json object per line, can be read line by line)
+    """
+
+    def __init__(self, path_report_file: str | int | IO, buffer_size: int = REPORT_FILE_BUFFER_SIZE,
+                 resume_position: int | None = None, json_backend: str = JSON_BACKEND,
+                 compression: str | None = None, fields: tuple = User.user_fields()):
+        """
+        Creates an ndjson file in path_report_file
+        For example: if path_report_file = 'results/res1', 'results/res1.ndjson' will be created
+        :param path_report_file: (str | int | IO) path without extension, file descriptor or file object
+        :param buffer_size: (int) size of the write buffer in bytes
+        :param resume_position: (int | None) position returned by commit() to continue an unfinished file from
+        :param json_backend: (str) "stdlib" or "orjson" (see make_user_json_encoder)
+        :param compression: (str | None) 'gzip' or 'zstd' - the file is compressed while it is written ('.gz', '.zst')
+        :param fields: (tuple) names of keys of objects (see report_fields)
+        """
+        self.path_report_file = path_report_file    # Saves the path to an instance of the class
+        self.fields = fields
+        self._encode_user = make_user_json_encoder(fields, backend=json_backend)
+        self.file = self._open_sink(path_report_file, 'ndjson', resume_position, compression, buffer_size,
+                                    newline='\n')
+
+    def add(self, list_of_users: list[User] | UserStore):
+        """
+        Adds user records to an ndjson file (one write for the whole chunk)
+        :param list_of_users: (list[User] | UserStore)
+        """
+        self.file.write(''.join(self._encode_user(user) + '\n' for user in iter_rows(list_of_users, self.fields)))
 
     def complete(self):
         """
-        Writes to file ']' to finish json_list
+        Flushes the buffer and closes the ndjson file
         """
-        with open(f'{self.path_report_file}.json', 'a', encoding='UTF-8', newline='\n') as json_file:
-            json_file.write(']')
+        self.close()
+
+
+class ParquetReportFile(ReportFile):
+    """
+    Class for writing report in parquet file report (columnar format for pandas/polars/spark, requires pyarrow)
+    Columns country, city and sex are dictionary encoded, birth_date has date type (null if the year is unknown),
+    birth_month and birth_day are stored separately, so the date without the year is not lost
+    The file is valid only after complete(), so it can not be resumed
+    """
+    resumable = False
+    _dictionary_fields = ('country', 'city', 'sex')          # few distinct values
+
+    def __init__(self, path_report_file: str | int | IO, buffer_size: int = REPORT_FILE_BUFFER_SIZE,
+                 resume_position: int | None = None, row_group_size: int = PARQUET_ROW_GROUP_SIZE,
+                 compression: str | None = None, fields: tuple = User.user_fields()):
+        """
+        Creates a parquet file in path_report_file
+        For example: if path_report_file = 'results/res1', 'results/res1.parquet' will be created
+        :param path_report_file: (str | int | IO) path without extension, file descriptor or file object
+        :param buffer_size: (int) size of the write buffer in bytes
+        :param resume_position: (int | None) parquet files can not be resumed, must be None
+        :param row_group_size: (int) number of users in one row group (users are collected from several add() calls)
+        :param compression: (str | None) 'gzip' or 'zstd' - compression codec of the columns ('zstd' if None)
+        :param fields: (tuple) names of columns (see report_fields)
+        """
+        if resume_position is not None:
+            raise ValueError('Parquet reports can not be resumed (the file is valid only after complete())')
+        import pyarrow
+        import pyarrow.parquet
+
+        self._pyarrow = pyarrow
+        self.path_report_file = path_report_file    # Saves the path to an instance of the class
+        self.fields = fields
+        self._row_group_size = row_group_size
+        self._users: list[tuple] = []               # users of the next row group
+        self._dictionary_type = pyarrow.dictionary(pyarrow.int32(), pyarrow.string())
+        schema = []
+        for field in fields:
+            if field == 'birth_date':
+                schema += [('birth_date', pyarrow.date32()), ('birth_month', pyarrow.int8()),
+                           ('birth_day', pyarrow.int8())]
+            elif field in self._dictionary_fields:
+                schema.append((field, self._dictionary_type))
+            else:
+                schema.append((field, pyarrow.int64() if report_fields[field].type is int else pyarrow.string()))
+        self._schema = pyarrow.schema(schema)
+        if compression not in (None, 'gzip', 'zstd'):
+            raise ValueError(f'Unknown compression "{compression}" of parquet reports, available: gzip, zstd')
+        self.file = self._open_sink(path_report_file, 'parquet', None, None, buffer_size)
+        self._writer = pyarrow.parquet.ParquetWriter(self.file, self._schema, compression=compression or 'zstd')
+
+    def add(self, list_of_users: list[User] | UserStore):
+        """
+        Collects user records, writes a row group when row_group_size users are collected
+        :param list_of_users: (list[User] | UserStore)
+        """
+        self._users.extend(iter_rows(list_of_users, self.fields))
+        while len(self._users) >= self._row_group_size:
+            self._write_row_group(self._users[:self._row_group_size])
+            del self._users[:self._row_group_size]
+
+    def _write_row_group(self, users: list[tuple]):
+        """
+        Converts users to columns and writes them as one row group
+        :param users: (list[tuple]) values of users in the order of self.fields
+        """
+        pyarrow = self._pyarrow
+        columns = []
+        for field, values in zip(self.fields, zip(*users)):
+            if field == 'birth_date':
+                dates, months, days = [], [], []
+                for birth_date in values:
+                    if not birth_date:
+                        dates.append(None)
+                        months.append(None)
+                        days.append(None)
+                    elif len(birth_date) == 10:                  # '1998-03-02'
+                        dates.append(date.fromisoformat(birth_date))
+                        months.append(int(birth_date[5:7]))
+                        days.append(int(birth_date[8:10]))
+                    else:                                        # '03-02' (without year)
+                        dates.append(None)
+                        months.append(int(birth_date[:2]))
+                        days.append(int(birth_date[3:5]))
+                columns += [pyarrow.array(dates, pyarrow.date32()), pyarrow.array(months, pyarrow.int8()),
+                            pyarrow.array(days, pyarrow.int8())]
+            elif field in self._dictionary_fields:
+                columns.append(pyarrow.array(values, pyarrow.string()).dictionary_encode().cast(self._dictionary_type))
+            else:
+                columns.append(pyarrow.array(values, self._schema.field(field).type))
+        self._writer.write_table(pyarrow.Table.from_arrays(columns, schema=self._schema))
+
+    def commit(self) -> int:
+        """
+        Parquet files can not be resumed, so there is no position to commit
+        """
+        raise ValueError('Parquet reports can not be resumed (the file is valid only after complete())')
+
+    def complete(self):
+        """
+        Writes the last row group and the parquet footer, flushes the buffer and closes the parquet file
+        """
+        if not self.file.closed:
+            if self._users:
+                self._write_row_group(self._users)
+                self._users = []
+            self._writer.close()
+        self.close()
+
+
+class SqliteReportFile(ReportFile):
+    """
+    Class for writing report in sqlite database (table "friends", can be queried with sql without rescanning files)
+    Friends of many users can be kept in one database: rows are keyed by owner_id (the user whose friends they are)
+    and position (order of the friend in the report), a new report of the user replaces the previous one
+    The table has columns of fields of the report (birth_date is accompanied by birth_month and birth_day), columns of
+    other fields are added when a report with them is written to the same database (values of other reports are null)
+    Every add() is one transaction (executemany), indexes on country, city, birth month and sex are built in complete()
+    Positions of commit() are numbers of written friends of the owner (not bytes)
+    """
+    _indexes = {'friends_country_city': ('country', 'city'),
+                'friends_city': ('city',),
+                'friends_birth_month': ('birth_month', 'birth_day'),
+                'friends_sex': ('sex',)}
+
+    def __init__(self, path_report_file: str | int | IO, buffer_size: int = REPORT_FILE_BUFFER_SIZE,
+                 resume_position: int | None = None, compression: str | None = None, owner_id: str = '',
+                 fields: tuple = User.user_fields()):
+        """
+        Creates a sqlite database in path_report_file (or opens the existing one) and removes previous friends
+        of the owner (friends after resume_position if it is given)
+        For example: if path_report_file = 'results/res1', 'results/res1.sqlite' will be created
+        :param path_report_file: (str) path without extension (databases can not be written to streams)
+        :param buffer_size: (int) size of the page cache of sqlite in bytes
+        :param resume_position: (int | None) position returned by commit() to continue an unfinished report from
+        :param compression: (str | None) must be None, sqlite databases are not compressed
+        :param owner_id: (str) VK id of the user whose friends are in the report
+        :param fields: (tuple) names of columns (see report_fields)
+        """
+        if not isinstance(path_report_file, str):
+            raise ValueError('Sqlite reports can be written only to a file given by path')
+        if compression is not None:
+            raise ValueError('Sqlite reports can not be compressed')
+        self.path_report_file = path_report_file    # Saves the path to an instance of the class
+        self.fields = fields
+        self.owner_id = str(owner_id)
+        self._position = resume_position or 0
+        columns = {}
+        for field in fields:
+            columns[field] = 'INTEGER' if report_fields[field].type is int else 'TEXT'
+            if field == 'birth_date':
+                columns.update(birth_month='INTEGER', birth_day='INTEGER')
+        self._birth_date_index = fields.index('birth_date') if 'birth_date' in fields else None
+        self._insert = (f'INSERT INTO friends (owner_id, position, {", ".join(columns)}) '
+                        f'VALUES ({", ".join("?" * (len(columns) + 2))})')
+        # the connection is made by one thread and used by the writer thread of the pipeline (never at the same time)
+        self._connection = sqlite3.connect(f'{path_report_file}.sqlite', timeout=SQLITE_BUSY_TIMEOUT,
+                                           isolation_level=None, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode = WAL')     # readers do not block the writer and vice versa
+        self._connection.execute('PRAGMA synchronous = NORMAL')   # WAL stays consistent, fsync only at checkpoints
+        self._connection.execute(f'PRAGMA cache_size = {-max(buffer_size // 1024, 2000)}')    # in KiB
+        self._connection.execute('PRAGMA temp_store = MEMORY')
+        with self._transaction():
+            self._connection.execute(f'CREATE TABLE IF NOT EXISTS friends (owner_id TEXT NOT NULL, '
+                                     f'position INTEGER NOT NULL, '
+                                     f'{"".join(f"{name} {type_}, " for name, type_ in columns.items())}'
+                                     f'PRIMARY KEY (owner_id, position)) WITHOUT ROWID')
+            table_columns = {row[1] for row in self._connection.execute('PRAGMA table_info(friends)')}
+            for name, type_ in columns.items():
+                if name not in table_columns:          # the database has reports with other fields
+                    self._connection.execute(f'ALTER TABLE friends ADD COLUMN {name} {type_}')
+            self._connection.execute('DELETE FROM friends WHERE owner_id = ? AND position >= ?',
+                                     (self.owner_id, self._position))
+
+    def _transaction(self):
+        """
+        :return: context manager of a transaction: "BEGIN IMMEDIATE" ... "COMMIT" (or "ROLLBACK" after an error)
+        """
+        self._connection.execute('BEGIN IMMEDIATE')         # takes the write lock at once, waits for other writers
+        return self._connection
+
+    def add(self, list_of_users: list[User] | UserStore):
+        """
+        Inserts user records into the database in one transaction
+        :param list_of_users: (list[User] | UserStore)
+        """
+        rows = []
+        owner_id, birth_date_index = self.owner_id, self._birth_date_index
+        for user in iter_rows(list_of_users, self.fields):
+            key = (owner_id, self._position + len(rows))
+            if birth_date_index is None:
+                rows.append(key + tuple(user))
+                continue
+            birth_date = user[birth_date_index]
+            birth_month = birth_day = None
+            if birth_date:                                   # '1998-03-02' or '03-02' (without year)
+                birth_month, birth_day = int(birth_date[-5:-3]), int(birth_date[-2:])
+            rows.append(key + tuple(user[:birth_date_index + 1]) + (birth_month, birth_day)
+                        + tuple(user[birth_date_index + 1:]))
+        if not rows:
+            return
+        with self._transaction():
+            self._connection.executemany(self._insert, rows)
+        self._position += len(rows)
+
+    def commit(self) -> int:
+        """
+        Every add() is committed already
+        :return: (int) number of written friends of the owner
+        """
+        return self._position
+
+    def complete(self):
+        """
+        Builds indexes (if they do not exist yet), updates statistics of the query planner and closes the database
+        """
+        if self._connection is not None:
+            with self._transaction():
+                table_columns = {row[1] for row in self._connection.execute('PRAGMA table_info(friends)')}
+                for name, columns in self._indexes.items():
+                    if table_columns.issuperset(columns):
+                        self._connection.execute(f'CREATE INDEX IF NOT EXISTS {name} ON friends '
+                                                 f'({", ".join(columns)})')
+            self._connection.execute('PRAGMA optimize')
+        self.close()
+
+    def close(self):
+        """
+        Closes the database (without building indexes), the last transaction is committed already
+        """
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
 
 
 # Functions
@@ -223,6 +1042,30 @@ def get_access_token() -> str:
     return access_token
 
 
+def parse_access_tokens(text: str) -> list[str]:
+    """
+    :param text: (str) access tokens separated by commas, whitespace or new lines (lines starting with # are comments)
+    :return: (list[str]) tokens without repeats in the order of the text
+    """
+    lines = [line for line in text.splitlines() if not line.lstrip().startswith('#')]
+    return list(dict.fromkeys(token for token in re.split(r'[\s,]+', ' '.join(lines)) if token))
+
+
+def read_access_tokens(path: str | None = None) -> list[str]:
+    """
+    Reads access tokens without questions (for the command line, batch and the report server)
+    :param path: (str | None) file with tokens (one per line), if None, tokens are taken from the environment variable
+                 ACCESS_TOKENS_ENV, from the environment variable ACCESS_TOKEN or from "config.py" (the first one set)
+    :return: (list[str]) tokens, empty list if there are no tokens
+    :raises OSError: if the file is not read
+    """
+    if path:
+        with open(path, 'r', encoding='UTF-8') as tokens_file:
+            return parse_access_tokens(tokens_file.read())
+    return (parse_access_tokens(os.environ.get(ACCESS_TOKENS_ENV, '')) or
+            parse_access_tokens(os.environ.get('ACCESS_TOKEN', '')) or parse_access_tokens(ACCESS_TOKEN))
+
+
 def get_format_of_report_file() -> str:
     """
     The function is needed to get the format of the report file from the command line
@@ -259,8 +1102,8 @@ def get_path_of_report_file(format_report_file):
         if path_report_file_temp == '':
             return 'report'
 
-        elif path_report_file_temp[0] == '/':
-            print('Wrong path. Try again')
+        elif path_report_file_temp.endswith(('/', os.sep)):
+            print('Wrong path (file name is missing). Try again')
             continue
         else:
             return path_report_file_temp
@@ -281,8 +1124,8 @@ def get_app_launch_info_from_user():
     print('---------------------------------------------------------------')
     path_report_file = get_path_of_report_file(format_report_file)
 
-    if '/' in path_report_file:   # If the path is in another folder, then need to create it
-        directory_with_file = '/'.join(path_report_file.split('/')[:-1])
+    directory_with_file = os.path.dirname(path_report_file)
+    if directory_with_file:   # If the path is in another folder (relative or absolute), then need to create it
         try:
             os.makedirs(directory_with_file)
             logger.info(f'Successful creating directory {directory_with_file}')
@@ -292,55 +1135,522 @@ def get_app_launch_info_from_user():
     return access_token, vk_user_id, format_report_file, path_report_file
 
 
-def create_and_fill_vk_friends_report(access_token, vk_user_id, format_report_file, path_of_report_file):
+def get_path_of_checkpoint_file(format_report_file: str, path_of_report_file: str, vk_user_id='') -> str:
+    """
+    :param format_report_file: (str)
+    :param path_of_report_file: (str) path of the report file without format
+    :param vk_user_id: (str) owner of the report, a sqlite database keeps reports of many users and every one of them
+                       has its own checkpoint
+    :return: (str) path of the checkpoint of the unfinished report file
+    """
+    if format_report_file == 'sqlite':
+        return f'{path_of_report_file}.{format_report_file}.{vk_user_id}.checkpoint'
+    return f'{path_of_report_file}.{format_report_file}.checkpoint'
+
+
+def get_size_of_report(vk_user_id, format_report_file: str, path_of_report_file: str) -> int:
+    """
+    :param vk_user_id: (str)
+    :param format_report_file: (str)
+    :param path_of_report_file: (str) path of the report file without format
+    :return: (int) size of the report in positions of ReportFile.commit(): bytes of the file or, for sqlite, number
+             of friends of the user in the database
+    :raises OSError: if there is no report file
+    """
+    path = f'{path_of_report_file}.{format_report_file}'
+    if format_report_file != 'sqlite':
+        return os.path.getsize(path)
+    if not os.path.exists(path):
+        raise FileNotFoundError(path)
+    connection = sqlite3.connect(path, timeout=SQLITE_BUSY_TIMEOUT)
+    try:
+        return connection.execute('SELECT count(*) FROM friends WHERE owner_id = ?', (str(vk_user_id),)).fetchone()[0]
+    except sqlite3.Error as Ex:             # there is no table of friends
+        raise OSError(f'Can not read the report {path}: {Ex}') from Ex
+    finally:
+        connection.close()
+
+
+def read_checkpoint(vk_user_id, format_report_file: str, path_of_report_file: str,
+                    friends_per_request: int, fields: tuple = User.user_fields()) -> dict | None:
+    """
+    Reads the checkpoint of the unfinished report file (see write_checkpoint)
+    :param vk_user_id: (str)
+    :param format_report_file: (str)
+    :param path_of_report_file: (str) path of the report file without format
+    :param friends_per_request: (int) number friends at one chunk
+    :param fields: (tuple) fields of the report
+    :return: (dict | None) checkpoint or None if there is no checkpoint, it is broken or made for another report
+             (another user, format, chunk size or fields, or the report is shorter than the checkpoint position)
+    """
+    path_of_checkpoint_file = get_path_of_checkpoint_file(format_report_file, path_of_report_file, vk_user_id)
+    try:
+        with open(path_of_checkpoint_file, 'r', encoding='UTF-8') as checkpoint_file:
+            checkpoint = json.load(checkpoint_file)
+        report_file_size = get_size_of_report(vk_user_id, format_report_file, path_of_report_file)
+        is_suitable = (checkpoint['vk_user_id'] == str(vk_user_id)
+                       and checkpoint['format'] == format_report_file
+                       and checkpoint['friends_per_request'] == friends_per_request
+                       and checkpoint.get('fields', list(User.user_fields())) == list(fields)
+                       and 0 <= checkpoint['position'] <= report_file_size)
+    except (OSError, ValueError, KeyError, TypeError) as Ex:
+        logger.info(f'No checkpoint to resume the report from ({Ex!r})')
+        return None
+    if not is_suitable:
+        logger.info(f'Checkpoint {path_of_checkpoint_file} does not match the report, it is ignored')
+        return None
+    return checkpoint
+
+
+def write_checkpoint(vk_user_id, format_report_file: str, path_of_report_file: str, friends_per_request: int,
+                     next_offset: int, position: int, statistics: FriendsStatistics | None = None,
+                     fields: tuple = User.user_fields()):
+    """
+    Saves the checkpoint of the unfinished report file: the offset of the next chunk of friends and the position
+    in the report file after the last written chunk. The file is replaced atomically, so it is never half-written
+    :param vk_user_id: (str)
+    :param format_report_file: (str)
+    :param path_of_report_file: (str) path of the report file without format
+    :param friends_per_request: (int) number friends at one chunk
+    :param next_offset: (int) offset of the first chunk that is not written yet
+    :param position: (int) result of ReportFile.commit() after the last written chunk
+    :param statistics: (FriendsStatistics | None) statistics of the written chunks (they are not requested again)
+    :param fields: (tuple) fields of the report
+    """
+    path_of_checkpoint_file = get_path_of_checkpoint_file(format_report_file, path_of_report_file, vk_user_id)
+    checkpoint = {'vk_user_id': str(vk_user_id),
+                  'format': format_report_file,
+                  'friends_per_request': friends_per_request,
+                  'fields': list(fields),
+                  'next_offset': next_offset,
+                  'position': position}
+    if statistics is not None:
+        checkpoint['statistics'] = statistics.to_dict()
+    with open(f'{path_of_checkpoint_file}.tmp', 'w', encoding='UTF-8') as checkpoint_file:
+        json.dump(checkpoint, checkpoint_file)
+    os.replace(f'{path_of_checkpoint_file}.tmp', path_of_checkpoint_file)
+
+
+def create_and_fill_vk_friends_report(access_token, vk_user_id, format_report_file, path_of_report_file,
+                                      workers: int = WORKERS, rate_limiter: 'RateLimiter | None' = None,
+                                      session: requests.Session | None = None, api_url: str = VK_API_URL,
+                                      use_execute: bool = USE_EXECUTE, cache=None, resume: bool = False,
+                                      parse_processes: int = PARSE_PROCESSES,
+                                      friends_per_request: int = FRIENDS_PER_REQUEST,
+                                      compression: str | None = None,
+                                      statistics: FriendsStatistics | None = None,
+                                      fields: tuple = REPORT_FIELDS,
+                                      stream_items: bool = STREAM_JSON_ITEMS) -> dict[str, 'StageTimer']:
     """
     A function that implements the main functionality of the application
     It 1) create report file
        2) create vk friends parser
-       3) get from vk api number of friends for the user_id
+       3) get from vk api number of friends for the user_id (not needed with use_execute)
        4) Takes data about friends in chunks (number friends at one chunk is in the variable "friends_per_request")
-       5) Immediately writes these chunks to a file
-       6) Finish report file if necessary
+          If workers > 1, chunks are requested by several threads at the same time, the speed of requests is
+          limited by RateLimiter (REQUESTS_PER_SECOND)
+          If use_execute, up to PAGES_PER_EXECUTE chunks are requested in one web request with VK API "execute"
+          (instead of one request per chunk), number of friends is taken from the first chunk
+       5) Immediately writes these chunks to a file (in offset order, so the report stays sorted by name)
+          After every chunk the checkpoint is saved (see write_checkpoint), so an interrupted report can be resumed
+          Requesting, parsing and writing of chunks are stages of a pipeline, so they overlap (see run_report_pipeline)
+       6) Finish report file if necessary and remove the checkpoint
     :param access_token: (str)
     :param vk_user_id: (str)
     :param format_report_file: (str)
-    :param path_of_report_file: (str)
-    """
-    report_file = create_and_prepare_file(format_report_file, path_of_report_file)
-    parser = VkFriendsParser(access_token, vk_user_id)
-    number_of_friends = parser.get_number_of_friends()
-    friends_per_request = FRIENDS_PER_REQUEST   # number friends at one "chunk"
-    number_of_requests = number_of_friends//friends_per_request + 1
-    for chunk_number in range(number_of_requests):
-        resp_data: dict = parser.get_info_about_friends(offset=chunk_number*friends_per_request,
-                                                        count=friends_per_request)
-        try:
-            vk_resp_data = VkResponseData(resp_data)   # get information about friends
-            list_of_friends = vk_resp_data.list_of_users
-        except Exception as Ex:
-            print(f'An error occurred while parsing vk response data: {Ex}')
-            logger.error(f'An error occurred while parsing vk response data: {Ex}')
-            sexit()
+    :param path_of_report_file: (str | int | IO) path without extension, file descriptor or file object
+                                (for example sys.stdout.buffer), only files given by path are resumable
+    :param workers: (int) number of threads requesting chunks at the same time
+    :param rate_limiter: (RateLimiter | None) limiter shared with other reports using the same access token,
+                         if None, a new AdaptiveRateLimiter(REQUESTS_PER_SECOND) is created
+    :param session: (requests.Session | None) keep-alive session shared with other reports
+    :param api_url: (str) base url of VK API methods
+    :param use_execute: (bool) request chunks with VK API method "execute"
+    :param cache: (cache.ResponseCache | None) cache of VK responses, repeated runs take chunks from it
+    :param resume: (bool) continue the unfinished report file from its checkpoint (if there is a suitable one),
+                   chunks written before the checkpoint are not requested again
+    :param parse_processes: (int) number of processes parsing chunks (0 - chunks are parsed by a thread)
+    :param friends_per_request: (int) number friends at one "chunk" (VK allows up to 5000)
+    :param compression: (str | None) 'gzip' or 'zstd' - the report is compressed while it is written
+    :param statistics: (FriendsStatistics | None) statistics of friends of the report are added to it (statistics of
+                       chunks written before the checkpoint are taken from the checkpoint), only fields of the report
+                       are counted
+    :param fields: (tuple | str) fields of the report (see report_fields, a string is split by commas),
+                   only VK fields needed for them are requested and parsed
+    :param stream_items: (bool) chunks are parsed incrementally from bodies of responses (see VkResponseData),
+                         without decoding whole chunks to dicts (less memory for big chunks)
+    :return: (dict[str, StageTimer]) timings of the stages of the pipeline
+    """
+    fields = check_report_fields(fields)
+    is_path = isinstance(path_of_report_file, str)
+    checkpoint = None
+    if resume and is_path and compression is None:
+        checkpoint = read_checkpoint(vk_user_id, format_report_file, path_of_report_file, friends_per_request,
+                                     fields)
+    if (checkpoint and statistics is not None and 'statistics' in checkpoint
+            and checkpoint['statistics'].get('today') != statistics.today.isoformat()):
+        logger.info('Statistics of the checkpoint are counted at another date, the report is created anew')
+        checkpoint = None
+    first_chunk_number = 0
+    resume_position = None
+    if checkpoint:
+        first_chunk_number = checkpoint['next_offset'] // friends_per_request
+        resume_position = checkpoint['position']
+        logger.info(f'Report is resumed from offset {checkpoint["next_offset"]}')
+    report_statistics = None
+    if statistics is not None:
+        report_statistics = FriendsStatistics(statistics.today)
+        if checkpoint and 'statistics' in checkpoint:
+            report_statistics.merge(FriendsStatistics.from_dict(checkpoint['statistics']))
+        elif checkpoint:
+            logger.warning('The checkpoint has no statistics, they cover only the resumed part of the report')
+
+    with create_and_prepare_file(format_report_file, path_of_report_file, resume_position, compression,
+                                 owner_id=vk_user_id, fields=fields) as report_file:
+        if rate_limiter is None:
+            rate_limiter = AdaptiveRateLimiter(REQUESTS_PER_SECOND)
+        parser = VkFriendsParser(access_token, vk_user_id, rate_limiter=rate_limiter, session=session,
+                                 api_url=api_url, cache=cache, fields=fields, stream_items=stream_items)
+        if use_execute:
+            pages = fetch_pages_of_friends_with_execute(parser, friends_per_request,
+                                                        first_chunk_number=first_chunk_number)
         else:
-            report_file.add(list_of_friends)          # save information about friends to file
-    report_file.complete()
+            number_of_friends = parser.get_number_of_friends()
+            number_of_requests = number_of_friends//friends_per_request + 1
+            offsets = [chunk_number*friends_per_request
+                       for chunk_number in range(first_chunk_number, number_of_requests)]
+            pages = fetch_pages_of_friends(parser, offsets, friends_per_request, workers)
+
+        def save_checkpoint(chunk_index: int):
+            if report_file.resumable:
+                write_checkpoint(vk_user_id, format_report_file, path_of_report_file, friends_per_request,
+                                 next_offset=(first_chunk_number + chunk_index + 1)*friends_per_request,
+                                 position=report_file.commit(), statistics=report_statistics, fields=fields)
+
+        timers = run_report_pipeline(pages, report_file, on_chunk_written=save_checkpoint,
+                                     parse_processes=parse_processes, statistics=report_statistics, fields=fields)
+    if statistics is not None:
+        statistics.merge(report_statistics)         # only complete reports are counted
+
+    if is_path:
+        path_of_checkpoint_file = get_path_of_checkpoint_file(format_report_file, path_of_report_file, vk_user_id)
+        if os.path.exists(path_of_checkpoint_file):
+            os.remove(path_of_checkpoint_file)             # the report is complete, nothing to resume
+    logger.info(f'Report pipeline: {", ".join(map(str, timers.values()))}')
+    return timers
+
+
+def fetch_pages_of_friends(parser, offsets: list[int], count: int, workers: int = 1):
+    """
+    Generator that requests chunks of friends for every offset and yields raw vk response data in offset order
+    If workers > 1, chunks are requested by a pool of threads, but they are still yielded in offset order
+    :param parser: (VkFriendsParser)
+    :param offsets: (list[int]) offsets of chunks
+    :param count: (int) number friends at one chunk
+    :param workers: (int) number of threads requesting chunks at the same time
+    :return: (Iterator[dict | bytes]) raw vk response data (request.json()) or not decoded bodies
+             (see VkFriendsParser.get_info_about_friends) for every offset
+    """
+    if workers <= 1:
+        for offset in offsets:
+            yield parser.get_info_about_friends(offset=offset, count=count)
+        return
+
+    # no more than 2 * workers chunks are requested ahead, so a slow consumer does not make the chunks pile up
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = deque()
+        for offset in offsets:
+            if len(futures) >= 2 * workers:
+                yield futures.popleft().result()
+            futures.append(executor.submit(parser.get_info_about_friends, offset=offset, count=count))
+        while futures:
+            yield futures.popleft().result()
+
+
+def fetch_pages_of_friends_with_execute(parser, count: int, pages_per_execute: int = PAGES_PER_EXECUTE,
+                                        first_chunk_number: int = 0):
+    """
+    Generator that requests all chunks of friends with VK API method "execute" (up to "pages_per_execute" chunks
+    in one web request) and yields raw vk response data in offset order
+    The number of friends is not requested separately, it is taken from the first chunk
+    :param parser: (VkFriendsParser)
+    :param count: (int) number friends at one chunk
+    :param pages_per_execute: (int) number of chunks in one web request (VK allows no more than 25)
+    :param first_chunk_number: (int) chunks before it are skipped (for resumed reports)
+    :return: (Iterator[dict]) raw vk response data for every chunk
+    """
+    number_of_requests = None          # unknown until the first response
+    chunk_number = first_chunk_number
+    while number_of_requests is None or chunk_number < number_of_requests:
+        last_chunk_number = chunk_number + pages_per_execute
+        if number_of_requests is not None:
+            last_chunk_number = min(last_chunk_number, number_of_requests)
+        offsets = [number*count for number in range(chunk_number, last_chunk_number)]
+        pages = parser.get_pages_with_execute(offsets, count)
+        if number_of_requests is None:
+            number_of_requests = max(math.ceil(pages[0]['response']['count'] / count), 1)
+        yield from pages[:max(number_of_requests - chunk_number, 0)]
+        chunk_number = last_chunk_number
+
+
+class StageTimer:
+    """
+    Counters of a stage of the report pipeline: number of processed chunks, time of work (busy) and time of waiting
+    for the other stages (waiting: for input chunks or for free space in the output queue)
+    """
+    def __init__(self, name: str):
+        self.name = name
+        self.items = 0
+        self.busy = 0.0
+        self.waiting = 0.0
 
+    def __repr__(self):
+        return f'{self.name}: {self.items} chunks, busy {self.busy:.3f} s, waiting {self.waiting:.3f} s'
 
-def create_and_prepare_file(format_file: str, path_file: str) -> CsvReportFile | TsvReportFile | JsonReportFile:
+
+class _StageError:
+    """
+    Exception of a stage passed through the queues to the writer, which raises it
+    """
+    def __init__(self, exception: BaseException):
+        self.exception = exception
+
+
+_END_OF_PIPELINE = object()
+
+
+def _put_until_stopped(stage_queue: Queue, item, stop: Event) -> bool:
+    """
+    Puts the item to the bounded queue, waiting for free space (backpressure) until the pipeline is stopped
+    :return: (bool) False if the pipeline is stopped
+    """
+    while not stop.is_set():
+        try:
+            stage_queue.put(item, timeout=0.1)
+            return True
+        except Full:
+            continue
+    return False
+
+
+def _get_until_stopped(stage_queue: Queue, stop: Event):
+    """
+    Takes an item from the queue, waiting until the pipeline is stopped
+    :return: item or _END_OF_PIPELINE if the pipeline is stopped
+    """
+    while not stop.is_set():
+        try:
+            return stage_queue.get(timeout=0.1)
+        except Empty:
+            continue
+    return _END_OF_PIPELINE
+
+
+def _get_from_stage(stage_queue: Queue, thread: Thread):
+    """
+    Takes an item from the queue filled by the thread of the previous stage
+    :return: item
+    :raises RuntimeError: if the thread has stopped without putting _END_OF_PIPELINE or an error to the queue
+    """
+    while True:
+        try:
+            return stage_queue.get(timeout=0.1)
+        except Empty:
+            if thread.is_alive():
+                continue
+        try:
+            return stage_queue.get_nowait()         # the last item could be put just before the thread stopped
+        except Empty:
+            raise RuntimeError(f'Stage {thread.name} stopped without finishing the report') from None
+
+
+def parse_page(vk_data: dict | bytes, statistics_date: date | None = None,
+               fields: tuple = User.user_fields()) -> tuple[list[User], float, FriendsStatistics | None]:
+    """
+    Converts raw vk response data to users (runs in a thread or in a process of the pool)
+    :param vk_data: (dict | bytes) raw vk response data or the not decoded body of the response
+    :param statistics_date: (date | None) if it is given, statistics of the chunk are computed too (ages at this date)
+    :param fields: (tuple) fields of users (see VkResponseData)
+    :return: (tuple[list[User], float, FriendsStatistics | None]) users, time of parsing in seconds and
+             statistics of the chunk (to be merged by the writer)
+    """
+    start = monotonic()
+    statistics = None
+    try:
+        vk_resp_data = VkResponseData(vk_data, fields)
+        if statistics_date is not None:
+            statistics = FriendsStatistics(statistics_date)
+            statistics.add_columns(vk_resp_data.columns)
+    except Exception as Ex:
+        print(f'An error occurred while parsing vk response data: {Ex}', file=sys.stderr)
+        logger.error(f'An error occurred while parsing vk response data: {Ex}')
+        raise ValueError(f'Can not parse vk response data: {Ex!r}') from None
+    return vk_resp_data.list_of_users, monotonic() - start, statistics
+
+
+def run_report_pipeline(pages, report_file: 'ReportFile', on_chunk_written=None,
+                        parse_processes: int = PARSE_PROCESSES,
+                        queue_size: int = PIPELINE_QUEUE_SIZE,
+                        statistics: FriendsStatistics | None = None,
+                        fields: tuple = User.user_fields()) -> dict[str, StageTimer]:
+    """
+    Writes chunks of friends to the report file with three stages working at the same time:
+    fetch (a thread iterating "pages", i.e. requesting chunks) -> parse (a thread, or a pool of processes if
+    parse_processes > 0) -> write (the calling thread, writes chunks in the order of "pages")
+    Stages are connected by queues of no more than queue_size chunks, so a slow stage stops the previous ones and
+    memory does not depend on the number of friends
+    An exception in any stage stops the pipeline and is raised by this function
+    :param pages: (Iterable[dict | bytes]) raw vk response data or not decoded bodies of responses, for example
+                  fetch_pages_of_friends(...) (bodies are sent to processes much faster than dicts)
+    :param report_file: (ReportFile)
+    :param on_chunk_written: (Callable[[int], None] | None) called with the index of the chunk after it is written
+    :param parse_processes: (int) number of processes parsing chunks (0 - chunks are parsed by a thread)
+    :param queue_size: (int) max number of chunks waiting between two stages
+    :param statistics: (FriendsStatistics | None) statistics of every chunk are computed by the parse stage
+                       (in parallel, if there are processes) and merged into it by the writer
+    :param fields: (tuple) fields of users (the same as fields of the report file)
+    :return: (dict[str, StageTimer]) timings of the stages "fetch", "parse", "write"
+    """
+    statistics_date = statistics.today if statistics is not None else None
+    timers = {name: StageTimer(name) for name in ('fetch', 'parse', 'write')}
+    raw_pages, parsed_pages = Queue(queue_size), Queue(queue_size)
+    stop = Event()
+    process_pool = ProcessPoolExecutor(parse_processes) if parse_processes > 0 else None
+
+    def fetch():
+        timer = timers['fetch']
+        iterator = iter(pages)
+        try:
+            while True:
+                start = monotonic()
+                try:
+                    page = next(iterator)
+                except StopIteration:
+                    break
+                timer.busy += monotonic() - start
+                timer.items += 1
+                start = monotonic()
+                if not _put_until_stopped(raw_pages, page, stop):
+                    return
+                timer.waiting += monotonic() - start
+        except BaseException as Ex:          # SystemExit too, it must not be lost in the thread
+            _put_until_stopped(raw_pages, _StageError(Ex), stop)
+            return
+        finally:
+            if hasattr(iterator, 'close'):
+                iterator.close()             # stops requesting chunks ahead
+        _put_until_stopped(raw_pages, _END_OF_PIPELINE, stop)
+
+    def parse():
+        timer = timers['parse']
+        while True:
+            start = monotonic()
+            page = _get_until_stopped(raw_pages, stop)
+            timer.waiting += monotonic() - start
+            if page is _END_OF_PIPELINE or isinstance(page, _StageError):
+                _put_until_stopped(parsed_pages, page, stop)
+                return
+            try:
+                if process_pool:        # time is counted by writer
+                    item = process_pool.submit(parse_page, page, statistics_date, fields)
+                else:
+                    item = parse_page(page, statistics_date, fields)
+            except BaseException as Ex:     # a broken pool of processes too, the writer must not wait forever
+                _put_until_stopped(parsed_pages, _StageError(Ex), stop)
+                return
+            if not process_pool:
+                timer.busy += item[1]
+                timer.items += 1
+            start = monotonic()
+            if not _put_until_stopped(parsed_pages, item, stop):
+                return
+            timer.waiting += monotonic() - start
+
+    threads = [Thread(target=fetch, name='report-fetch', daemon=True),
+               Thread(target=parse, name='report-parse', daemon=True)]
+    for thread in threads:
+        thread.start()
+    try:
+        timer = timers['write']
+        chunk_index = 0
+        while True:
+            start = monotonic()
+            item = _get_from_stage(parsed_pages, threads[1])
+            if isinstance(item, Future):
+                item = item.result()
+                timers['parse'].busy += item[1]
+                timers['parse'].items += 1
+            timer.waiting += monotonic() - start
+            if item is _END_OF_PIPELINE:
+                break
+            if isinstance(item, _StageError):
+                raise item.exception
+            METRICS.observe('parse_seconds', item[1])      # measured where the chunk is parsed (maybe in a process)
+            start = monotonic()
+            report_file.add(item[0])          # save information about friends to file
+            METRICS.observe('report_write_seconds', monotonic() - start, report_file=type(report_file).__name__)
+            if statistics is not None:
+                statistics.merge(item[2])
+            if on_chunk_written is not None:
+                on_chunk_written(chunk_index)
+            timer.busy += monotonic() - start
+            timer.items += 1
+            chunk_index += 1
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+        if process_pool:
+            process_pool.shutdown(cancel_futures=True)
+    for name, stage_timer in timers.items():
+        METRICS.observe('pipeline_stage_busy_seconds', stage_timer.busy, stage=name)
+        METRICS.observe('pipeline_stage_waiting_seconds', stage_timer.waiting, stage=name)
+    return timers
+
+
+def create_session(pool_size: int = WORKERS) -> requests.Session:
+    """
+    Creates a keep-alive session for VK API requests with a pool big enough for "pool_size" threads
+    :param pool_size: (int) number of threads using the session at the same time
+    :return: (requests.Session)
+    """
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=max(pool_size, 1))
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def create_and_prepare_file(format_file: str, path_file: str | int | IO, resume_position: int | None = None,
+                            compression: str | None = None, owner_id: str = '',
+                            fields: tuple = User.user_fields()) -> ReportFile:
     """
     Function for creating an object for working with a report file, depending on the selected report file's format
     :param format_file: (str)
-    :param path_file: (str)
-    :return: (CsvReportFile | TsvReportFile | JsonReportFile) an object for creating file and writing information to it
-                           (child of ReportFile)
+    :param path_file: (str | int | IO) path without extension, file descriptor or file object (for example sys.stdout)
+    :param resume_position: (int | None) position returned by ReportFile.commit() to continue an unfinished file from
+    :param compression: (str | None) 'gzip' or 'zstd' (see ReportFile)
+    :param owner_id: (str) VK id of the user whose friends are in the report (sqlite keeps reports of many users)
+    :param fields: (tuple) names of columns of the report (see report_fields)
+    :return: (CsvReportFile | TsvReportFile | JsonReportFile | NdjsonReportFile | SqliteReportFile |
+             ParquetReportFile) an object for creating file and writing information to it (child of ReportFile)
     """
     match format_file:
         case 'csv':
-            return CsvReportFile(path_file)
+            return CsvReportFile(path_file, resume_position=resume_position, compression=compression, fields=fields)
         case 'tsv':
-            return TsvReportFile(path_file)
+            return TsvReportFile(path_file, resume_position=resume_position, compression=compression, fields=fields)
         case 'json':
-            return JsonReportFile(path_file)
+            return JsonReportFile(path_file, resume_position=resume_position, compression=compression, fields=fields)
+        case 'ndjson':
+            return NdjsonReportFile(path_file, resume_position=resume_position, compression=compression,
+                                    fields=fields)
+        case 'sqlite':
+            return SqliteReportFile(path_file, resume_position=resume_position, compression=compression,
+                                    owner_id=owner_id, fields=fields)
+        case 'parquet':
+            return ParquetReportFile(path_file, resume_position=resume_position, compression=compression,
+                                     fields=fields)
 
 
 # Classes
@@ -350,24 +1660,77 @@ class VkResponseData:
     """
     Class for working with data returned by VK API
     The main goal is to create a list of objects of class User
+    The whole page is converted column by column (self.columns), then columns are zipped into users
+    Only columns of the requested fields are made, other data of friends is not converted
+    The not decoded body of the response is parsed incrementally: friends are decoded and converted by batches of
+    stream_batch_size friends (see iter_json_items)
     """
-    def __init__(self, vk_data: dict):
+    _sex_strings = {1: 'Female', 2: 'Male'}
+    stream_batch_size = 500
+
+    def __init__(self, vk_data: dict | bytes, fields: tuple = User.user_fields()):
         """
-        Create a list of objects of class User, uses protected static methods for this
-        :param vk_data: (dict) request.json() from vk friends get api
+        Create columns of user data and a list of objects of class User, uses protected static methods for this
+        :param vk_data: (dict | bytes) request.json() from vk friends get api or the not decoded body of the response
+        :param fields: (tuple) names of fields (see report_fields), users are User for User.user_fields(),
+                       otherwise tuples of values in the order of fields
         """
-        self.list_of_users: list[User] = []
-        for friend in vk_data['response']['items']:
-            if friend.get('deactivated'):          # skip banned and deleted users
-                continue
-            user = User(first_name=friend.get('first_name'),
-                        last_name=friend.get('last_name'),
-                        country=self._make_country_str_or_none(friend.get('country')),
-                        city=self._make_city_str_or_none(friend.get('city')),
-                        birth_date=self._make_bd_iso_format_str(friend.get('bdate')),
-                        sex=self._make_sex_str(friend['sex'])
-                        )
-            self.list_of_users.append(user)
+        self.fields = fields
+        self.ids: list[int] = []
+        self.columns: dict[str, list] = {field: [] for field in fields}
+        if isinstance(vk_data, (bytes, str)):
+            items = iter_json_items(vk_data)
+            while batch := [item for _, item in zip(range(self.stream_batch_size), items)]:
+                self._add_friends(batch)
+        else:
+            self._add_friends(vk_data['response']['items'])
+        if fields == User.user_fields():
+            self.list_of_users: list[User] = list(map(User._make, zip(*self.columns.values())))
+        else:
+            self.list_of_users: list[tuple] = list(zip(*self.columns.values()))
+
+    def _add_friends(self, items: list[dict]):
+        """
+        Converts friends and adds them to the columns
+        :param items: (list[dict]) items of vk response data
+        """
+        friends = [friend for friend in items if not friend.get('deactivated')]     # skip banned and deleted users
+        self.ids.extend(friend.get('id') for friend in friends)
+        for field, column in self.columns.items():
+            column.extend(self._make_column(field, friends))
+
+    def _make_column(self, field: str, friends: list[dict]) -> list:
+        """
+        Converts values of one field of friends
+        :param field: (str) one of report_fields
+        :param friends: (list[dict]) active friends from vk response data
+        :return: (list) values of the field
+        """
+        match field:
+            case 'id':
+                return [friend.get('id') for friend in friends]
+            case 'first_name' | 'last_name' | 'domain':
+                return [friend.get(field) for friend in friends]
+            case 'country':
+                make_country = self._make_country_str_or_none
+                return [make_country(friend.get('country')) for friend in friends]
+            case 'city':
+                make_city = self._make_city_str_or_none
+                return [make_city(friend.get('city')) for friend in friends]
+            case 'birth_date':
+                make_bd_iso_format_str = self._make_bd_iso_format_str
+                return [make_bd_iso_format_str(friend['bdate']) if 'bdate' in friend else None for friend in friends]
+            case 'sex':
+                sex_strings = self._sex_strings
+                return [sex_strings.get(friend['sex']) for friend in friends]
+            case 'last_seen':
+                make_last_seen = self._make_last_seen_str_or_none
+                return [make_last_seen(friend.get('last_seen')) for friend in friends]
+            case 'education':
+                return [friend.get('university_name') or None for friend in friends]     # VK sends '' if unknown
+            case 'graduation':
+                return [friend.get('graduation') or None for friend in friends]          # VK sends 0 if unknown
+        raise ValueError(f'Unknown field of reports: {field}')
 
     @staticmethod
     def _make_sex_str(vk_sex: Literal[1, 2]) -> Literal['Female', 'Male']:
@@ -407,10 +1770,25 @@ class VkResponseData:
         return vk_city
 
     @staticmethod
+    def _make_last_seen_str_or_none(vk_last_seen: dict | None) -> str | None:
+        """
+        Converts vk last seen format (for example {'time': 1706745599, 'platform': 7}) to UTC time in iso format
+        ('2024-01-31T23:59:59')
+        If param vk_last_seen is None, returns None
+        :param vk_last_seen: (dict | None)
+        :return: (str | None)
+        """
+        if vk_last_seen and vk_last_seen.get('time'):
+            return datetime.fromtimestamp(vk_last_seen['time'], timezone.utc).isoformat()[:19]
+        return None
+
+    @staticmethod
+    @lru_cache(maxsize=65536)           # there are few distinct birth dates, most of them are taken from the cache
     def _make_bd_iso_format_str(vk_bd: str | None) -> str | None:
         """
         Converts vk birth date format (for example: 2.3.1998 or 1.5)
         to string birth date iso format ('1998-03-02' or '05-01')
+        Well-formed dates are split and zero-padded, other strings are checked by strptime as before
 
         If param vk_bd is None, returns None
         :param vk_bd: (str | None)
@@ -418,27 +1796,481 @@ class VkResponseData:
         """
         if not vk_bd:
             return vk_bd
-        if len(vk_bd.split('.')) == 3:
+        parts = vk_bd.split('.')
+        if vk_bd.isascii() and all(part.isdigit() and 0 < len(part) <= 2 for part in parts[:2]):
+            if len(parts) == 3 and len(parts[2]) == 4 and parts[2].isdigit():
+                return date(int(parts[2]), int(parts[1]), int(parts[0])).isoformat()
+            elif len(parts) == 2:
+                return date(2016, int(parts[1]), int(parts[0])).isoformat()[5:]     # Some users have no year
+        if len(parts) == 3:
             bd_date = datetime.strptime(vk_bd, '%d.%m.%Y')
             return bd_date.isoformat()[:10]                              # crutch
-        elif len(vk_bd.split('.')) == 2:
+        elif len(parts) == 2:
             bd_date = datetime.strptime(vk_bd+'-2016', '%d.%m-%Y')       # Some users have no year
             return bd_date.isoformat()[5:10]                             # crutch
         return None
 
 
+class RateLimiter:
+    """
+    Token bucket for limiting the number of requests per second to VK API
+    One object can be shared between several threads (and parsers using the same access token)
+    """
+    def __init__(self, requests_per_second: float, burst: int = 1):
+        """
+        Creates a token bucket
+        :param requests_per_second: (float) speed of filling the bucket
+        :param burst: (int) size of the bucket (number of requests that can be sent at once)
+        """
+        self.requests_per_second = requests_per_second
+        self.burst = burst
+        self._tokens = float(burst)
+        self._last_time = monotonic()
+        self._lock = Lock()
+
+    def reserve(self) -> float:
+        """
+        Takes one token from the bucket
+        If the bucket is empty, the token is taken "in debt"
+        :return: (float) number of seconds to wait before sending the request
+        """
+        with self._lock:
+            now = monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last_time) * self.requests_per_second)
+            self._last_time = now
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.requests_per_second
+
+    def get_waiting_time(self) -> float:
+        """
+        :return: (float) number of seconds a request would wait now (the token is not taken)
+        """
+        with self._lock:
+            tokens = min(self.burst, self._tokens + (monotonic() - self._last_time) * self.requests_per_second)
+            return max(1 - tokens, 0.0) / self.requests_per_second
+
+    def acquire(self) -> float:
+        """
+        Waits until the request can be sent
+        :return: (float) number of seconds of waiting
+        """
+        delay = self.reserve()
+        if delay > 0:
+            sleep(delay)
+        return max(delay, 0.0)
+
+    def on_success(self):
+        """
+        Called after a successful request (the fixed limiter does not change its speed)
+        """
+        pass
+
+    def on_throttle(self):
+        """
+        Called when VK answers "too many requests" (the fixed limiter does not change its speed)
+        """
+        pass
+
+
+class AdaptiveRateLimiter(RateLimiter):
+    """
+    RateLimiter that changes its speed depending on VK answers (AIMD):
+    every successful request increases the speed by "increase" (up to max_requests_per_second),
+    every throttled request divides the speed by 2 (down to min_requests_per_second)
+    """
+    def __init__(self, requests_per_second: float, burst: int = 1, min_requests_per_second: float = 0.2,
+                 max_requests_per_second: float | None = None, increase: float = 0.1):
+        """
+        Creates a token bucket with adaptive speed
+        :param requests_per_second: (float) initial speed of filling the bucket
+        :param burst: (int) size of the bucket (number of requests that can be sent at once)
+        :param min_requests_per_second: (float)
+        :param max_requests_per_second: (float | None) if None, the initial speed is the max speed
+        :param increase: (float) increase of the speed after every successful request
+        """
+        super().__init__(requests_per_second, burst)
+        self.min_requests_per_second = min_requests_per_second
+        self.max_requests_per_second = max_requests_per_second or requests_per_second
+        self.increase = increase
+
+    def on_success(self):
+        with self._lock:
+            self.requests_per_second = min(self.max_requests_per_second, self.requests_per_second + self.increase)
+
+    def on_throttle(self):
+        with self._lock:
+            self.requests_per_second = max(self.min_requests_per_second, self.requests_per_second / 2)
+        logger.warning(f'VK throttles requests, speed is reduced to {self.requests_per_second:.2f} requests/second')
+
+
+class PooledToken:
+    """
+    Access token of TokenPool with its own rate limiter
+    """
+    def __init__(self, access_token: str, rate_limiter: RateLimiter, number: int):
+        """
+        :param access_token: (str)
+        :param rate_limiter: (RateLimiter) limiter of requests with this token
+        :param number: (int) number of the token in the pool (logs and metrics never show the token itself)
+        """
+        self.access_token = access_token
+        self.rate_limiter = rate_limiter
+        self.number = number
+        self.sidelined_until = 0.0          # monotonic time
+
+    def __repr__(self):
+        return f'token {self.number}'
+
+
+class TokenPool:
+    """
+    Pool of VK access tokens. VK limits requests per token, so every token has its own rate limiter and the total
+    speed grows with the number of tokens
+    Every request takes the token that can send it the soonest. Throttled tokens and tokens rejected by VK
+    (TOKEN_ERROR_CODES) are sidelined for a while: they are used only if all tokens are sidelined
+    One pool can be shared between several threads and parsers (instead of a rate limiter)
+    """
+    def __init__(self, access_tokens: list[str], requests_per_second: float = REQUESTS_PER_SECOND,
+                 rate_limiters: list[RateLimiter] | None = None,
+                 throttle_sideline: float = TOKEN_THROTTLE_SIDELINE, error_sideline: float = TOKEN_ERROR_SIDELINE):
+        """
+        :param access_tokens: (list[str])
+        :param requests_per_second: (float) initial speed of AdaptiveRateLimiter of every token
+        :param rate_limiters: (list[RateLimiter] | None) limiters of the tokens (in the same order) instead of
+                              AdaptiveRateLimiter(requests_per_second)
+        :param throttle_sideline: (float) seconds a throttled token is not used
+        :param error_sideline: (float) seconds a token rejected by VK is not used
+        """
+        if not access_tokens:
+            raise ValueError('There are no access tokens')
+        rate_limiters = rate_limiters or [AdaptiveRateLimiter(requests_per_second) for _ in access_tokens]
+        self.tokens = [PooledToken(access_token, rate_limiter, number)
+                       for number, (access_token, rate_limiter) in enumerate(zip(access_tokens, rate_limiters), 1)]
+        self.throttle_sideline = throttle_sideline
+        self.error_sideline = error_sideline
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def _get_usable_tokens(self, now: float) -> list[PooledToken]:
+        """
+        :return: (list[PooledToken]) not sidelined tokens or, if all tokens are sidelined, the one released first
+        """
+        tokens = [token for token in self.tokens if token.sidelined_until <= now]
+        return tokens or [min(self.tokens, key=lambda token: token.sidelined_until)]
+
+    def reserve(self) -> tuple[PooledToken, float]:
+        """
+        Takes the token that can send a request the soonest without waiting (asyncio code waits by itself)
+        :return: (tuple[PooledToken, float]) the token and number of seconds to wait before sending the request
+        """
+        with self._lock:
+            token = min(self._get_usable_tokens(monotonic()), key=lambda token: token.rate_limiter.get_waiting_time())
+            delay = token.rate_limiter.reserve()
+        METRICS.increment('vk_token_requests_total', token=str(token.number))
+        return token, max(delay, 0.0)
+
+    def acquire(self) -> tuple[PooledToken, float]:
+        """
+        Takes the token that can send a request the soonest and waits until the request can be sent
+        :return: (tuple[PooledToken, float]) the token and number of seconds of waiting
+        """
+        token, delay = self.reserve()
+        if delay > 0:
+            sleep(delay)
+        return token, delay
+
+    def _sideline(self, token: PooledToken, seconds: float, reason: str):
+        with self._lock:
+            token.sidelined_until = max(token.sidelined_until, monotonic() + seconds)
+        METRICS.increment('vk_token_sidelined_total', token=str(token.number), reason=reason)
+
+    def on_success(self, token: PooledToken):
+        """
+        Called after a successful request with the token
+        """
+        token.rate_limiter.on_success()
+
+    def on_throttle(self, token: PooledToken):
+        """
+        Called when VK answers "too many requests" to the token: the token is slowed down and sidelined
+        """
+        token.rate_limiter.on_throttle()
+        if len(self.tokens) > 1:
+            self._sideline(token, self.throttle_sideline, 'throttle')
+
+    def on_token_error(self, token: PooledToken, error_code: int) -> bool:
+        """
+        Called when VK rejects the token (one of TOKEN_ERROR_CODES): the token is sidelined
+        :param token: (PooledToken)
+        :param error_code: (int) VK error code
+        :return: (bool) True if there are other not sidelined tokens, so the request is worth retrying with them
+        """
+        if len(self.tokens) == 1:
+            return False
+        self._sideline(token, self.error_sideline, 'error')
+        logger.warning(f'VK rejected {token} (VK error {error_code}), it is not used for {self.error_sideline} seconds')
+        now = monotonic()
+        return any(other.sidelined_until <= now for other in self.tokens)
+
+    @staticmethod
+    def get_token_error_code(vk_data: dict) -> int | None:
+        """
+        :param vk_data: (dict) raw vk response data
+        :return: (int | None) code of the VK error caused by the token (see TOKEN_ERROR_CODES) or None
+        """
+        errors = [vk_data['error']] if 'error' in vk_data else vk_data.get('execute_errors', [])
+        for error in errors:
+            if error.get('error_code') in TOKEN_ERROR_CODES:
+                return error['error_code']
+        return None
+
+
+class RetryPolicy:
+    """
+    Which failed requests are retried and how long to wait before the retries
+    Delays are "full jitter" exponential backoff: random in [0, min(max_delay, base_delay * 2 ** retry_number)],
+    so parsers throttled at the same time do not retry at the same time
+    """
+    def __init__(self, attempts: int = RETRY_ATTEMPTS, base_delay: float = RETRY_BASE_DELAY,
+                 max_delay: float = RETRY_MAX_DELAY, retryable_error_codes: tuple = RETRYABLE_VK_ERROR_CODES):
+        """
+        :param attempts: (int) max number of attempts of one request (1 - no retries)
+        :param base_delay: (float) seconds
+        :param max_delay: (float) seconds
+        :param retryable_error_codes: (tuple) VK error codes worth retrying
+        """
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retryable_error_codes = retryable_error_codes
+
+    def get_delay(self, retry_number: int) -> float:
+        """
+        :param retry_number: (int) 0 for the first retry
+        :return: (float) seconds to wait before the retry
+        """
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** retry_number))
+
+    def get_retryable_error_code(self, vk_data: dict) -> int | None:
+        """
+        Finds a retryable VK error in the response (also among errors of calls inside "execute")
+        :param vk_data: (dict) raw vk response data
+        :return: (int | None) code of the retryable error or None if the response should not be retried
+        """
+        errors = [vk_data['error']] if 'error' in vk_data else vk_data.get('execute_errors', [])
+        for error in errors:
+            if error.get('error_code') in self.retryable_error_codes:
+                return error['error_code']
+        return None
+
+
+class FailedAttempt(NamedTuple):
+    error: str                      # description for logs
+    is_throttled: bool              # VK answered "too many requests"
+    is_token_error: bool = False    # VK rejected the token, the request is retried at once with another token
+
+
+def check_vk_result(token_pool: TokenPool, token: PooledToken, retry_policy: RetryPolicy, method: str,
+                    vk_data: dict) -> FailedAttempt | None:
+    """
+    Checks the decoded response of one attempt of a request (shared by retry loops of the sync and async parsers)
+    :param token_pool: (TokenPool)
+    :param token: (PooledToken) token of the attempt
+    :param retry_policy: (RetryPolicy)
+    :param method: (str) VK API method, for example 'friends.get'
+    :param vk_data: (dict) raw vk response data
+    :return: (FailedAttempt | None) None if the response is final (successful or with an error that is not retried,
+             it is returned to the caller), otherwise the failure to pass to get_retry_delay
+    """
+    error_code = retry_policy.get_retryable_error_code(vk_data)
+    token_error_code = token_pool.get_token_error_code(vk_data) if error_code is None else None
+    if token_error_code is not None:
+        if token_pool.on_token_error(token, token_error_code):
+            return FailedAttempt(f'VK error {token_error_code} of {token}', is_throttled=False, is_token_error=True)
+        METRICS.increment('vk_failed_requests_total', method=method)
+        return None             # there is no other token to retry with, the caller raises VkApiError
+    if error_code is None:
+        token_pool.on_success(token)
+        return None
+    return FailedAttempt(f'VK error {error_code}', is_throttled=error_code in (6, 9))
+
+
+def get_retry_delay(token_pool: TokenPool, token: PooledToken, retry_policy: RetryPolicy, method: str,
+                    attempt: int, failure: FailedAttempt) -> float | None:
+    """
+    Counts the failed attempt (metrics, throttling of the token) and decides when to retry the request
+    :param token_pool: (TokenPool)
+    :param token: (PooledToken) token of the attempt
+    :param retry_policy: (RetryPolicy)
+    :param method: (str) VK API method
+    :param attempt: (int) number of the attempt, 0 for the first one
+    :param failure: (FailedAttempt)
+    :return: (float | None) seconds to wait before the retry, None if there are no attempts left
+    """
+    METRICS.increment('vk_failed_requests_total', method=method)
+    if failure.is_throttled:
+        METRICS.increment('vk_throttled_requests_total', method=method)
+        token_pool.on_throttle(token)
+    if attempt + 1 >= retry_policy.attempts:
+        return None
+    METRICS.increment('vk_retries_total', method=method)
+    if failure.is_token_error:
+        logger.warning(f'Request to {method} failed ({failure.error}), retry with another token')
+        return 0.0
+    delay = retry_policy.get_delay(attempt)
+    logger.warning(f'Request to {method} failed ({failure.error}), retry in {delay:.2f} seconds')
+    METRICS.observe('retry_backoff_seconds', delay)
+    return delay
+
+
+class VkApiError(Exception):
+    """
+    VK API request failed (VK error, or network/server errors after all retries)
+    """
+    def __init__(self, message: str, error_code: int | None = None):
+        super().__init__(message)
+        self.error_code = error_code
+
+
 class VkFriendsParser:
     """
     Class for requesting information from VK API friends
+    Failed requests are retried according to RetryPolicy, VK throttling slows down the rate limiter
+    With a TokenPool requests are spread over its tokens, a request rejected because of the token is retried with
+    another token
     """
-    def __init__(self, access_token: str, vk_user_id: str):
+    def __init__(self, access_token: 'str | TokenPool', vk_user_id: str, rate_limiter: RateLimiter | None = None,
+                 session: requests.Session | None = None, api_url: str = VK_API_URL, cache=None,
+                 retry_policy: RetryPolicy | None = None, fields: tuple = User.user_fields(),
+                 stream_items: bool = False):
         """
         Creates an object for working with VK API friends
-        :param access_token: (str)
+        :param access_token: (str | TokenPool) one token or a pool of tokens (can be shared between parsers)
         :param vk_user_id: (str)
+        :param rate_limiter: (RateLimiter | None) limiter of the token (can be shared between parsers),
+                             if None, parser creates its own AdaptiveRateLimiter(REQUESTS_PER_SECOND),
+                             not used with a TokenPool (tokens of the pool have their own limiters)
+        :param session: (requests.Session | None) keep-alive session (can be shared between parsers),
+                        if None, parser creates its own session
+        :param api_url: (str) base url of VK API methods
+        :param cache: (cache.ResponseCache | None) cache of responses (can be shared between parsers)
+        :param retry_policy: (RetryPolicy | None) if None, RetryPolicy() with settings from config is used
+        :param fields: (tuple) fields of the report (see report_fields), only VK fields needed for them are requested
+        :param stream_items: (bool) get_info_about_friends returns successful responses not decoded (bytes) to be
+                             parsed incrementally by VkResponseData (responses of the cache are decoded as usual)
         """
-        self.__access_token = access_token
+        if isinstance(access_token, TokenPool):
+            self._token_pool = access_token
+        else:
+            self._token_pool = TokenPool([access_token],
+                                         rate_limiters=[rate_limiter or AdaptiveRateLimiter(REQUESTS_PER_SECOND)])
         self._vk_user_id = vk_user_id
+        self._session = session or requests.Session()
+        self._api_url = api_url
+        self._cache = cache
+        self._retry_policy = retry_policy or RetryPolicy()
+        self._vk_fields = get_vk_fields(fields)
+        self._stream_items = stream_items
+
+    def _get_cache_key(self, method: str, params: dict) -> str | None:
+        """
+        :return: (str | None) key of the request in the cache, None if there is no cache
+        """
+        if self._cache is None:
+            return None
+        return self._cache.make_key(method, {**params, 'v': VK_API_VERSION})
+
+    def _call(self, method: str, params: dict, http_method: str = 'GET', use_cache: bool = True,
+              raw: bool = False) -> dict | bytes:
+        """
+        Makes a web request to VK API method or takes the response from the cache
+        Successful responses are saved to the cache
+        :param method: (str) VK API method, for example 'friends.get'
+        :param params: (dict) params of the method (without access_token and version)
+        :param http_method: (str) 'GET' or 'POST'
+        :param use_cache: (bool) False to not use the cache for this request
+        :param raw: (bool) return the successful response not decoded if it is not saved to the cache
+        :return: (dict | bytes) raw vk response data (request.json()) or the not decoded body
+        """
+        cache_key = self._get_cache_key(method, params) if use_cache else None
+        if cache_key is not None:
+            cached_response = self._cache.get(cache_key)
+            if cached_response is not None:
+                METRICS.increment('cache_hits_total', method=method)
+                return cached_response
+            METRICS.increment('cache_misses_total', method=method)
+
+        result = self._request(method, params, http_method, raw=raw and cache_key is None)
+        if cache_key is not None and 'response' in result and 'execute_errors' not in result:
+            self._cache.set(cache_key, result)
+        return result
+
+    def _request(self, method: str, params: dict, http_method: str = 'GET', raw: bool = False) -> dict | bytes:
+        """
+        Makes a web request to VK API method, waiting for the rate limiter
+        Network errors, HTTP 429/5xx and retryable VK errors are retried with backoff (see RetryPolicy),
+        errors of the token (TOKEN_ERROR_CODES) are retried at once with another token of the pool
+        The body is decoded once (see decode_json), with raw=True successful responses are not decoded at all
+        :param method: (str) VK API method, for example 'friends.get'
+        :param params: (dict) params of the method (without access_token and version)
+        :param http_method: (str) 'GET' or 'POST'
+        :param raw: (bool) return the body of the successful response (see is_vk_response_body) not decoded
+        :return: (dict | bytes) raw vk response data (with a not retryable VK error or the last retryable one)
+                 or the not decoded body
+        """
+        result = None
+        for attempt in range(self._retry_policy.attempts):
+            token, waiting_time = self._token_pool.acquire()
+            METRICS.observe('rate_limiter_wait_seconds', waiting_time)
+            METRICS.increment('vk_requests_total', method=method)
+            request_params = {**params, 'access_token': token.access_token, 'v': VK_API_VERSION}
+            try:
+                start = monotonic()
+                if http_method == 'POST':
+                    vk_response = self._session.post(url=f'{self._api_url}{method}', data=request_params,
+                                                     timeout=REQUEST_TIMEOUT)
+                else:
+                    vk_response = self._session.get(url=f'{self._api_url}{method}', params=request_params,
+                                                    timeout=REQUEST_TIMEOUT)
+                METRICS.observe('vk_request_seconds', monotonic() - start, method=method)
+                METRICS.increment('vk_received_bytes_total', len(vk_response.content), method=method)
+                if vk_response.status_code == 429 or vk_response.status_code >= 500:
+                    raise requests.HTTPError(f'HTTP {vk_response.status_code}', response=vk_response)
+                if raw and is_vk_response_body(vk_response.content):
+                    self._token_pool.on_success(token)
+                    return vk_response.content
+                result = decode_json(vk_response.content)
+                if not isinstance(result, dict):          # 'null' or a list is not a response of VK API
+                    raise ValueError(f'Response is not a json object: {type(result).__name__}')
+            except (requests.RequestException, ValueError) as Ex:    # ValueError - response is not a json object
+                result = None
+                failure = FailedAttempt(f'{type(Ex).__name__}: {Ex}', is_throttled=getattr(
+                    getattr(Ex, 'response', None), 'status_code', None) == 429)
+            else:
+                failure = check_vk_result(self._token_pool, token, self._retry_policy, method, result)
+                if failure is None:
+                    return result
+            delay = get_retry_delay(self._token_pool, token, self._retry_policy, method, attempt, failure)
+            if delay:
+                sleep(delay)
+        if result is None:
+            raise VkApiError(f'Request to {method} failed after {self._retry_policy.attempts} attempts: '
+                             f'{failure.error}')
+        return result
+
+    def _make_friends_params(self, offset: int, count: int) -> dict:
+        """
+        :return: (dict) params of friends.get for a page of friends with information
+        """
+        return {'user_id': self._vk_user_id,
+                'order': 'name',
+                'fields': self._vk_fields,
+                'offset': offset,
+                'count': count}
 
     def get_number_of_friends(self) -> int:
         """
@@ -446,22 +2278,20 @@ class VkFriendsParser:
         Function to get the number of friends of user (with user_id)
         :return: (int) number of friends of user (with user_id)
         """
-        params = {'user_id': self._vk_user_id,
-                  'access_token': self.__access_token,
-                  'v': '5.81'}
-        vk_response = requests.get(url='https://api.vk.com/method/friends.get', params=params)
-        sleep(1)
+        vk_response = None
         try:
-            result = int(vk_response.json()['response']['count'])
+            vk_response = self._call('friends.get', {'user_id': self._vk_user_id})
+            result = int(vk_response['response']['count'])
         except Exception as Ex:
             print('''An error occurred while getting the number of friends.
-                  Possibly incorrect access_token/user_id entered or access closed.''')
+                  Possibly incorrect access_token/user_id entered or access closed.''', file=sys.stderr)
             logger.error(f'An error occurred while getting the number of friends. '
                          f'Possibly incorrect access_token/user_id entered or access closed. : \n Error: {Ex}')
-            if vk_response:
-                print(f'Vk error: {vk_response.json()["error"]["error_msg"]}')
-                logger.error(f'Vk error: {vk_response.json()["error"]["error_msg"]}')
-            sexit()
+            if vk_response and 'error' in vk_response:
+                print(f'Vk error: {vk_response["error"]["error_msg"]}', file=sys.stderr)
+                logger.error(f'Vk error: {vk_response["error"]["error_msg"]}')
+                raise VkApiError(vk_response['error']['error_msg'], vk_response['error'].get('error_code')) from Ex
+            raise VkApiError(f'Can not get the number of friends: {Ex}') from Ex
         else:
             logger.info('Number of friends received successfully')
             return result
@@ -472,29 +2302,115 @@ class VkFriendsParser:
         Function to get the information about friends of user (with user_if)
         :param offset: (int) query shift for pagination
         :param count: (count)
-        :return: (dict) raw vk response data (request.json())
-        """
-        params = {'user_id': self._vk_user_id,
-                  'order': 'name',
-                  'fields': 'sex, bdate, city, country',
-                  'offset': offset,
-                  'count': count,
-                  'access_token': self.__access_token,
-                  'v': '5.81'}
-        vk_response = requests.get(url='https://api.vk.com/method/friends.get', params=params)
-        sleep(1)
-
+        :return: (dict | bytes) raw vk response data (request.json()), with stream_items - the not decoded body of
+                 the successful response (VkResponseData parses both)
+        """
         try:
-            result = vk_response.json()
+            result = self._call('friends.get', self._make_friends_params(offset, count), raw=self._stream_items)
         except Exception as Ex:
             print('An error occurred while getting friends list with information. '
-                  'Possibly incorrect access_token/user_id entered or access closed.')
+                  'Possibly incorrect access_token/user_id entered or access closed.', file=sys.stderr)
             logger.error(f'An error occurred while getting friends list with information. '
                          f'Possibly incorrect access_token/user_id entered or access closed. : \n Error {Ex}')
-            if vk_response:
-                print(f'VK error: {vk_response.json()["error"]["error_msg"]}')
-                logger.error(f'VK error: {vk_response.json()["error"]["error_msg"]}')
-            sexit()
+            raise VkApiError(f'Can not get friends list with information: {Ex}') from Ex
+        if not isinstance(result, bytes) and 'error' in result:
+            print(f'VK error: {result["error"]["error_msg"]}', file=sys.stderr)
+            logger.error(f'VK error: {result["error"]["error_msg"]}')
+            raise VkApiError(result['error']['error_msg'], result['error'].get('error_code'))
+        logger.info('Friends list with information received successfully')
+        return result
+
+    def get_ids_of_friends(self) -> list[int]:
+        """
+        Function makes web requests to VK API friends.get without fields (up to FRIEND_IDS_PER_REQUEST ids in one
+        request), ids are much cheaper than friends with information
+        :return: (list[int]) ids of all friends (including deactivated) sorted by name, like friends in the report
+        """
+        ids: list[int] = []
+        number_of_friends = None
+        while number_of_friends is None or len(ids) < number_of_friends:
+            params = {'user_id': self._vk_user_id, 'order': 'name', 'offset': len(ids),
+                      'count': FRIEND_IDS_PER_REQUEST}
+            result = self._call('friends.get', params)
+            if 'error' in result:
+                print(f'VK error: {result["error"]["error_msg"]}', file=sys.stderr)
+                logger.error(f'An error occurred while getting ids of friends. VK error: '
+                             f'{result["error"]["error_msg"]}')
+                raise VkApiError(result['error']['error_msg'], result['error'].get('error_code'))
+            number_of_friends = result['response']['count']
+            if not result['response']['items']:     # the list of friends became shorter between requests
+                break
+            ids.extend(result['response']['items'])
+        logger.info(f'Ids of friends received successfully ({len(ids)} ids)')
+        return ids
+
+    def get_users(self, user_ids: list[int]) -> dict:
+        """
+        Function makes web requests to VK API users.get (up to USERS_PER_REQUEST users in one request)
+        :param user_ids: (list[int])
+        :return: (dict) raw vk response data in the same format as get_info_about_friends returns
+                 ({'response': {'count': ..., 'items': [...]}}), so it can be converted by VkResponseData
+        """
+        items = []
+        for start in range(0, len(user_ids), USERS_PER_REQUEST):
+            params = {'user_ids': ','.join(map(str, user_ids[start:start + USERS_PER_REQUEST])),
+                      'fields': self._vk_fields}
+            result = self._call('users.get', params, http_method='POST')     # the list of ids can be long
+            if 'error' in result:
+                print(f'VK error: {result["error"]["error_msg"]}', file=sys.stderr)
+                logger.error(f'An error occurred while getting information about users. VK error: '
+                             f'{result["error"]["error_msg"]}')
+                raise VkApiError(result['error']['error_msg'], result['error'].get('error_code'))
+            items.extend(result['response'])
+        logger.info(f'Information about {len(items)} users received successfully')
+        return {'response': {'count': len(items), 'items': items}}
+
+    def get_pages_with_execute(self, offsets: list[int], count: int) -> list[dict]:
+        """
+        Function makes one web request to VK API method "execute", which runs friends.get for every offset
+        (no more than PAGES_PER_EXECUTE offsets) on the VK side
+        Pages found in the cache are not requested, received pages are saved to the cache as friends.get responses
+        :param offsets: (list[int]) query shifts for pagination
+        :param count: (int) number friends at one page
+        :return: (list[dict]) raw vk response data for every offset in the same format as get_info_about_friends
+                 returns ({'response': {'count': ..., 'items': [...]}})
+        """
+        pages: dict[int, dict] = {}
+        cache_keys = {offset: self._get_cache_key('friends.get', self._make_friends_params(offset, count))
+                      for offset in offsets}
+        if self._cache is not None:
+            for offset, cache_key in cache_keys.items():
+                cached_response = self._cache.get(cache_key)
+                if cached_response is not None:
+                    pages[offset] = cached_response
+        offsets_to_request = [offset for offset in offsets if offset not in pages]
+        if not offsets_to_request:
+            return [pages[offset] for offset in offsets]
+
+        calls = [f'API.friends.get({json.dumps(self._make_friends_params(offset, count))})'
+                 for offset in offsets_to_request]
+        result = None
+        try:
+            result = self._call('execute', {'code': f'return [{", ".join(calls)}];'}, http_method='POST',
+                                use_cache=False)          # pages are cached separately
+            received_pages = result['response']
+            if len(received_pages) != len(offsets_to_request) or not all(received_pages):    # failed calls are false
+                raise ValueError(f'VK execute errors: {result.get("execute_errors")}')
+        except Exception as Ex:
+            print('An error occurred while getting friends list with information. '
+                  'Possibly incorrect access_token/user_id entered or access closed.', file=sys.stderr)
+            logger.error(f'An error occurred while getting friends list with information (execute). '
+                         f'Possibly incorrect access_token/user_id entered or access closed. : \n Error {Ex}')
+            if result and 'error' in result:
+                print(f'VK error: {result["error"]["error_msg"]}', file=sys.stderr)
+                logger.error(f'VK error: {result["error"]["error_msg"]}')
+                raise VkApiError(result['error']['error_msg'], result['error'].get('error_code')) from Ex
+            raise VkApiError(f'Can not get friends list with information (execute): {Ex}') from Ex
         else:
-            logger.info('Friends list with information received successfully')
-            return result
+            for offset, page in zip(offsets_to_request, received_pages):
+                pages[offset] = {'response': page}
+                if self._cache is not None:
+                    self._cache.set(cache_keys[offset], pages[offset])
+            logger.info(f'Friends list with information received successfully '
+                        f'({len(offsets_to_request)} pages with execute)')
+            return [pages[offset] for offset in offsets]
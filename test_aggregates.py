@@ -0,0 +1,153 @@
+import os
+import csv
+import tempfile
+import unittest
+from datetime import date
+
+from aggregates import FriendsStatistics
+from fake_vk_server import FakeVkServer
+from services import User, RateLimiter, CsvReportFile, VkResponseData, create_and_fill_vk_friends_report, \
+    run_report_pipeline, write_checkpoint
+from batch import run_batch
+
+
+TODAY = date(2024, 6, 15)
+
+
+def read_statistics_of_csv_report(path: str) -> FriendsStatistics:
+    """
+    Statistics of the report file (the slow way, which the aggregation replaces)
+    """
+    statistics = FriendsStatistics(TODAY)
+    with open(path, 'r', encoding='UTF-8', newline='') as report_file:
+        rows = list(csv.reader(report_file))[1:]
+    statistics.add(tuple(value or None for value in row) for row in rows)
+    return statistics
+
+
+class TestFriendsStatistics(unittest.TestCase):
+    users = [User(first_name='Ирина', last_name='Γригорьева', country='Россия', city='Екатеринбург',
+                  birth_date='1990-06-15', sex='Female'),
+             User(first_name='Αндрей', last_name='Εвсекеев', country='Россия', city='Москва',
+                  birth_date='1990-06-16', sex='Male'),
+             User(first_name='Денис', last_name='Креев', country=None, city=None, birth_date='02-29', sex='Male'),
+             User(first_name='Никита', last_name='Ηикитин', country='Казахстан', city='Москва', birth_date=None,
+                  sex=None)]
+
+    def test_add(self):
+        statistics = FriendsStatistics(TODAY)
+        statistics.add(self.users)
+        self.assertEqual(statistics.number_of_friends, 4)
+        self.assertEqual(statistics.countries, {'Россия': 2, None: 1, 'Казахстан': 1})
+        self.assertEqual(statistics.cities['Москва'], 2)
+        self.assertEqual(statistics.sexes, {'Male': 2, 'Female': 1, None: 1})
+        self.assertEqual(statistics.ages, {34: 1, 33: 1})             # the birthday of the second one is tomorrow
+        self.assertEqual(statistics.birth_months, [0, 1, 0, 0, 0, 2, 0, 0, 0, 0, 0, 0])
+        self.assertIn('Friends: 4', statistics.format_summary())
+
+    def test_merge_of_parts_is_the_whole(self):
+        whole = FriendsStatistics(TODAY)
+        whole.add(self.users)
+        merged = FriendsStatistics(TODAY)
+        for user in self.users:
+            part = FriendsStatistics(TODAY)
+            part.add([user])
+            merged.merge(part)
+        self.assertEqual(merged.to_dict(), whole.to_dict())
+        with self.assertRaises(ValueError):         # ages are counted at another date
+            merged.merge(FriendsStatistics(date(2024, 6, 16)))
+
+    def test_add_projection(self):
+        statistics = FriendsStatistics(TODAY)
+        statistics.add([(1, 'Москва'), (2, None)], ('id', 'city'))      # other statistics are not in the report
+        self.assertEqual(statistics.number_of_friends, 2)
+        self.assertEqual(statistics.cities, {'Москва': 1, None: 1})
+        self.assertEqual(statistics.sexes, {})
+        self.assertEqual(statistics.birth_months, [0] * 12)
+
+    def test_save_and_load(self):
+        statistics = FriendsStatistics(TODAY)
+        statistics.add(self.users)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'statistics.json')
+            statistics.save(path)
+            loaded = FriendsStatistics.load(path)
+        self.assertEqual(loaded.to_dict(), statistics.to_dict())
+        self.assertEqual(loaded.countries, statistics.countries)
+        self.assertEqual(loaded.ages, statistics.ages)
+
+
+class TestStatisticsOfReports(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'report')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_statistics_of_report(self):
+        statistics = FriendsStatistics(TODAY)
+        with FakeVkServer(number_of_friends=2500) as server:
+            create_and_fill_vk_friends_report('token', '1', 'csv', self.path, api_url=server.url,
+                                              rate_limiter=RateLimiter(1000), statistics=statistics)
+        self.assertEqual(statistics.number_of_friends, 2500 - 25)
+        self.assertEqual(statistics.to_dict(), read_statistics_of_csv_report(f'{self.path}.csv').to_dict())
+
+    def test_statistics_of_resumed_report(self):
+        with FakeVkServer(number_of_friends=2500) as server:
+            # interrupted report: the first chunk is written, its statistics are in the checkpoint
+            first_chunk = VkResponseData(server.friends_get({'fields': '', 'offset': 0, 'count': 1000})).list_of_users
+            first_chunk_statistics = FriendsStatistics(TODAY)
+            first_chunk_statistics.add(first_chunk)
+            rep_file = CsvReportFile(self.path)
+            rep_file.add(first_chunk)
+            write_checkpoint('1', 'csv', self.path, 1000, next_offset=1000, position=rep_file.commit(),
+                             statistics=first_chunk_statistics)
+            rep_file.close()
+
+            statistics = FriendsStatistics(TODAY)
+            create_and_fill_vk_friends_report('token', '1', 'csv', self.path, api_url=server.url,
+                                              rate_limiter=RateLimiter(1000), resume=True, statistics=statistics)
+        self.assertEqual(statistics.number_of_friends, 2500 - 25)
+        self.assertEqual(statistics.to_dict(), read_statistics_of_csv_report(f'{self.path}.csv').to_dict())
+
+    def test_checkpoint_of_another_date(self):
+        with FakeVkServer(number_of_friends=2500) as server:
+            rep_file = CsvReportFile(self.path)
+            rep_file.add(VkResponseData(server.friends_get({'fields': '', 'offset': 0, 'count': 1000})).list_of_users)
+            write_checkpoint('1', 'csv', self.path, 1000, next_offset=1000, position=rep_file.commit(),
+                             statistics=FriendsStatistics(date(2024, 6, 14)))
+            rep_file.close()
+
+            statistics = FriendsStatistics(TODAY)
+            create_and_fill_vk_friends_report('token', '1', 'csv', self.path, api_url=server.url,
+                                              rate_limiter=RateLimiter(1000), resume=True, statistics=statistics)
+        self.assertEqual(server.number_of_requests, 1 + 3)             # the report is created anew
+        self.assertEqual(statistics.to_dict(), read_statistics_of_csv_report(f'{self.path}.csv').to_dict())
+
+    def test_statistics_are_computed_by_processes(self):
+        from test_services import make_pages
+
+        class NullReportFile:
+            def add(self, list_of_users):
+                pass
+
+        by_thread, by_processes = FriendsStatistics(TODAY), FriendsStatistics(TODAY)
+        run_report_pipeline(make_pages(20), NullReportFile(), statistics=by_thread)
+        run_report_pipeline(make_pages(20), NullReportFile(), parse_processes=2, statistics=by_processes)
+        self.assertEqual(by_thread.number_of_friends, 20)
+        self.assertEqual(by_processes.to_dict(), by_thread.to_dict())
+
+    def test_batch_statistics(self):
+        statistics = FriendsStatistics(TODAY)
+        with FakeVkServer(number_of_friends=1200, private_user_ids=(3,)) as server:
+            results = run_batch('token', ['1', '2', '3'], 'csv', self.directory.name, workers=3, api_url=server.url,
+                                statistics=statistics)
+        self.assertIsNotNone(results['3'])
+        expected = read_statistics_of_csv_report(os.path.join(self.directory.name, '1.csv'))
+        expected.merge(read_statistics_of_csv_report(os.path.join(self.directory.name, '2.csv')))
+        self.assertEqual(statistics.to_dict(), expected.to_dict())       # the failed report is not counted
+
+
+if __name__ == '__main__':
+    unittest.main()
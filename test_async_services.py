@@ -0,0 +1,119 @@
+import asyncio
+import csv
+import os
+import unittest
+from unittest import mock
+
+from fake_vk_server import FakeVkServer
+from services import RateLimiter, RetryPolicy, VkResponseData, VkApiError, TokenPool
+from async_services import AsyncVkFriendsParser, async_create_and_fill_vk_friends_report
+
+
+class TestAsyncVkFriendsParser(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.server = FakeVkServer(number_of_friends=2500)
+        self.server.start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    async def test_get_number_of_friends(self):
+        async with AsyncVkFriendsParser('token', '1', rate_limiter=RateLimiter(1000),
+                                        api_url=self.server.url) as parser:
+            self.assertEqual(await parser.get_number_of_friends(), 2500)
+
+    async def test_pooled_session(self):
+        async with AsyncVkFriendsParser('token', '1', rate_limiter=RateLimiter(1000), api_url=self.server.url,
+                                        connections_limit=1) as parser:
+            pages = await asyncio.gather(*(parser.get_info_about_friends(offset=offset, count=1000)
+                                           for offset in (0, 1000, 2000)))
+        self.assertEqual([len(page['response']['items']) for page in pages], [1000, 1000, 500])
+        self.assertEqual(self.server.number_of_requests, 3)
+        self.assertEqual(self.server.number_of_connections, 1)
+
+    async def test_retry_server_errors(self):
+        self.server.server_error_every = 2
+        async with AsyncVkFriendsParser('token', '1', rate_limiter=RateLimiter(1000), api_url=self.server.url,
+                                        retry_policy=RetryPolicy(base_delay=0.01)) as parser:
+            pages = [await parser.get_info_about_friends(offset=offset, count=1000) for offset in (0, 1000)]
+        self.assertEqual([len(page['response']['items']) for page in pages], [1000, 1000])
+        self.assertEqual(self.server.number_of_server_errors, 1)
+
+    async def test_retry_malformed_bodies(self):
+        self.server.malformed_body_every = 2
+        async with AsyncVkFriendsParser('token', '1', rate_limiter=RateLimiter(1000), api_url=self.server.url,
+                                        retry_policy=RetryPolicy(base_delay=0.01)) as parser:
+            pages = [await parser.get_info_about_friends(offset=offset, count=1000) for offset in (0, 1000, 2000)]
+        self.assertEqual([len(page['response']['items']) for page in pages], [1000, 1000, 500])
+        self.assertEqual(self.server.number_of_malformed_bodies, 2)     # "null" and "[]" are retried
+
+    async def test_token_pool(self):
+        self.server.rejected_tokens = {'bad'}
+        async with AsyncVkFriendsParser(TokenPool(['bad', 'good'], requests_per_second=1000), '1',
+                                        api_url=self.server.url) as parser:
+            pages = [await parser.get_info_about_friends(offset=offset, count=1000) for offset in (0, 1000, 2000)]
+        self.assertEqual([len(page['response']['items']) for page in pages], [1000, 1000, 500])
+        self.assertEqual(self.server.requests_by_token['bad'], 1)       # retried with the good token at once
+        self.assertEqual(self.server.requests_by_token['good'], 3)
+
+        async with AsyncVkFriendsParser('bad', '1', rate_limiter=RateLimiter(1000), api_url=self.server.url) as parser:
+            with self.assertRaises(VkApiError):                         # one token: the error is not retried
+                await parser.get_info_about_friends(offset=0, count=10)
+        self.assertEqual(self.server.requests_by_token['bad'], 2)
+
+    async def test_create_and_fill_report(self):
+        await async_create_and_fill_vk_friends_report('token', '1', 'csv', 'temp_for_async_test', concurrency=3,
+                                                      api_url=self.server.url)
+        with open('temp_for_async_test.csv', 'r', encoding='UTF-8', newline='') as r_f:
+            rows = list(csv.reader(r_f))
+        os.remove('temp_for_async_test.csv')
+
+        expected_rows = []
+        for offset in (0, 1000, 2000):
+            page = self.server.friends_get({'fields': '', 'offset': offset, 'count': 1000})
+            expected_rows.extend(list(user) for user in VkResponseData(page).list_of_users)
+        self.assertEqual(rows[1:], [[value or '' for value in row] for row in expected_rows])
+
+    async def test_chunks_ahead_are_limited(self):
+        class RecordingReportFile:
+            def __init__(self, server: FakeVkServer):
+                self.server = server
+                self.chunks_ahead = []
+
+            def add(self, list_of_users):
+                # received chunks that are not written yet (the first request is the number of friends)
+                self.chunks_ahead.append(self.server.number_of_requests - 1 - len(self.chunks_ahead))
+
+            def __enter__(self):
+                return self
+
+            def __exit__(self, exc_type, exc_val, exc_tb):
+                pass
+
+        get_info_about_friends = AsyncVkFriendsParser.get_info_about_friends
+
+        async def slow_first_chunk(parser, offset: int, count: int) -> dict:
+            if offset == 0:
+                await asyncio.sleep(0.3)
+            return await get_info_about_friends(parser, offset, count)
+
+        self.server.number_of_friends = 20000
+        report_file = RecordingReportFile(self.server)
+        with mock.patch('async_services.create_and_prepare_file', return_value=report_file), \
+                mock.patch.object(AsyncVkFriendsParser, 'get_info_about_friends', slow_first_chunk):
+            await async_create_and_fill_vk_friends_report(TokenPool(['token'], requests_per_second=1000), '1', 'csv',
+                                                          'temp_for_async_test', concurrency=3,
+                                                          api_url=self.server.url)
+        self.assertEqual(len(report_file.chunks_ahead), 21)
+        self.assertLessEqual(max(report_file.chunks_ahead), 3 + 1)     # the window and the chunk being written
+
+    async def test_malformed_response(self):
+        self.server.friends_get = lambda params: {'response': {'count': 10, 'items': [None]}}
+        with self.assertRaises(VkApiError):
+            await async_create_and_fill_vk_friends_report('token', '1', 'csv', 'temp_for_async_test',
+                                                          api_url=self.server.url)
+        os.remove('temp_for_async_test.csv')
+
+
+if __name__ == '__main__':
+    unittest.main()
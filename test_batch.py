@@ -0,0 +1,60 @@
+import io
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from fake_vk_server import FakeVkServer
+from batch import read_user_ids, run_batch
+
+
+class TestReadUserIds(unittest.TestCase):
+    def test_read_user_ids(self):
+        lines = io.StringIO('1\n\n2  # comment\n# only comment\n1\n 3 \n')
+        self.assertEqual(read_user_ids(lines), ['1', '2', '3'])
+
+
+class TestRunBatch(unittest.TestCase):
+    def test_reports_and_failures(self):
+        with FakeVkServer(number_of_friends=1200, private_user_ids=(2,)) as server, \
+                tempfile.TemporaryDirectory() as output_directory:
+            results = run_batch('token', ['1', '2', '3'], 'csv', output_directory, workers=3, api_url=server.url)
+            self.assertEqual(sorted(os.listdir(output_directory)), ['1.csv', '2.csv', '3.csv'])
+            with open(os.path.join(output_directory, '3.csv'), 'r', encoding='UTF-8') as r_f:
+                number_of_lines = len(r_f.readlines())
+        self.assertIsNone(results['1'])
+        self.assertIsNotNone(results['2'])
+        self.assertIsNone(results['3'])
+        self.assertEqual(number_of_lines, 1 + 1200 - 12)       # header + friends without deactivated
+
+    def test_reports_with_execute(self):
+        with FakeVkServer(number_of_friends=1200) as server, tempfile.TemporaryDirectory() as output_directory:
+            results = run_batch('token', ['1', '2'], 'csv', output_directory, workers=2, api_url=server.url,
+                                use_execute=True)
+        self.assertEqual(results, {'1': None, '2': None})
+        self.assertEqual(server.number_of_requests, 2)       # one "execute" request per user
+
+    def test_sqlite_reports_in_one_database(self):
+        with FakeVkServer(number_of_friends=1200) as server, tempfile.TemporaryDirectory() as output_directory:
+            for delta in (False, True):
+                results = run_batch('token', ['1', '2', '3'], 'sqlite', output_directory, workers=3,
+                                    api_url=server.url, delta=delta)
+                self.assertEqual(results, {'1': None, '2': None, '3': None})
+            connection = sqlite3.connect(os.path.join(output_directory, 'friends.sqlite'))
+            counts = connection.execute('SELECT owner_id, count(*) FROM friends GROUP BY owner_id').fetchall()
+            connection.close()
+        self.assertEqual(counts, [('1', 1200 - 12), ('2', 1200 - 12), ('3', 1200 - 12)])
+
+    def test_delta_reports(self):
+        with FakeVkServer(number_of_friends=1200) as server, tempfile.TemporaryDirectory() as output_directory:
+            for _ in range(2):
+                results = run_batch('token', ['1', '2'], 'csv', output_directory, workers=2, api_url=server.url,
+                                    delta=True)
+                self.assertEqual(results, {'1': None, '2': None})
+            self.assertIn('1_added.csv', os.listdir(output_directory))
+        # the second run requests ids and information only about deactivated friends (they may become active again)
+        self.assertEqual(server.number_of_requests, 2 * 3 + 2 * 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
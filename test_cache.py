@@ -0,0 +1,96 @@
+import os
+import tempfile
+import unittest
+from time import sleep
+from concurrent.futures import ThreadPoolExecutor
+
+from cache import ResponseCache
+from fake_vk_server import FakeVkServer
+from services import VkFriendsParser, RateLimiter, fetch_pages_of_friends_with_execute
+
+
+class TestResponseCache(unittest.TestCase):
+    def setUp(self):
+        self.temp_directory = tempfile.TemporaryDirectory()
+        self.directory = self.temp_directory.name
+
+    def tearDown(self):
+        self.temp_directory.cleanup()
+
+    def test_make_key(self):
+        key = ResponseCache.make_key('friends.get', {'user_id': 1, 'offset': 0, 'access_token': 'a'})
+        self.assertEqual(key, ResponseCache.make_key('friends.get', {'offset': '0', 'user_id': '1',
+                                                                     'access_token': 'b'}))
+        self.assertNotEqual(key, ResponseCache.make_key('friends.get', {'user_id': 1, 'offset': 1000}))
+
+    def test_get_and_set(self):
+        cache = ResponseCache(self.directory)
+        self.assertIsNone(cache.get('key'))
+        cache.set('key', {'response': {'count': 1, 'items': ['Уфа']}})
+        self.assertEqual(cache.get('key'), {'response': {'count': 1, 'items': ['Уфа']}})
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_ttl(self):
+        cache = ResponseCache(self.directory, ttl=0.05)
+        cache.set('key', {'response': 1})
+        sleep(0.1)
+        self.assertIsNone(cache.get('key'))
+
+    def test_bypass(self):
+        cache = ResponseCache(self.directory, bypass=True)
+        cache.set('key', {'response': 1})
+        self.assertIsNone(cache.get('key'))
+        self.assertEqual(ResponseCache(self.directory).get('key'), {'response': 1})
+
+    def test_size_of_concurrent_sets(self):
+        cache = ResponseCache(self.directory)
+        with ThreadPoolExecutor(8) as executor:
+            for number in range(200):
+                executor.submit(cache.set, 'key', {'response': {'items': [str(number) * 50] * (number % 7)}})
+        self.assertEqual(cache._size, os.path.getsize(os.path.join(self.directory, 'key.json.z')))
+
+    def test_lru_eviction(self):
+        response = {'response': {'items': [str(number) * 50 for number in range(200)]}}
+        cache = ResponseCache(self.directory)
+        cache.set('probe', response)
+        entry_size = os.path.getsize(os.path.join(self.directory, 'probe.json.z'))
+        cache.clear()
+
+        # the creation time is compressed with the response, so sizes of entries differ by a few bytes
+        cache = ResponseCache(self.directory, max_size=entry_size * 3 + entry_size // 2)
+        for key in ('first', 'second', 'third'):
+            cache.set(key, response)
+            sleep(0.02)
+        self.assertIsNotNone(cache.get('first'))        # "first" is used, so "second" is the least recently used
+        sleep(0.02)
+        cache.set('fourth', response)
+        self.assertIsNone(cache.get('second'))
+        self.assertIsNotNone(cache.get('first'))
+        self.assertIsNotNone(cache.get('fourth'))
+
+
+class TestVkFriendsParserWithCache(unittest.TestCase):
+    def test_repeated_requests_from_cache(self):
+        with FakeVkServer(number_of_friends=1500) as server, tempfile.TemporaryDirectory() as directory:
+            for _ in range(2):
+                parser = VkFriendsParser('token', '1', rate_limiter=RateLimiter(1000), api_url=server.url,
+                                         cache=ResponseCache(directory))
+                self.assertEqual(parser.get_number_of_friends(), 1500)
+                pages = [parser.get_info_about_friends(offset=offset, count=1000) for offset in (0, 1000)]
+        self.assertEqual([len(page['response']['items']) for page in pages], [1000, 500])
+        self.assertEqual(server.number_of_requests, 3)
+
+    def test_execute_uses_cached_pages(self):
+        with FakeVkServer(number_of_friends=2500) as server, tempfile.TemporaryDirectory() as directory:
+            cache = ResponseCache(directory)
+            parser = VkFriendsParser('token', '1', rate_limiter=RateLimiter(1000), api_url=server.url, cache=cache)
+            parser.get_info_about_friends(offset=1000, count=1000)
+            pages = list(fetch_pages_of_friends_with_execute(parser, count=1000))
+            self.assertEqual([len(page['response']['items']) for page in pages], [1000, 1000, 500])
+            self.assertEqual(server.number_of_requests, 2)
+            self.assertEqual(list(fetch_pages_of_friends_with_execute(parser, count=1000)), pages)
+            self.assertEqual(server.number_of_requests, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
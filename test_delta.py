@@ -0,0 +1,82 @@
+import os
+import tempfile
+import unittest
+
+from fake_vk_server import FakeVkServer
+from services import RateLimiter, User, create_and_fill_vk_friends_report
+from delta import FriendsSnapshot, create_delta_report, get_path_of_snapshot_file
+
+
+class TestFriendsSnapshot(unittest.TestCase):
+    def test_save_and_load(self):
+        users = {1: User(first_name='Ирина', last_name='Γригорьева', country='Россия', city=None,
+                         birth_date='04-17', sex='Female')}
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'snapshot')
+            FriendsSnapshot('10', [2, 1], users).save(path)
+            snapshot = FriendsSnapshot.load(path, '10')
+            self.assertIsNone(FriendsSnapshot.load(path, '11'))
+        self.assertEqual(snapshot.ids, [2, 1])
+        self.assertEqual(snapshot.list_of_users, list(users.values()))
+        self.assertEqual(snapshot.hashes, FriendsSnapshot('10', [2, 1], users).hashes)
+
+
+class TestCreateDeltaReport(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'report')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def read(self, name: str) -> list[str]:
+        with open(f'{self.path}{name}.csv', 'r', encoding='UTF-8') as r_f:
+            return r_f.readlines()
+
+    def test_delta_between_runs(self):
+        with FakeVkServer(number_of_friends=1200) as server:
+            delta = create_delta_report('token', '1', 'csv', self.path, rate_limiter=RateLimiter(1000),
+                                        api_url=server.url)
+            self.assertEqual((len(delta.added), len(delta.removed), len(delta.changed)), (1200 - 12, 0, 0))
+            self.assertEqual(server.number_of_requests, 3)        # ids + two users.get
+            self.assertTrue(os.path.exists(get_path_of_snapshot_file(self.path)))
+
+            server.number_of_friends = 1205
+            server.removed_friend_numbers = {3, 10}
+            server.changed_friend_numbers = {7}
+            delta = create_delta_report('token', '1', 'csv', self.path, rate_limiter=RateLimiter(1000),
+                                        api_url=server.url)
+            self.assertEqual(server.number_of_requests, 5)        # ids + users.get for new friends only
+            self.assertEqual([user.first_name for user in delta.added], [f'Name{number:07d}'
+                                                                        for number in range(1200, 1205)])
+            self.assertEqual([user.first_name for user in delta.removed], ['Name0000003', 'Name0000010'])
+            self.assertEqual(delta.changed, [])
+            self.assertEqual(len(self.read('_added')), 1 + 5)
+            self.assertEqual(len(self.read('_removed')), 1 + 2)
+
+            delta = create_delta_report('token', '1', 'csv', self.path, rate_limiter=RateLimiter(1000),
+                                        api_url=server.url, check_changes=True)
+            self.assertEqual(([user.first_name for user in delta.changed]), ['Name0000007'])
+            self.assertEqual(delta.changed[0].city, 'NewCity')
+            delta_report = self.read('')
+
+            create_and_fill_vk_friends_report('token', '1', 'csv', self.path, rate_limiter=RateLimiter(1000),
+                                              api_url=server.url)
+        self.assertEqual(delta_report, self.read(''))             # the same as the full report
+
+    def test_reactivated_friend(self):
+        with FakeVkServer(number_of_friends=300) as server:
+            create_delta_report('token', '1', 'csv', self.path, rate_limiter=RateLimiter(1000), api_url=server.url)
+            snapshot = FriendsSnapshot.load(get_path_of_snapshot_file(self.path), '1')
+            reactivated = snapshot.users.pop(100005)          # the friend was deactivated at the previous run
+            snapshot.save(get_path_of_snapshot_file(self.path))
+
+            delta = create_delta_report('token', '1', 'csv', self.path, rate_limiter=RateLimiter(1000),
+                                        api_url=server.url)
+        self.assertEqual(delta.added, [reactivated])
+        self.assertEqual(len(self.read('')), 1 + 300 - 3)
+        self.assertIn(100005, FriendsSnapshot.load(get_path_of_snapshot_file(self.path), '1').users)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import os
+import csv
+import tempfile
+import unittest
+
+from fake_vk_server import FakeVkServer
+from services import RateLimiter
+from graph import IdBitmap, crawl_friends_graph
+
+
+class TestIdBitmap(unittest.TestCase):
+    def test_add(self):
+        bitmap = IdBitmap()
+        self.assertTrue(bitmap.add(100500))
+        self.assertFalse(bitmap.add(100500))
+        self.assertTrue(bitmap.add(7))
+        self.assertIn(7, bitmap)
+        self.assertNotIn(8, bitmap)
+        self.assertNotIn(10 ** 9, bitmap)
+        self.assertEqual(len(bitmap), 2)
+
+
+class TestCrawlFriendsGraph(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'graph')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def read(self, suffix: str) -> list[list[str]]:
+        with open(f'{self.path}{suffix}', 'r', encoding='UTF-8', newline='') as r_f:
+            return list(csv.reader(r_f))
+
+    def test_two_hops(self):
+        # every user of the fake server has the same 50 friends (ids 100000...100049)
+        with FakeVkServer(number_of_friends=50) as server:
+            result = crawl_friends_graph('token', 100049, self.path, depth=2, workers=3,
+                                         rate_limiter=RateLimiter(1000), api_url=server.url)
+        self.assertEqual(server.number_of_requests, 1 + 50)          # seed (users.get) + friends of every user once
+        self.assertEqual(result.number_of_nodes, 50)
+        self.assertEqual(result.number_of_expanded, 50)
+        edges = self.read('_edges.csv')[1:]
+        self.assertEqual(len(edges), 49 * 50 // 2)                    # every friendship once, no self-loops
+        self.assertEqual(len({frozenset(edge) for edge in edges}), len(edges))
+        nodes = self.read('_nodes.csv')
+        self.assertEqual(nodes[0][:2], ['id', 'first_name'])
+        self.assertEqual(nodes[1][:2], ['100049', 'Name0000049'])
+        self.assertEqual(len({node[0] for node in nodes[1:]}), 50)
+
+    def test_private_profiles_and_frontier_limit(self):
+        with FakeVkServer(number_of_friends=30, private_user_ids=(100003,)) as server:
+            result = crawl_friends_graph('token', 100000, self.path, depth=2, max_frontier_size=10,
+                                         rate_limiter=RateLimiter(1000), api_url=server.url)
+        self.assertEqual(result.number_of_nodes, 30)
+        self.assertEqual(result.number_of_expanded, 1 + 9)          # seed + frontier without private profile
+        self.assertEqual(result.number_of_skipped, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+import io
+import os
+import gzip
+import tempfile
+import unittest
+from contextlib import redirect_stdout, redirect_stderr
+from unittest import mock
+
+from fake_vk_server import FakeVkServer
+from main import main, EXIT_OK, EXIT_FAILED, EXIT_USAGE, EXIT_NO_ACCESS_TOKEN
+
+
+class TestMain(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.environment = mock.patch.dict(os.environ, {'ACCESS_TOKEN': 'token'})
+        self.environment.start()
+
+    def tearDown(self):
+        self.environment.stop()
+        self.directory.cleanup()
+
+    def run_main(self, *argv: str) -> tuple[int, bytes]:
+        """
+        :return: (tuple[int, bytes]) exit code and bytes written to stdout
+        """
+        stdout = io.TextIOWrapper(io.BytesIO(), encoding='UTF-8')
+        with redirect_stdout(stdout), redirect_stderr(io.StringIO()):
+            exit_code = main(list(argv))
+            stdout.flush()
+        return exit_code, stdout.buffer.getvalue()
+
+    def test_absolute_output_path(self):
+        path = os.path.join(self.directory.name, 'reports', 'res1')
+        with FakeVkServer(number_of_friends=1200) as server:
+            exit_code, _ = self.run_main('1', '--output', path, '--page-size', '500', '--api-url', server.url)
+            self.assertEqual(server.number_of_requests, 1 + 3)     # number of friends + 3 pages of 500
+        self.assertEqual(exit_code, EXIT_OK)
+        with open(f'{path}.csv', 'r', encoding='UTF-8') as r_f:
+            self.assertEqual(len(r_f.readlines()), 1 + 1200 - 12)
+
+    def test_stdout_output(self):
+        with FakeVkServer(number_of_friends=1200) as server:
+            exit_code, output = self.run_main('1', '--output', '-', '--format', 'ndjson', '--api-url', server.url)
+        self.assertEqual(exit_code, EXIT_OK)
+        self.assertEqual(len(output.decode('UTF-8').splitlines()), 1200 - 12)
+
+    def test_fields(self):
+        with FakeVkServer(number_of_friends=100) as server:
+            exit_code, output = self.run_main('1', '--output', '-', '--fields', 'id,city', '--api-url', server.url)
+        self.assertEqual(exit_code, EXIT_OK)
+        self.assertEqual(output.decode('UTF-8').splitlines()[:3], ['id,city', '100000,', '100001,City1'])
+
+    def test_stream_json(self):
+        with FakeVkServer(number_of_friends=1200) as server:
+            exit_code, output = self.run_main('1', '--output', '-', '--stream-json', '--api-url', server.url)
+            _, expected_output = self.run_main('1', '--output', '-', '--api-url', server.url)
+        self.assertEqual(exit_code, EXIT_OK)
+        self.assertEqual(output, expected_output)
+        self.assertEqual(len(output.splitlines()), 1 + 1200 - 12)
+
+    def test_compressed_stdout_output(self):
+        with FakeVkServer(number_of_friends=1200) as server:
+            exit_code, output = self.run_main('1', '--output', '-', '--compression', 'gzip', '--api-url', server.url)
+        self.assertEqual(exit_code, EXIT_OK)
+        self.assertEqual(len(gzip.decompress(output).splitlines()), 1 + 1200 - 12)
+
+    def test_many_users(self):
+        user_ids_file = os.path.join(self.directory.name, 'user_ids.txt')
+        with open(user_ids_file, 'w', encoding='UTF-8') as w_f:
+            w_f.write('2\n3\n')
+        with FakeVkServer(number_of_friends=100, private_user_ids=(3,)) as server:
+            exit_code, _ = self.run_main('1', '--user-ids-file', user_ids_file, '--output', self.directory.name,
+                                         '--api-url', server.url)
+        self.assertEqual(exit_code, EXIT_FAILED)            # the report of the private user is not created
+        self.assertTrue(os.path.exists(os.path.join(self.directory.name, '2.csv')))
+
+    def test_vk_error(self):
+        with FakeVkServer(number_of_friends=100, private_user_ids=(1,)) as server:
+            exit_code, _ = self.run_main('1', '--output', os.path.join(self.directory.name, 'res'),
+                                         '--api-url', server.url)
+        self.assertEqual(exit_code, EXIT_FAILED)
+
+    def test_token_file(self):
+        token_file = os.path.join(self.directory.name, 'token')
+        with open(token_file, 'w', encoding='UTF-8') as w_f:
+            w_f.write('token\n')
+        with mock.patch.dict(os.environ, {'ACCESS_TOKEN': ''}), FakeVkServer(number_of_friends=10) as server:
+            exit_code, _ = self.run_main('1', '--output', '-', '--token-file', token_file,
+                                         '--api-url', server.url)
+        self.assertEqual(exit_code, EXIT_OK)
+
+    def test_token_pool(self):
+        with mock.patch.dict(os.environ, {'ACCESS_TOKEN': 'token1,token2'}), \
+                FakeVkServer(number_of_friends=3000) as server:
+            exit_code, _ = self.run_main('1', '--output', '-', '--page-size', '500', '--workers', '2',
+                                         '--api-url', server.url)
+        self.assertEqual(exit_code, EXIT_OK)
+        self.assertEqual(set(server.requests_by_token), {'token1', 'token2'})
+
+    def test_usage_errors(self):
+        self.assertEqual(self.run_main('1', '--format', 'xml')[0], EXIT_USAGE)
+        self.assertEqual(self.run_main('1', '--compression', 'lzma')[0], EXIT_USAGE)
+        self.assertEqual(self.run_main('1', '--page-size', '6000')[0], EXIT_USAGE)
+        self.assertEqual(self.run_main('1', '2', '--output', '-')[0], EXIT_USAGE)
+        self.assertEqual(self.run_main('1', '--fields', 'id,phone')[0], EXIT_USAGE)
+        with mock.patch('main.ACCESS_TOKEN', ''), mock.patch.dict(os.environ, {'ACCESS_TOKEN': ''}):
+            self.assertEqual(self.run_main('1')[0], EXIT_NO_ACCESS_TOKEN)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import os
+import json
+import tempfile
+import unittest
+
+from fake_vk_server import FakeVkServer
+from metrics import Metrics, METRICS
+from services import RateLimiter, RetryPolicy, VkFriendsParser, create_and_fill_vk_friends_report
+
+
+class TestMetrics(unittest.TestCase):
+    def test_counters_and_timings(self):
+        metrics = Metrics()
+        metrics.increment('vk_requests_total', method='friends.get')
+        metrics.increment('vk_requests_total', 2, method='friends.get')
+        metrics.observe('vk_request_seconds', 0.02)
+        metrics.observe('vk_request_seconds', 3)
+        data = metrics.get_dict()
+        self.assertEqual(data['counters'], {'vk_requests_total{method="friends.get"}': 3})
+        timing = data['timings']['vk_request_seconds']
+        self.assertEqual((timing['count'], timing['sum'], timing['max']), (2, 3.02, 3))
+        self.assertEqual(timing['buckets']['0.025'], 1)
+
+    def test_prometheus(self):
+        metrics = Metrics()
+        metrics.increment('vk_retries_total')
+        metrics.observe('parse_seconds', 0.2)
+        lines = metrics.format_prometheus().splitlines()
+        self.assertIn('# TYPE vk_friends_report_vk_retries_total counter', lines)
+        self.assertIn('vk_friends_report_vk_retries_total 1', lines)
+        self.assertIn('vk_friends_report_parse_seconds_bucket{le="0.1"} 0', lines)
+        self.assertIn('vk_friends_report_parse_seconds_bucket{le="0.25"} 1', lines)
+        self.assertIn('vk_friends_report_parse_seconds_bucket{le="+Inf"} 1', lines)
+        self.assertIn('vk_friends_report_parse_seconds_count 1', lines)
+
+    def test_exact_values(self):
+        metrics = Metrics()
+        metrics.increment('vk_received_bytes_total', 123456789)
+        metrics.observe('parse_seconds', 1234.56789)
+        lines = metrics.format_prometheus().splitlines()
+        self.assertIn('vk_friends_report_vk_received_bytes_total 123456789', lines)
+        self.assertIn('vk_friends_report_parse_seconds_sum 1234.56789', lines)
+        self.assertIn('123456789', metrics.format_summary())
+
+    def test_dump(self):
+        metrics = Metrics()
+        metrics.increment('vk_requests_total')
+        with tempfile.TemporaryDirectory() as directory:
+            metrics.dump(os.path.join(directory, 'metrics.json'))
+            with open(os.path.join(directory, 'metrics.json'), 'r', encoding='UTF-8') as r_f:
+                self.assertEqual(json.load(r_f)['counters'], {'vk_requests_total': 1})
+
+
+class TestServicesMetrics(unittest.TestCase):
+    def setUp(self):
+        METRICS.reset()
+
+    def test_report_metrics(self):
+        with FakeVkServer(number_of_friends=1500, server_error_every=3) as server:
+            parser = VkFriendsParser('token', '1', rate_limiter=RateLimiter(1000), api_url=server.url,
+                                     retry_policy=RetryPolicy(base_delay=0.01))
+            parser.get_info_about_friends(offset=0, count=1000)
+            create_and_fill_vk_friends_report('token', '1', 'csv', 'temp_for_test', rate_limiter=RateLimiter(1000),
+                                              api_url=server.url)
+        os.remove('temp_for_test.csv')
+        data = METRICS.get_dict()
+        self.assertEqual(data['counters']['vk_requests_total{method="friends.get"}'], server.number_of_requests)
+        self.assertEqual(data['counters']['vk_retries_total{method="friends.get"}'], server.number_of_server_errors)
+        self.assertGreater(data['counters']['vk_received_bytes_total{method="friends.get"}'], 0)
+        self.assertEqual(data['timings']['parse_seconds']['count'], 2)
+        self.assertEqual(data['timings']['report_write_seconds{report_file="CsvReportFile"}']['count'], 2)
+        self.assertIn('pipeline_stage_busy_seconds{stage="fetch"}', data['timings'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,138 @@
+import os
+import gzip
+import tempfile
+import unittest
+import http.client
+from time import sleep, monotonic
+
+import requests
+
+from fake_vk_server import FakeVkServer
+from report_server import ReportServer, JobQueue, parse_job, QUEUED, RUNNING, DONE, FAILED, CANCELLED, \
+    MAX_REQUEST_BODY_SIZE
+
+
+def wait_for_jobs(server_url: str, job_ids: list[str], timeout: float = 20) -> list[dict]:
+    """
+    Polls statuses of jobs until all of them are finished
+    :return: (list[dict]) finished jobs
+    """
+    deadline = monotonic() + timeout
+    while True:
+        jobs = [requests.get(f'{server_url}/jobs/{job_id}').json() for job_id in job_ids]
+        if all(job['status'] not in (QUEUED, RUNNING) for job in jobs) or monotonic() > deadline:
+            return jobs
+        sleep(0.05)
+
+
+class TestParseJob(unittest.TestCase):
+    def test_defaults(self):
+        self.assertEqual(parse_job({'user_id': 1}), {'user_id': '1', 'format': 'csv', 'compression': None,
+                                                     'fields': None})
+
+    def test_errors(self):
+        for data in ([], {}, {'user_id': ''}, {'user_id': '1', 'format': 'xml'},
+                     {'user_id': '1', 'compression': 'lzma'},
+                     {'user_id': '1', 'format': 'sqlite', 'compression': 'gzip'},
+                     {'user_id': '1', 'fields': 'sex'}, {'user_id': '1', 'fields': ['phone']},
+                     {'user_id': '1', 'priority': 1}):
+            with self.subTest(data=data), self.assertRaises(ValueError):
+                parse_job(data)
+
+
+class TestJobQueue(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'jobs.sqlite')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_order_and_statuses(self):
+        queue = JobQueue(self.path)
+        first, second = queue.submit([parse_job({'user_id': '1'}), parse_job({'user_id': '2'})])
+        self.assertEqual(queue.take(timeout=0)['id'], first['id'])
+        self.assertTrue(queue.cancel(second['id']))
+        self.assertIsNone(queue.take(timeout=0))
+        queue.finish(first['id'])
+        self.assertEqual(queue.count(), {DONE: 1, CANCELLED: 1})
+        self.assertEqual([job['id'] for job in queue.list()], [first['id'], second['id']])
+        self.assertTrue(queue.delete(first['id']))
+        self.assertIsNone(queue.get(first['id']))
+        queue.close()
+
+    def test_interrupted_jobs_are_queued_again(self):
+        queue = JobQueue(self.path)
+        job, = queue.submit([parse_job({'user_id': '1'})])
+        self.assertEqual(queue.take(timeout=0)['status'], RUNNING)
+        queue.close()                       # the server is stopped while the job is running
+
+        queue = JobQueue(self.path)
+        self.assertEqual(queue.get(job['id'])['status'], QUEUED)
+        self.assertEqual(queue.take(timeout=0)['id'], job['id'])
+        queue.close()
+
+
+class TestReportServer(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_jobs(self):
+        with FakeVkServer(number_of_friends=1200, private_user_ids=(3,)) as vk_server, \
+                ReportServer(self.directory.name, 'token', port=0, workers=2, api_url=vk_server.url) as server:
+            answer = requests.post(f'{server.url}/jobs', json=[{'user_id': '1'},
+                                                               {'user_id': 2, 'format': 'ndjson',
+                                                                'compression': 'gzip'},
+                                                               {'user_id': '3'}])
+            self.assertEqual(answer.status_code, 202)
+            jobs = wait_for_jobs(server.url, [job['id'] for job in answer.json()])
+            self.assertEqual([job['status'] for job in jobs], [DONE, DONE, FAILED])
+            self.assertIn('private', jobs[2]['error'])      # the private profile does not stop other jobs
+
+            report = requests.get(f'{server.url}/jobs/{jobs[0]["id"]}/report')
+            self.assertEqual(report.headers['Content-Type'], 'text/csv; charset=utf-8')
+            self.assertIn('filename="1.csv"', report.headers['Content-Disposition'])
+            self.assertEqual(len(report.content.decode('UTF-8').splitlines()), 1 + 1200 - 12)
+            report = requests.get(f'{server.url}/jobs/{jobs[1]["id"]}/report')
+            self.assertEqual(len(gzip.decompress(report.content).splitlines()), 1200 - 12)
+            self.assertEqual(requests.get(f'{server.url}/jobs/{jobs[2]["id"]}/report').status_code, 409)
+
+            listing = requests.get(f'{server.url}/jobs', params={'status': DONE}).json()
+            self.assertEqual(listing['counts'], {DONE: 2, FAILED: 1})
+            self.assertEqual(len(listing['jobs']), 2)
+            self.assertEqual(requests.delete(f'{server.url}/jobs/{jobs[0]["id"]}').status_code, 200)
+            self.assertFalse(os.path.exists(os.path.join(server.reports_directory, f'{jobs[0]["id"]}.csv')))
+            self.assertIn('server_jobs_finished_total', requests.get(f'{server.url}/metrics').text)
+
+    def test_bad_requests(self):
+        with ReportServer(self.directory.name, 'token', port=0, workers=0) as server:
+            self.assertEqual(requests.post(f'{server.url}/jobs', data=b'{').status_code, 400)
+            self.assertEqual(requests.post(f'{server.url}/jobs', json={'format': 'csv'}).status_code, 400)
+            self.assertEqual(requests.get(f'{server.url}/jobs/unknown').status_code, 404)
+            self.assertEqual(requests.get(f'{server.url}/unknown').status_code, 404)
+            job = requests.post(f'{server.url}/jobs', json={'user_id': '1'}).json()
+            self.assertEqual(requests.get(f'{server.url}/jobs/{job["id"]}/report').status_code, 409)
+            for length in ('abc', '-1', str(MAX_REQUEST_BODY_SIZE + 1)):
+                connection = http.client.HTTPConnection(server.url.removeprefix('http://'))
+                connection.putrequest('POST', '/jobs')
+                connection.putheader('Content-Length', length)
+                connection.endheaders()
+                with self.subTest(length=length):
+                    self.assertEqual(connection.getresponse().status, 400)
+                connection.close()
+
+    def test_jobs_survive_restart(self):
+        with ReportServer(self.directory.name, 'token', port=0, workers=0) as server:     # accepts jobs only
+            job = requests.post(f'{server.url}/jobs', json={'user_id': '1', 'format': 'json'}).json()
+        with FakeVkServer(number_of_friends=100) as vk_server, \
+                ReportServer(self.directory.name, 'token', port=0, workers=1, api_url=vk_server.url) as server:
+            job, = wait_for_jobs(server.url, [job['id']])
+            self.assertEqual(job['status'], DONE)
+            self.assertEqual(len(requests.get(f'{server.url}/jobs/{job["id"]}/report').json()), 100 - 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
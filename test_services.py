@@ -1,6 +1,23 @@
+import io
 import os
+import gzip
+import json
+import tempfile
 import unittest
-from services import VkResponseData, User, JsonReportFile, CsvReportFile, TsvReportFile
+import importlib.util
+from datetime import date, datetime
+from time import sleep, monotonic
+from unittest import mock
+from concurrent.futures.process import BrokenProcessPool
+from services import VkResponseData, User, JsonReportFile, CsvReportFile, TsvReportFile, RateLimiter, \
+    fetch_pages_of_friends, VkFriendsParser, fetch_pages_of_friends_with_execute, create_and_prepare_file, \
+    make_user_json_encoder, orjson, ParquetReportFile, UserStore, create_and_fill_vk_friends_report, \
+    write_checkpoint, read_checkpoint, get_path_of_checkpoint_file, AdaptiveRateLimiter, RetryPolicy, VkApiError, \
+    run_report_pipeline, available_compressions, get_report_file_name, SqliteReportFile, check_report_fields, \
+    get_vk_fields, report_fields, decode_json, iter_json_items, is_vk_response_body, TokenPool, parse_access_tokens, \
+    read_access_tokens
+from fake_vk_server import FakeVkServer, make_fake_friend
+from metrics import METRICS
 
 
 # NEED MORE TESTS !!!!
@@ -18,6 +35,24 @@ class TestVkResponseData(unittest.TestCase):
         self.assertEqual(VkResponseData._make_bd_iso_format_str('5.10.2000'), '2000-10-05')
         self.assertEqual(VkResponseData._make_bd_iso_format_str('29.2'), '02-29')
 
+    def test_make_bd_iso_format_str_same_as_strptime(self):
+        def make_bd_with_strptime(vk_bd):
+            if len(vk_bd.split('.')) == 3:
+                return datetime.strptime(vk_bd, '%d.%m.%Y').isoformat()[:10]
+            elif len(vk_bd.split('.')) == 2:
+                return datetime.strptime(vk_bd + '-2016', '%d.%m-%Y').isoformat()[5:10]
+            return None
+
+        for vk_bd in ('1.1.1900', '09.09.0999', '31.12.2023', '7.7', '01.02', '2000', '1.2.3.4', ' 1.2.2000',
+                      '31.2.2000', '29.2.2001', '0.1', '1.13', '1.2.99', '1.2.12345', '١.٢.٢٠٠٠', '1.2.'):
+            try:
+                expected = make_bd_with_strptime(vk_bd)
+            except ValueError:
+                with self.assertRaises(ValueError, msg=vk_bd):
+                    VkResponseData._make_bd_iso_format_str(vk_bd)
+            else:
+                self.assertEqual(VkResponseData._make_bd_iso_format_str(vk_bd), expected, msg=vk_bd)
+
     def test_make_sex_str(self):
         self.assertEqual(VkResponseData._make_sex_str(1), 'Female')
         self.assertEqual(VkResponseData._make_sex_str(2), 'Male')
@@ -99,6 +134,18 @@ class TestVkResponseData(unittest.TestCase):
         users_list = [user1, user2, user3, user4, user5]
 
         self.assertEqual(vk_resp_data.list_of_users, users_list)
+        self.assertEqual(vk_resp_data.ids, [518784344364, 52158834389, 62696323428, 6217630097, 62376887833])
+        self.assertEqual(vk_resp_data.columns['city'], ['Екатеринбург', 'Москва', 'Москва', 'Нижний Новгород',
+                                                        'Москва'])
+
+    def test_skip_deactivated(self):
+        test_vk_data = {'response': {'count': 2, 'items': [
+            {'id': 1, 'first_name': 'DELETED', 'last_name': '', 'deactivated': 'deleted', 'sex': 0},
+            {'id': 2, 'first_name': 'Денис', 'last_name': 'Креев', 'sex': 2, 'country': {}}]}}
+        vk_resp_data = VkResponseData(test_vk_data)
+        self.assertEqual(vk_resp_data.ids, [2])
+        self.assertEqual(vk_resp_data.list_of_users, [User(first_name='Денис', last_name='Креев', country={},
+                                                           city=None, birth_date=None, sex='Male')])
 
 
 class TestJsonReportFile(unittest.TestCase):
@@ -119,9 +166,106 @@ class TestJsonReportFile(unittest.TestCase):
             file_content = r_f.readlines()[0]
         os.remove('temp_for_test.json')
         expected_file_content = '[{"first_name": "Ирина", "last_name": "Γригорьева", "country": "Россия",' \
-                                ' "city": "Екатеринбург", "birth_date": "04-17", "sex": "Female"},\n'
+                                ' "city": "Екатеринбург", "birth_date": "04-17", "sex": "Female"}]\n'
         self.assertEqual(file_content, expected_file_content)
 
+    def test_valid_json(self):
+        users = [User(first_name='Ирина', last_name='Γригорьева', country='Россия', city=None,
+                      birth_date='04-17', sex='Female'),
+                 User(first_name='Анна "Аня"', last_name='Back\\slash\tTab', country=None, city='100%',
+                      birth_date=None, sex=None)]
+        rep_file = JsonReportFile('temp_for_test')
+        rep_file.add(users[:1])
+        rep_file.add([])
+        rep_file.add(users[1:])
+        rep_file.complete()
+        with open('temp_for_test.json', 'r', encoding='UTF-8') as r_f:
+            file_content = json.load(r_f)
+        os.remove('temp_for_test.json')
+        self.assertEqual(file_content, [user.get_dict() for user in users])
+
+    def test_empty_report(self):
+        with JsonReportFile('temp_for_test'):
+            pass
+        with open('temp_for_test.json', 'r', encoding='UTF-8') as r_f:
+            file_content = json.load(r_f)
+        os.remove('temp_for_test.json')
+        self.assertEqual(file_content, [])
+
+
+class TestNdjsonReportFile(unittest.TestCase):
+    def test_filling_file(self):
+        users = [User(first_name='Ирина', last_name='Γригорьева', country='Россия', city='Екатеринбург',
+                      birth_date='04-17', sex='Female'),
+                 User(first_name='Денис', last_name='Креев', country='Россия', city='Москва',
+                      birth_date=None, sex='Male')]
+        with create_and_prepare_file('ndjson', 'temp_for_test') as rep_file:
+            rep_file.add(users)
+        with open('temp_for_test.ndjson', 'r', encoding='UTF-8') as r_f:
+            file_content = [json.loads(line) for line in r_f]
+        os.remove('temp_for_test.ndjson')
+        self.assertEqual(file_content, [user.get_dict() for user in users])
+
+
+@unittest.skipIf(importlib.util.find_spec('pyarrow') is None, 'pyarrow is not installed')
+class TestParquetReportFile(unittest.TestCase):
+    def test_filling_file(self):
+        import pyarrow
+        import pyarrow.parquet
+
+        users = [User(first_name='Ирина', last_name='Γригорьева', country='Россия', city='Екатеринбург',
+                      birth_date='04-17', sex='Female'),
+                 User(first_name='Αндрей', last_name='Εвсекеев', country='Россия', city='Москва',
+                      birth_date='1971-03-20', sex='Male'),
+                 User(first_name='Денис', last_name='Креев', country=None, city=None,
+                      birth_date=None, sex='Male')]
+        with ParquetReportFile('temp_for_test', row_group_size=2) as rep_file:
+            rep_file.add(users[:1])
+            rep_file.add(users[1:])
+        parquet_file = pyarrow.parquet.ParquetFile('temp_for_test.parquet')
+        table = parquet_file.read()
+        number_of_row_groups = parquet_file.metadata.num_row_groups
+        parquet_file.close()
+        os.remove('temp_for_test.parquet')
+
+        self.assertEqual(number_of_row_groups, 2)
+        self.assertEqual(table.schema.field('city').type, pyarrow.dictionary(pyarrow.int32(), pyarrow.string()))
+        self.assertEqual(table.column('birth_date').to_pylist(), [None, date(1971, 3, 20), None])
+        self.assertEqual(table.column('birth_month').to_pylist(), [4, 3, None])
+        self.assertEqual(table.column('birth_day').to_pylist(), [17, 20, None])
+        self.assertEqual(table.column('country').to_pylist(), ['Россия', 'Россия', None])
+        self.assertEqual(table.column('sex').to_pylist(), ['Female', 'Male', 'Male'])
+        self.assertEqual(table.column('first_name').to_pylist(), ['Ирина', 'Αндрей', 'Денис'])
+
+    def test_stream_with_gzip_codec(self):
+        import pyarrow.parquet
+
+        sink = io.BytesIO()
+        with ParquetReportFile(sink, compression='gzip') as rep_file:
+            rep_file.add([User(first_name='Денис', last_name='Креев', country=None, city=None, birth_date=None,
+                               sex='Male')])
+        parquet_file = pyarrow.parquet.ParquetFile(io.BytesIO(sink.getvalue()))
+        self.assertEqual(parquet_file.metadata.row_group(0).column(0).compression, 'GZIP')
+        self.assertEqual(parquet_file.read().column('last_name').to_pylist(), ['Креев'])
+
+
+class TestUserJsonEncoder(unittest.TestCase):
+    users = [User(first_name='Ирина', last_name='Γригорьева', country='Россия', city='Екатеринбург',
+                  birth_date='04-17', sex='Female'),
+             User(first_name='"Quoted"\n', last_name='\x01\u2028', country=None, city='%s', birth_date=None,
+                  sex=None)]
+
+    def test_stdlib_backend_same_as_json_dumps(self):
+        encode_user = make_user_json_encoder(backend='stdlib')
+        for user in self.users:
+            self.assertEqual(encode_user(user), json.dumps(user.get_dict(), ensure_ascii=False))
+
+    @unittest.skipIf(orjson is None, 'orjson is not installed')
+    def test_orjson_backend(self):
+        encode_user = make_user_json_encoder(backend='orjson')
+        for user in self.users:
+            self.assertEqual(json.loads(encode_user(user)), user.get_dict())
+
 
 class TestCsvReportFile(unittest.TestCase):
     def test_creation_file(self):
@@ -167,6 +311,471 @@ class TestTsvReportFile(unittest.TestCase):
         self.assertEqual(file_content, expected_file_content)
 
 
+class TestReportFileLifecycle(unittest.TestCase):
+    def test_context_manager_completes_file(self):
+        my_user = User(first_name='Ирина', last_name='Γригорьева', country='Россия', city='Екатеринбург',
+                       birth_date='04-17', sex='Female')
+        with CsvReportFile('temp_for_test') as rep_file:
+            for _ in range(3):
+                rep_file.add([my_user])
+            file_object = rep_file.file
+        self.assertTrue(file_object.closed)
+        with open('temp_for_test.csv', 'r', encoding='UTF-8') as r_f:
+            file_content = r_f.readlines()
+        os.remove('temp_for_test.csv')
+        self.assertEqual(len(file_content), 4)
+
+    def test_writes_are_buffered_until_complete(self):
+        my_user = User(first_name='Ирина', last_name='Γригорьева', country='Россия', city='Екатеринбург',
+                       birth_date='04-17', sex='Female')
+        rep_file = TsvReportFile('temp_for_test', buffer_size=1024 * 1024)
+        rep_file.add([my_user])
+        size_before_complete = os.path.getsize('temp_for_test.tsv')
+        rep_file.complete()
+        rep_file.complete()         # repeated completion does nothing
+        size_after_complete = os.path.getsize('temp_for_test.tsv')
+        os.remove('temp_for_test.tsv')
+        self.assertEqual(size_before_complete, len('first_name\tlast_name\tcountry\tcity\tbirth_date\tsex\r\n'))
+        self.assertGreater(size_after_complete, size_before_complete)
+
+    def test_error_closes_without_completing(self):
+        with self.assertRaises(RuntimeError):
+            with JsonReportFile('temp_for_test') as rep_file:
+                raise RuntimeError('error while filling the report')
+        with open('temp_for_test.json', 'r', encoding='UTF-8') as r_f:
+            file_content = r_f.read()
+        os.remove('temp_for_test.json')
+        self.assertTrue(rep_file.file.closed)
+        self.assertEqual(file_content, '[')
+
+
+class TestReportFileResume(unittest.TestCase):
+    users = [User(first_name=f'Имя{number}', last_name='Фамилия', country='Россия', city=None,
+                  birth_date='04-17', sex='Female') for number in range(3)]
+
+    def test_resume_csv(self):
+        rep_file = CsvReportFile('temp_for_test')
+        rep_file.add(self.users[:1])
+        position = rep_file.commit()
+        rep_file.add(self.users[1:2])          # not committed, must be removed
+        rep_file.close()
+        with CsvReportFile('temp_for_test', resume_position=position) as rep_file:
+            rep_file.add(self.users[2:])
+        with open('temp_for_test.csv', 'r', encoding='UTF-8') as r_f:
+            file_content = r_f.readlines()
+        os.remove('temp_for_test.csv')
+        self.assertEqual([line.split(',')[0] for line in file_content], ['first_name', 'Имя0', 'Имя2'])
+
+    def test_resume_json(self):
+        for committed_users in (self.users[:0], self.users[:2]):
+            rep_file = JsonReportFile('temp_for_test')
+            rep_file.add(committed_users)
+            position = rep_file.commit()
+            rep_file.add(self.users)
+            rep_file.close()
+            with JsonReportFile('temp_for_test', resume_position=position) as rep_file:
+                rep_file.add(self.users[2:])
+            with open('temp_for_test.json', 'r', encoding='UTF-8') as r_f:
+                file_content = json.load(r_f)
+            os.remove('temp_for_test.json')
+            self.assertEqual(file_content, [user.get_dict() for user in committed_users + self.users[2:]])
+
+    def test_resume_report_from_checkpoint(self):
+        with FakeVkServer(number_of_friends=2500) as server:
+            create_and_fill_vk_friends_report('token', '1', 'csv', 'temp_for_test', api_url=server.url,
+                                              rate_limiter=RateLimiter(1000))
+            with open('temp_for_test.csv', 'r', encoding='UTF-8') as r_f:
+                expected_file_content = r_f.read()
+            self.assertFalse(os.path.exists(get_path_of_checkpoint_file('csv', 'temp_for_test')))
+
+            # interrupted report: the first chunk is saved, the second one is written only partially
+            rep_file = CsvReportFile('temp_for_test')
+            rep_file.add(VkResponseData(server.friends_get({'fields': '', 'offset': 0, 'count': 1000})).list_of_users)
+            write_checkpoint('1', 'csv', 'temp_for_test', 1000, next_offset=1000, position=rep_file.commit())
+            rep_file.file.write('Half,written,line')
+            rep_file.close()
+            self.assertIsNone(read_checkpoint('2', 'csv', 'temp_for_test', 1000))    # another user
+
+            number_of_requests = server.number_of_requests
+            create_and_fill_vk_friends_report('token', '1', 'csv', 'temp_for_test', api_url=server.url,
+                                              rate_limiter=RateLimiter(1000), resume=True)
+            with open('temp_for_test.csv', 'r', encoding='UTF-8') as r_f:
+                file_content = r_f.read()
+        os.remove('temp_for_test.csv')
+        self.assertEqual(file_content, expected_file_content)
+        self.assertEqual(server.number_of_requests - number_of_requests, 3)    # count + two remaining chunks
+        self.assertFalse(os.path.exists(get_path_of_checkpoint_file('csv', 'temp_for_test')))
+
+
+class TestReportSinks(unittest.TestCase):
+    users = [User(first_name=f'Имя{number}', last_name='Фамилия', country='Россия', city=None,
+                  birth_date='04-17', sex='Female') for number in range(3)]
+
+    def test_binary_stream_stays_open(self):
+        sink = io.BytesIO()
+        with create_and_prepare_file('ndjson', sink) as rep_file:
+            rep_file.add(self.users)
+            self.assertFalse(rep_file.resumable)
+        self.assertFalse(sink.closed)
+        self.assertEqual([json.loads(line)['first_name'] for line in sink.getvalue().decode('UTF-8').splitlines()],
+                         ['Имя0', 'Имя1', 'Имя2'])
+
+    def test_text_stream_with_buffer(self):
+        sink = io.TextIOWrapper(io.BytesIO(), encoding='UTF-8')
+        sink.write('before the report\n')
+        with create_and_prepare_file('csv', sink) as rep_file:
+            rep_file.add(self.users)
+        self.assertEqual(sink.buffer.getvalue().decode('UTF-8').splitlines()[:2],
+                         ['before the report', 'first_name,last_name,country,city,birth_date,sex'])
+        with self.assertRaises(ValueError):
+            create_and_prepare_file('csv', io.StringIO())         # text stream without binary buffer
+
+    def test_file_descriptor(self):
+        with tempfile.TemporaryFile() as temporary_file:
+            with create_and_prepare_file('json', temporary_file.fileno()) as rep_file:
+                rep_file.add(self.users)
+            os.lseek(temporary_file.fileno(), 0, os.SEEK_SET)       # the descriptor is not closed
+            self.assertEqual(len(json.loads(os.read(temporary_file.fileno(), 1 << 16))), 3)
+
+    def test_gzip_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'report')
+            with create_and_prepare_file('tsv', path, compression='gzip') as rep_file:
+                rep_file.add(self.users)
+                with self.assertRaises(ValueError):
+                    rep_file.commit()                               # compressed files can not be resumed
+            self.assertEqual(get_report_file_name(path, 'tsv', 'gzip'), f'{path}.tsv.gz')
+            with gzip.open(f'{path}.tsv.gz', 'rt', encoding='UTF-8') as r_f:
+                self.assertEqual(len(r_f.readlines()), 1 + 3)
+            with self.assertRaises(ValueError):
+                create_and_prepare_file('tsv', path, resume_position=10, compression='gzip')
+            with self.assertRaises(ValueError):
+                create_and_prepare_file('tsv', path, compression='lzma')
+
+    @unittest.skipUnless('zstd' in available_compressions, 'zstandard is not installed')
+    def test_zstd_stream(self):
+        import zstandard
+
+        sink = io.BytesIO()
+        with create_and_prepare_file('csv', sink, compression='zstd') as rep_file:
+            rep_file.add(self.users)
+        content = zstandard.ZstdDecompressor().decompressobj().decompress(sink.getvalue())
+        self.assertEqual(len(content.decode('UTF-8').splitlines()), 1 + 3)
+
+    def test_report_to_compressed_stream(self):
+        sink = io.BytesIO()
+        with FakeVkServer(number_of_friends=2500) as server:
+            create_and_fill_vk_friends_report('token', '1', 'csv', sink, api_url=server.url,
+                                              rate_limiter=RateLimiter(1000), resume=True, compression='gzip')
+        self.assertEqual(len(gzip.decompress(sink.getvalue()).splitlines()), 1 + 2500 - 25)
+
+
+class TestSqliteReportFile(unittest.TestCase):
+    users = [User(first_name=f'Имя{number}', last_name='Фамилия', country='Россия', city=f'Город{number % 2}',
+                  birth_date=('1990-03-15', '04-17', None)[number % 3], sex='Female') for number in range(5)]
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'report')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def query(self, sql: str, parameters: tuple = ()) -> list[tuple]:
+        import sqlite3
+
+        connection = sqlite3.connect(f'{self.path}.sqlite')
+        try:
+            return connection.execute(sql, parameters).fetchall()
+        finally:
+            connection.close()
+
+    def test_filling_database(self):
+        with create_and_prepare_file('sqlite', self.path, owner_id='1') as rep_file:
+            rep_file.add(self.users[:2])
+            rep_file.add(UserStore(self.users[2:]))
+        with create_and_prepare_file('sqlite', self.path, owner_id='2') as rep_file:
+            rep_file.add(self.users[:1])
+        self.assertEqual(self.query('SELECT first_name, city, birth_date, birth_month, birth_day FROM friends '
+                                    'WHERE owner_id = ? ORDER BY position', ('1',))[:3],
+                         [('Имя0', 'Город0', '1990-03-15', 3, 15), ('Имя1', 'Город1', '04-17', 4, 17),
+                          ('Имя2', 'Город0', None, None, None)])
+        self.assertEqual(self.query('SELECT owner_id, count(*) FROM friends GROUP BY owner_id'), [('1', 5), ('2', 1)])
+        self.assertEqual({name for name, in self.query("SELECT name FROM sqlite_master WHERE type = 'index' "
+                                                       "AND name LIKE 'friends_%'")}, set(SqliteReportFile._indexes))
+        self.assertEqual(self.query('PRAGMA journal_mode'), [('wal',)])
+        self.assertIn('friends_city', str(self.query('EXPLAIN QUERY PLAN SELECT * FROM friends WHERE city = ?',
+                                                     ('Город1',))))
+
+        with create_and_prepare_file('sqlite', self.path, owner_id='1') as rep_file:      # replaces the report
+            rep_file.add(self.users[4:])
+        self.assertEqual(self.query('SELECT owner_id, count(*) FROM friends GROUP BY owner_id'), [('1', 1), ('2', 1)])
+
+    def test_resume(self):
+        rep_file = SqliteReportFile(self.path, owner_id='1')
+        rep_file.add(self.users[:2])
+        position = rep_file.commit()
+        rep_file.add(self.users[2:3])           # the checkpoint is not saved, must be removed
+        rep_file.close()
+        with SqliteReportFile(self.path, resume_position=position, owner_id='1') as rep_file:
+            rep_file.add(self.users[3:])
+        self.assertEqual(self.query('SELECT position, first_name FROM friends ORDER BY position'),
+                         [(0, 'Имя0'), (1, 'Имя1'), (2, 'Имя3'), (3, 'Имя4')])
+
+    def test_checkpoint_position_is_number_of_friends(self):
+        with SqliteReportFile(self.path, owner_id='1') as rep_file:
+            rep_file.add(self.users[:2])
+            position = rep_file.commit()
+        write_checkpoint('1', 'sqlite', self.path, 1000, next_offset=1000, position=position)
+        self.assertIsNotNone(read_checkpoint('1', 'sqlite', self.path, 1000))
+        write_checkpoint('1', 'sqlite', self.path, 1000, next_offset=2000, position=position + 1)
+        self.assertIsNone(read_checkpoint('1', 'sqlite', self.path, 1000))      # friends are not in the database
+        write_checkpoint('2', 'sqlite', self.path, 1000, next_offset=1000, position=1)
+        self.assertIsNone(read_checkpoint('2', 'sqlite', self.path, 1000))      # there are no friends of user 2
+
+    def test_streams_and_compression_are_rejected(self):
+        with self.assertRaises(ValueError):
+            SqliteReportFile(io.BytesIO())
+        with self.assertRaises(ValueError):
+            SqliteReportFile(self.path, compression='gzip')
+
+
+class TestReportFields(unittest.TestCase):
+    vk_fields = {'sex', 'bdate', 'city', 'country', 'domain', 'last_seen', 'education'}
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'report')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_check_report_fields(self):
+        self.assertEqual(check_report_fields('id, first_name,domain'), ('id', 'first_name', 'domain'))
+        self.assertEqual(check_report_fields(['sex']), ('sex',))
+        for fields in ('', 'phone', ('id', 'id')):
+            with self.subTest(fields=fields), self.assertRaises(ValueError):
+                check_report_fields(fields)
+
+    def test_vk_fields(self):
+        self.assertEqual(get_vk_fields(User.user_fields()), 'sex, bdate, city, country')      # as before projections
+        self.assertEqual(get_vk_fields(('id', 'first_name')), 'sex')
+        self.assertEqual(get_vk_fields(('graduation', 'education', 'domain')), 'domain, education')
+
+    def test_projection(self):
+        vk_data = {'response': {'count': 5, 'items': [make_fake_friend(number, self.vk_fields)
+                                                      for number in range(4)]}}
+        vk_resp_data = VkResponseData(vk_data, ('id', 'domain', 'last_seen', 'education', 'graduation'))
+        self.assertEqual(vk_resp_data.list_of_users[:2],
+                         [(100000, 'id100000', '2023-11-14T22:13:20', 'University0', 2000),
+                          (100001, 'name1', '2023-11-14T23:13:20', None, None)])
+        self.assertEqual(list(vk_resp_data.columns), ['id', 'domain', 'last_seen', 'education', 'graduation'])
+        self.assertEqual(VkResponseData(vk_data, ('city',)).list_of_users, [(None,), ('City1',), ('City2',),
+                                                                            ('City3',)])
+
+    def test_report_files(self):
+        fields = ('id', 'first_name', 'birth_date', 'graduation')
+        users = [(1, 'Ирина', '1990-03-15', 2012), (2, 'Денис', '04-17', None)]
+        for format_report_file in ('csv', 'json', 'ndjson', 'sqlite', 'parquet'):
+            with create_and_prepare_file(format_report_file, self.path, fields=fields, owner_id='1') as rep_file:
+                rep_file.add(users)
+        with open(f'{self.path}.csv', 'r', encoding='UTF-8') as r_f:
+            self.assertEqual(r_f.read().splitlines(), ['id,first_name,birth_date,graduation',
+                                                       '1,Ирина,1990-03-15,2012', '2,Денис,04-17,'])
+        with open(f'{self.path}.json', 'r', encoding='UTF-8') as r_f:
+            self.assertEqual(json.load(r_f), [dict(zip(fields, user)) for user in users])
+
+        import sqlite3
+        connection = sqlite3.connect(f'{self.path}.sqlite')
+        self.assertEqual(connection.execute('SELECT id, first_name, birth_month, graduation FROM friends').fetchall(),
+                         [(1, 'Ирина', 3, 2012), (2, 'Денис', 4, None)])
+        self.assertEqual([name for name, in connection.execute("SELECT name FROM sqlite_master WHERE type = 'index' "
+                                                               "AND name LIKE 'friends_%'")], ['friends_birth_month'])
+        connection.close()
+        with create_and_prepare_file('sqlite', self.path, owner_id='2') as rep_file:      # other fields, one table
+            rep_file.add([User(first_name='Никита', last_name='Ηикитин', country=None, city='Москва',
+                               birth_date=None, sex='Male')])
+        connection = sqlite3.connect(f'{self.path}.sqlite')
+        self.assertEqual(connection.execute('SELECT owner_id, id, city FROM friends ORDER BY owner_id').fetchall(),
+                         [('1', 1, None), ('1', 2, None), ('2', None, 'Москва')])
+        connection.close()
+
+        import pyarrow
+        import pyarrow.parquet
+        table = pyarrow.parquet.read_table(f'{self.path}.parquet')
+        self.assertEqual(table.column_names, ['id', 'first_name', 'birth_date', 'birth_month', 'birth_day',
+                                              'graduation'])
+        self.assertEqual(table.schema.field('graduation').type, pyarrow.int64())
+        self.assertEqual(table.column('graduation').to_pylist(), [2012, None])
+
+    def test_report_with_projection(self):
+        counters = {}
+        for fields in (User.user_fields(), ('id', 'first_name', 'domain')):
+            METRICS.reset()
+            with FakeVkServer(number_of_friends=1200) as server:
+                create_and_fill_vk_friends_report('token', '1', 'csv', self.path, api_url=server.url,
+                                                  rate_limiter=RateLimiter(1000), fields=','.join(fields))
+            counters[fields] = METRICS.get_dict()['counters']['vk_received_bytes_total{method="friends.get"}']
+        with open(f'{self.path}.csv', 'r', encoding='UTF-8') as r_f:
+            lines = r_f.read().splitlines()
+        self.assertEqual(lines[:2], ['id,first_name,domain', '100000,Name0000000,id100000'])
+        self.assertEqual(len(lines), 1 + 1200 - 12)
+        self.assertLess(counters[('id', 'first_name', 'domain')], counters[User.user_fields()] * 0.8)
+
+    def test_checkpoint_of_other_fields_is_ignored(self):
+        with open(f'{self.path}.csv', 'w', encoding='UTF-8') as w_f:
+            w_f.write('first_name\n')
+        write_checkpoint('1', 'csv', self.path, 1000, next_offset=1000, position=11, fields=('first_name',))
+        self.assertIsNotNone(read_checkpoint('1', 'csv', self.path, 1000, ('first_name',)))
+        self.assertIsNone(read_checkpoint('1', 'csv', self.path, 1000, ('first_name', 'domain')))
+        self.assertIsNone(read_checkpoint('1', 'csv', self.path, 1000))
+
+    def test_every_field_is_parsed(self):
+        vk_data = {'response': {'count': 3, 'items': [make_fake_friend(number, self.vk_fields)
+                                                      for number in range(3)]}}
+        for field in report_fields:
+            with self.subTest(field=field):
+                self.assertEqual(len(VkResponseData(vk_data, (field,)).columns[field]), 3)
+
+
+class TestJsonDecoding(unittest.TestCase):
+    vk_data = {'response': {'count': 250, 'items': [make_fake_friend(number) for number in range(250)]}}
+
+    def test_decode_json(self):
+        body = json.dumps(self.vk_data, ensure_ascii=False).encode('UTF-8')
+        self.assertEqual(decode_json(body), self.vk_data)
+        with mock.patch('services.orjson', None):           # orjson is not installed
+            self.assertEqual(decode_json(body), self.vk_data)
+            with self.assertRaises(ValueError):
+                decode_json(b'{"response": ')
+        with self.assertRaises(ValueError):
+            decode_json(b'{"response": ')
+
+    def test_iter_json_items(self):
+        items = self.vk_data['response']['items']
+        for body in (json.dumps(self.vk_data, ensure_ascii=False).encode('UTF-8'),
+                     json.dumps(self.vk_data, separators=(',', ':')),
+                     json.dumps({'response': {'items': items, 'count': 250}, 'extra': [1, {'items': []}]}, indent=2),
+                     json.dumps({'meta': {'items': [1]}, 'response': {'count': 250, 'items': items}})):
+            with self.subTest(body=body[:30]):
+                self.assertEqual(list(iter_json_items(body)), items)
+        self.assertEqual(list(iter_json_items(b'{"response": {"count": 0, "items": [ ]}}')), [])
+        for body in (b'{"error": {"error_code": 30}}', b'{"response": {"count": 1, "items": [{"id": 1},',
+                     b'{"response": {"count": 1, "items": [{"id": 1} {"id": 2}]}}', b'[]', b''):
+            with self.subTest(body=body), self.assertRaises(ValueError):
+                list(iter_json_items(body))
+
+    def test_is_vk_response_body(self):
+        self.assertTrue(is_vk_response_body(b'{"response": {"count": 0, "items": []}}\n'))
+        self.assertTrue(is_vk_response_body(b' {\n "response":{"count":0,"items":[]}}'))
+        self.assertFalse(is_vk_response_body(b'{"error": {"error_code": 6}}'))
+        self.assertFalse(is_vk_response_body(b'{"response": {"count": 1, "items": [{"id": 1}'))      # truncated
+        self.assertFalse(is_vk_response_body(b'{"response": {"count": 1, "items": [{"id": 1}]'))
+
+    def test_response_data_of_body(self):
+        fields = tuple(report_fields)
+        vk_data = {'response': {'count': 250, 'items': [make_fake_friend(number, TestReportFields.vk_fields)
+                                                        for number in range(250)]}}
+        body = json.dumps(vk_data, ensure_ascii=False).encode('UTF-8')
+        with mock.patch.object(VkResponseData, 'stream_batch_size', 7):
+            streamed = VkResponseData(body, fields)
+        expected = VkResponseData(vk_data, fields)
+        self.assertEqual(streamed.list_of_users, expected.list_of_users)
+        self.assertEqual(streamed.ids, expected.ids)
+        self.assertEqual(len(streamed.list_of_users), 250 - 2)          # deactivated friends are skipped
+        self.assertEqual(VkResponseData(json.dumps(self.vk_data)).list_of_users,
+                         VkResponseData(self.vk_data).list_of_users)
+
+    def test_parser_returns_bodies(self):
+        with FakeVkServer(number_of_friends=1500, requests_per_second=5) as server:
+            parser = VkFriendsParser('token', '1', rate_limiter=RateLimiter(1000), api_url=server.url,
+                                     retry_policy=RetryPolicy(attempts=20, base_delay=0.05, max_delay=0.2),
+                                     stream_items=True)
+            pages = [parser.get_info_about_friends(offset=offset, count=100) for offset in range(0, 1500, 100)]
+        self.assertGreater(server.number_of_throttled_requests, 0)          # errors are decoded and retried
+        self.assertTrue(all(isinstance(page, bytes) for page in pages))
+        self.assertEqual(sum(len(VkResponseData(page).list_of_users) for page in pages), 1500 - 15)
+
+        with FakeVkServer(number_of_friends=100, private_user_ids=(1,)) as server:
+            parser = VkFriendsParser('token', '1', rate_limiter=RateLimiter(1000), api_url=server.url,
+                                     stream_items=True)
+            with self.assertRaises(VkApiError) as context:
+                parser.get_info_about_friends(offset=0, count=10)
+        self.assertEqual(context.exception.error_code, 30)
+
+    def test_streamed_report(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        reports = []
+        with FakeVkServer(number_of_friends=2500) as server:
+            for name, kwargs in (('dicts', {}), ('bodies', {'stream_items': True}),
+                                 ('bodies_by_processes', {'stream_items': True, 'parse_processes': 2})):
+                path = os.path.join(directory.name, name)
+                create_and_fill_vk_friends_report('token', '1', 'csv', path, api_url=server.url,
+                                                  rate_limiter=RateLimiter(1000), **kwargs)
+                with open(f'{path}.csv', 'r', encoding='UTF-8') as r_f:
+                    reports.append(r_f.read())
+        self.assertEqual(len(reports[0].splitlines()), 1 + 2500 - 25)
+        self.assertEqual(reports[1], reports[0])
+        self.assertEqual(reports[2], reports[0])
+
+
+class TestUserStore(unittest.TestCase):
+    users = [User(first_name='Ирина', last_name='Γригорьева', country='Россия', city='Екатеринбург',
+                  birth_date='04-17', sex='Female'),
+             User(first_name='Денис', last_name='Креев', country='Россия', city='Москва',
+                  birth_date=None, sex='Male'),
+             User(first_name='Никита', last_name='Ηикитин', country=None, city=None,
+                  birth_date='1971-03-20', sex='Male')]
+
+    def test_views(self):
+        store = UserStore(self.users[:2])
+        store.append(self.users[2])
+        self.assertEqual(len(store), 3)
+        self.assertEqual(list(store), self.users)
+        self.assertEqual(self.users, list(store))
+        self.assertEqual(list(store.rows()), [tuple(user) for user in self.users])
+        self.assertEqual(store[-1].birth_date, '1971-03-20')
+        self.assertEqual(store[1].city, 'Москва')
+        self.assertEqual(store[0].get_dict(), self.users[0].get_dict())
+        self.assertEqual(store[0].to_user(), self.users[0])
+        with self.assertRaises(IndexError):
+            store[3]
+
+    def test_values_are_interned(self):
+        store = UserStore()
+        store.add_columns({'first_name': ['a', 'b'], 'last_name': ['c', 'd'], 'country': ['Россия', 'Россия'],
+                           'city': [None, 'Уфа'], 'birth_date': [None, None], 'sex': ['Male', 'Male']})
+        self.assertEqual(store._values['country'], [None, 'Россия'])
+        self.assertEqual(list(store._columns['country']), [1, 1])
+
+    def test_report_files_accept_store(self):
+        store = UserStore(self.users)
+        for format_file in ('csv', 'json', 'ndjson'):
+            with create_and_prepare_file(format_file, 'temp_for_test') as rep_file:
+                rep_file.add(store)
+            with open(f'temp_for_test.{format_file}', 'r', encoding='UTF-8') as r_f:
+                content_from_store = r_f.read()
+            with create_and_prepare_file(format_file, 'temp_for_test') as rep_file:
+                rep_file.add(self.users)
+            with open(f'temp_for_test.{format_file}', 'r', encoding='UTF-8') as r_f:
+                content_from_list = r_f.read()
+            os.remove(f'temp_for_test.{format_file}')
+            self.assertEqual(content_from_store, content_from_list)
+
+    def test_projected_report_from_store(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'report')
+            with create_and_prepare_file('csv', path, fields=('city', 'first_name')) as rep_file:
+                rep_file.add(UserStore(self.users))
+            with open(f'{path}.csv', 'r', encoding='UTF-8') as r_f:
+                self.assertEqual(r_f.read().splitlines(), ['city,first_name', 'Екатеринбург,Ирина', 'Москва,Денис',
+                                                           ',Никита'])
+            with create_and_prepare_file('csv', path, fields=('id', 'city')) as rep_file:
+                with self.assertRaises(ValueError):                 # the store has no ids
+                    rep_file.add(UserStore(self.users))
+
+
 class TestUser(unittest.TestCase):
     def test_user_to_dict(self):
         test_user = User(first_name='Ирина', last_name='Γригорьева', country='Россия', city='Екатеринбург',
@@ -176,6 +785,310 @@ class TestUser(unittest.TestCase):
                          "city": "Екатеринбург", "birth_date": "04-17", "sex": "Female"}
         self.assertEqual(test_user_dict, expected_dict)
 
+    def test_user_eq(self):
+        test_user = User(first_name='Ирина', last_name='Γригорьева', country='Россия', city='Екатеринбург',
+                         birth_date='04-17', sex='Female')
+        self.assertEqual(test_user, test_user._replace())
+        self.assertNotEqual(test_user, test_user._replace(city=None))
+        self.assertFalse(test_user == tuple(test_user))
+
+
+class TestRateLimiter(unittest.TestCase):
+    def test_first_request_without_waiting(self):
+        rate_limiter = RateLimiter(requests_per_second=3)
+        self.assertEqual(rate_limiter.reserve(), 0.0)
+
+    def test_requests_are_spaced(self):
+        rate_limiter = RateLimiter(requests_per_second=4)
+        delays = [rate_limiter.reserve() for _ in range(4)]
+        self.assertEqual(delays[0], 0.0)
+        for previous_delay, delay in zip(delays, delays[1:]):
+            self.assertAlmostEqual(delay - previous_delay, 0.25, places=2)
+
+    def test_burst(self):
+        rate_limiter = RateLimiter(requests_per_second=2, burst=3)
+        self.assertEqual([rate_limiter.reserve() for _ in range(3)], [0.0, 0.0, 0.0])
+        self.assertGreater(rate_limiter.reserve(), 0.0)
+
+
+class TestAdaptiveRateLimiter(unittest.TestCase):
+    def test_speed_changes(self):
+        rate_limiter = AdaptiveRateLimiter(4, min_requests_per_second=1, max_requests_per_second=5, increase=0.5)
+        rate_limiter.on_throttle()
+        self.assertEqual(rate_limiter.requests_per_second, 2)
+        for _ in range(3):
+            rate_limiter.on_throttle()
+        self.assertEqual(rate_limiter.requests_per_second, 1)
+        for _ in range(10):
+            rate_limiter.on_success()
+        self.assertEqual(rate_limiter.requests_per_second, 5)
+
+
+class TestTokenPool(unittest.TestCase):
+    def test_parse_access_tokens(self):
+        self.assertEqual(parse_access_tokens('a1, b2\n# comment c3\n\nc3 a1\n'), ['a1', 'b2', 'c3'])
+        self.assertEqual(parse_access_tokens(' '), [])
+
+    def test_read_access_tokens(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'tokens.txt')
+            with open(path, 'w', encoding='UTF-8') as w_f:
+                w_f.write('a1\nb2\n')
+            self.assertEqual(read_access_tokens(path), ['a1', 'b2'])
+        with mock.patch.dict(os.environ, {'ACCESS_TOKENS': 'a1,b2', 'ACCESS_TOKEN': 'c3'}):
+            self.assertEqual(read_access_tokens(), ['a1', 'b2'])
+        with mock.patch.dict(os.environ, {'ACCESS_TOKENS': '', 'ACCESS_TOKEN': 'c3'}):
+            self.assertEqual(read_access_tokens(), ['c3'])
+
+    def test_requests_go_to_tokens_with_capacity(self):
+        pool = TokenPool(['a1', 'b2', 'c3'], requests_per_second=1)
+        acquired = [pool.acquire() for _ in range(3)]
+        self.assertEqual([token.access_token for token, _ in acquired], ['a1', 'b2', 'c3'])
+        self.assertEqual([waiting_time for _, waiting_time in acquired], [0.0, 0.0, 0.0])
+        self.assertEqual(len(pool), 3)
+        with self.assertRaises(ValueError):
+            TokenPool([])
+
+    def test_sidelined_tokens(self):
+        pool = TokenPool(['a1', 'b2'], requests_per_second=1000, throttle_sideline=0.2, error_sideline=60)
+        first, second = pool.tokens
+        pool.on_throttle(first)
+        self.assertEqual({pool.acquire()[0].access_token for _ in range(5)}, {'b2'})
+        sleep(0.25)
+        self.assertTrue(pool.on_token_error(second, 5))                 # there is another token to retry with
+        self.assertEqual({pool.acquire()[0].access_token for _ in range(5)}, {'a1'})
+        self.assertFalse(pool.on_token_error(first, 5))                 # all tokens are sidelined
+        self.assertEqual(pool.acquire()[0].access_token, 'b2')          # the one released first is still used
+        self.assertFalse(TokenPool(['a1']).on_token_error(TokenPool(['a1']).tokens[0], 5))
+
+    def test_throughput_grows_with_tokens(self):
+        times = {}
+        for number_of_tokens in (1, 4):
+            pool = TokenPool([f'token{number}' for number in range(number_of_tokens)], requests_per_second=20)
+            with FakeVkServer(number_of_friends=1000, requests_per_second=25) as server:
+                start = monotonic()
+                create_and_fill_vk_friends_report(pool, '1', 'csv', os.devnull, workers=4, api_url=server.url,
+                                                  friends_per_request=40)
+                times[number_of_tokens] = monotonic() - start
+            self.assertEqual(server.number_of_throttled_requests, 0)      # every token keeps to its own limit
+            self.assertEqual(len(server.requests_by_token), number_of_tokens)
+        self.assertLess(times[4], times[1] / 2)
+
+    def test_rejected_token_is_sidelined(self):
+        METRICS.reset()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, 'report')
+        with FakeVkServer(number_of_friends=2500, rejected_tokens=('bad',)) as server:
+            create_and_fill_vk_friends_report(TokenPool(['bad', 'good'], requests_per_second=1000), '1', 'csv', path,
+                                              api_url=server.url)
+        self.assertEqual(server.requests_by_token['bad'], 1)            # retried with the good token at once
+        self.assertEqual(server.requests_by_token['good'], 1 + 3)
+        self.assertEqual(METRICS.get_dict()['counters']['vk_token_sidelined_total{reason="error",token="1"}'], 1)
+        with open(f'{path}.csv', 'r', encoding='UTF-8') as r_f:
+            self.assertEqual(len(r_f.readlines()), 1 + 2500 - 25)
+
+        with FakeVkServer(number_of_friends=100, rejected_tokens=('bad',)) as server:
+            rate_limiter = AdaptiveRateLimiter(1000, max_requests_per_second=2000)
+            parser = VkFriendsParser('bad', '1', rate_limiter=rate_limiter, api_url=server.url)
+            with self.assertRaises(VkApiError) as context:          # one token: the error is not retried
+                parser.get_info_about_friends(offset=0, count=10)
+        self.assertEqual(context.exception.error_code, 5)
+        self.assertEqual(rate_limiter.requests_per_second, 1000)   # the rejected request is not a success
+        self.assertEqual(server.number_of_requests, 1)
+
+
+class TestRetryPolicy(unittest.TestCase):
+    def test_delays(self):
+        retry_policy = RetryPolicy(base_delay=1, max_delay=5)
+        for retry_number, max_delay in ((0, 1), (1, 2), (2, 4), (3, 5), (10, 5)):
+            for _ in range(20):
+                self.assertTrue(0 <= retry_policy.get_delay(retry_number) <= max_delay)
+
+    def test_retryable_errors(self):
+        retry_policy = RetryPolicy()
+        self.assertEqual(retry_policy.get_retryable_error_code({'error': {'error_code': 6}}), 6)
+        self.assertIsNone(retry_policy.get_retryable_error_code({'error': {'error_code': 30}}))
+        self.assertIsNone(retry_policy.get_retryable_error_code({'response': {'count': 0, 'items': []}}))
+        execute_result = {'response': [False], 'execute_errors': [{'method': 'friends.get', 'error_code': 9}]}
+        self.assertEqual(retry_policy.get_retryable_error_code(execute_result), 9)
+
+
+class FakeParser:
+    """
+    Returns chunks with a delay that is bigger for smaller offsets, so chunks are ready in reverse order
+    """
+    def get_info_about_friends(self, offset: int, count: int) -> dict:
+        sleep(0.01 * (5 - offset // count))
+        return {'response': {'count': 5 * count, 'items': [offset]}}
+
+
+class TestFetchPagesOfFriends(unittest.TestCase):
+    def test_sequential(self):
+        pages = list(fetch_pages_of_friends(FakeParser(), [0, 10, 20], count=10))
+        self.assertEqual([page['response']['items'] for page in pages], [[0], [10], [20]])
+
+    def test_concurrent_pages_in_offset_order(self):
+        offsets = [0, 10, 20, 30, 40]
+        pages = list(fetch_pages_of_friends(FakeParser(), offsets, count=10, workers=5))
+        self.assertEqual([page['response']['items'][0] for page in pages], offsets)
+
+
+class ListReportFile:
+    """
+    Report "file" collecting chunks in a list (for pipeline tests)
+    """
+    def __init__(self, delay: float = 0):
+        self.chunks = []
+        self.delay = delay
+
+    def add(self, list_of_users):
+        sleep(self.delay)
+        self.chunks.append(list_of_users)
+
+
+def make_pages(number_of_pages: int, produced: list | None = None):
+    for number in range(number_of_pages):
+        if produced is not None:
+            produced.append(number)
+        yield {'response': {'count': number_of_pages, 'items': [make_fake_friend(number)]}}
+
+
+class FakeFriendsParser(FakeParser):
+    def get_info_about_friends(self, offset: int, count: int) -> dict:
+        page = super().get_info_about_friends(offset, count)
+        page['response']['items'] = [make_fake_friend(offset)]
+        return page
+
+
+class TestRunReportPipeline(unittest.TestCase):
+    def test_chunks_in_order(self):
+        report_file = ListReportFile()
+        written = []
+        timers = run_report_pipeline(fetch_pages_of_friends(FakeFriendsParser(), [0, 10, 20, 30, 40], count=10,
+                                                            workers=5),
+                                     report_file, on_chunk_written=written.append)
+        self.assertEqual([chunk[0].first_name for chunk in report_file.chunks],
+                         [f'Name{offset:07d}' for offset in (0, 10, 20, 30, 40)])
+        self.assertEqual(written, [0, 1, 2, 3, 4])
+        self.assertEqual([timer.items for timer in timers.values()], [5, 5, 5])
+
+    def test_backpressure(self):
+        produced, chunks_ahead = [], []
+        report_file = ListReportFile(delay=0.01)
+        run_report_pipeline(make_pages(30, produced), report_file, queue_size=2,
+                            on_chunk_written=lambda chunk_index: chunks_ahead.append(len(produced) - chunk_index))
+        self.assertEqual(len(report_file.chunks), 30)
+        self.assertLessEqual(max(chunks_ahead), 2 * 2 + 3)     # two queues, parse and fetch stages, written chunk
+
+    def test_error_stops_pipeline(self):
+        def pages():
+            yield from make_pages(3)
+            raise VkApiError('Too many requests per second', 6)
+
+        report_file = ListReportFile()
+        with self.assertRaises(VkApiError):
+            run_report_pipeline(pages(), report_file)
+        self.assertEqual(len(report_file.chunks), 3)
+        with self.assertRaises(ValueError):
+            run_report_pipeline([{'response': {}}], report_file)
+
+    def test_stopped_parse_stage(self):
+        with mock.patch('services.parse_page', side_effect=SystemExit):
+            with self.assertRaises(SystemExit):     # the writer does not wait for chunks forever
+                run_report_pipeline(make_pages(3), ListReportFile())
+        with mock.patch('services.ProcessPoolExecutor.submit', side_effect=BrokenProcessPool):
+            with self.assertRaises(BrokenProcessPool):
+                run_report_pipeline(make_pages(3), ListReportFile(), parse_processes=1)
+
+    def test_parse_processes(self):
+        report_file, process_report_file = ListReportFile(), ListReportFile()
+        run_report_pipeline(make_pages(10), report_file)
+        run_report_pipeline(make_pages(10), process_report_file, parse_processes=2)
+        self.assertEqual(process_report_file.chunks, report_file.chunks)
+
+
+class TestVkFriendsParser(unittest.TestCase):
+    def test_requests_through_one_connection(self):
+        with FakeVkServer(number_of_friends=1500) as server:
+            parser = VkFriendsParser('token', '1', rate_limiter=RateLimiter(1000), api_url=server.url)
+            self.assertEqual(parser.get_number_of_friends(), 1500)
+            pages = [parser.get_info_about_friends(offset=offset, count=1000) for offset in (0, 1000)]
+        self.assertEqual([len(page['response']['items']) for page in pages], [1000, 500])
+        self.assertEqual(server.number_of_requests, 3)
+        self.assertEqual(server.number_of_connections, 1)
+
+    def test_get_pages_with_execute(self):
+        with FakeVkServer(number_of_friends=1500) as server:
+            parser = VkFriendsParser('token', '1', rate_limiter=RateLimiter(1000), api_url=server.url)
+            pages = parser.get_pages_with_execute([0, 1000], count=1000)
+            expected_pages = [server.friends_get({'fields': '', 'offset': offset, 'count': 1000})
+                              for offset in (0, 1000)]
+        self.assertEqual(pages, expected_pages)
+        self.assertEqual(server.number_of_requests, 1)
+
+    def test_fetch_pages_with_execute(self):
+        with FakeVkServer(number_of_friends=2500) as server:
+            parser = VkFriendsParser('token', '1', rate_limiter=RateLimiter(1000), api_url=server.url)
+            pages = list(fetch_pages_of_friends_with_execute(parser, count=1000, pages_per_execute=2))
+        self.assertEqual([len(page['response']['items']) for page in pages], [1000, 1000, 500])
+        self.assertEqual(server.number_of_requests, 2)
+
+    def test_retry_server_errors(self):
+        with FakeVkServer(number_of_friends=2500, server_error_every=2) as server:
+            parser = VkFriendsParser('token', '1', rate_limiter=RateLimiter(1000), api_url=server.url,
+                                     retry_policy=RetryPolicy(base_delay=0.01))
+            pages = [parser.get_info_about_friends(offset=offset, count=1000) for offset in (0, 1000, 2000)]
+        self.assertEqual([len(page['response']['items']) for page in pages], [1000, 1000, 500])
+        self.assertEqual(server.number_of_server_errors, 2)
+
+    def test_adaptive_throttling(self):
+        rate_limiter = AdaptiveRateLimiter(100, min_requests_per_second=1)
+        with FakeVkServer(number_of_friends=100, requests_per_second=5) as server:
+            parser = VkFriendsParser('token', '1', rate_limiter=rate_limiter, api_url=server.url,
+                                     retry_policy=RetryPolicy(attempts=10, base_delay=0.05))
+            pages = [parser.get_info_about_friends(offset=offset, count=10) for offset in range(0, 100, 10)]
+        self.assertEqual(sum(len(page['response']['items']) for page in pages), 100)
+        self.assertGreater(server.number_of_throttled_requests, 0)
+        self.assertLess(rate_limiter.requests_per_second, 100)
+
+    def test_not_retryable_error(self):
+        with FakeVkServer(number_of_friends=100, private_user_ids=(1,)) as server:
+            parser = VkFriendsParser('token', '1', rate_limiter=RateLimiter(1000), api_url=server.url)
+            with self.assertRaises(VkApiError) as context:
+                parser.get_info_about_friends(offset=0, count=10)
+        self.assertEqual(context.exception.error_code, 30)
+        self.assertEqual(server.number_of_requests, 1)
+
+    def test_retry_malformed_bodies(self):
+        with FakeVkServer(number_of_friends=100, malformed_body_every=2) as server:
+            parser = VkFriendsParser('token', '1', rate_limiter=RateLimiter(1000), api_url=server.url,
+                                     retry_policy=RetryPolicy(base_delay=0.01))
+            pages = [parser.get_info_about_friends(offset=offset, count=40) for offset in (0, 40, 80)]
+        self.assertEqual([len(page['response']['items']) for page in pages], [40, 40, 20])
+        self.assertEqual(server.number_of_malformed_bodies, 2)      # "null" and "[]" are retried
+
+        with FakeVkServer(number_of_friends=100, malformed_body_every=1) as server:
+            parser = VkFriendsParser('token', '1', rate_limiter=RateLimiter(1000), api_url=server.url,
+                                     retry_policy=RetryPolicy(attempts=3, base_delay=0.01))
+            with self.assertRaises(VkApiError):
+                parser.get_number_of_friends()
+        self.assertEqual(server.number_of_requests, 3)
+
+    def test_retries_are_limited(self):
+        with FakeVkServer(number_of_friends=100, server_error_every=1) as server:
+            parser = VkFriendsParser('token', '1', rate_limiter=RateLimiter(1000), api_url=server.url,
+                                     retry_policy=RetryPolicy(attempts=3, base_delay=0.01))
+            with self.assertRaises(VkApiError):
+                parser.get_number_of_friends()
+        self.assertEqual(server.number_of_requests, 3)
+
+    def test_fetch_pages_with_execute_without_friends(self):
+        with FakeVkServer(number_of_friends=0) as server:
+            parser = VkFriendsParser('token', '1', rate_limiter=RateLimiter(1000), api_url=server.url)
+            pages = list(fetch_pages_of_friends_with_execute(parser, count=1000))
+        self.assertEqual(pages, [{'response': {'count': 0, 'items': []}}])
+
 
 if __name__ == '__main__':
     unittest.main()